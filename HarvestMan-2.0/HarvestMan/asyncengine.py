@@ -0,0 +1,810 @@
+# -- coding: latin-1
+""" asyncengine.py - Module providing an asynchronous download
+    engine for HarvestMan. This is part of the HarvestMan program.
+
+    The engine is an alternative to the tracker threads. It
+    keeps the URLs to download in per-server queues and downloads
+    them using non-blocking sockets on a single asyncore event
+    loop, which allows for a large number of simultaneous
+    connections. The downloaded data is saved and parsed using
+    the same code as the threaded crawl, i.e the connector, data
+    manager, rules checker and page parser objects.
+
+    Only plain http URLs without a proxy or site authentication
+    are downloaded by the engine. Other URLs, and files which are
+    too large to be downloaded in one piece, are downloaded using
+    the regular (blocking) connector, in worker threads so that
+    the event loop is not blocked by them.
+"""
+
+__version__ = '2.0 b1'
+
+import asyncore
+import socket
+import heapq
+import time
+import sys
+import urlparse
+import urllib2
+import threading
+from Queue import Queue
+
+from connector import HarvestManUrlConnector
+from common.common import *
+
+class HarvestManAsyncResponse(object):
+    """ File like object holding the data read by an asynchronous
+    channel, which stands in for the object returned by
+    urllib2.urlopen(...) """
+
+    def __init__(self, url, status, reason, headers, blocks, error='', latency=0.0, elapsed=0.0):
+        self._url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        # Error message in case the download failed
+        self.error = error
+        # Time taken for the server to respond and
+        # time taken to read the data
+        self.latency = latency
+        self.elapsed = elapsed
+        # Blocks of data, reversed so that they
+        # can be popped from the end.
+        self._blocks = blocks[:]
+        self._blocks.reverse()
+
+    def geturl(self):
+        return self._url
+
+    def info(self):
+        return self.headers
+
+    def read(self, n=-1):
+
+        if not self._blocks:
+            return ''
+
+        block = self._blocks.pop()
+        if n>0 and len(block)>n:
+            self._blocks.append(block[n:])
+            block = block[:n]
+
+        return block
+
+    def close(self):
+        self._blocks = []
+
+class HarvestManAsyncConnector(HarvestManUrlConnector):
+    """ Connector which is handed the response read by the
+    asynchronous engine, instead of connecting by itself """
+
+    def __init__(self, response):
+        HarvestManUrlConnector.__init__(self)
+        self._response = response
+        # Timings of the channel, since opening
+        # the request here takes no time at all.
+        self._channeltimes = (response.latency, response.elapsed)
+        # No point in waiting, since there
+        # are no retries.
+        self._sleeptime = 0
+
+    def open_request(self, request):
+        """ Return the response read by the engine """
+
+        response, self._response = self._response, None
+        if response is None:
+            raise socket.error, 'Response already consumed'
+
+        if response.error:
+            raise socket.error, response.error
+
+        if response.status >= 300:
+            raise urllib2.HTTPError(response.geturl(), response.status,
+                                    response.reason, response.headers, None)
+
+        return response
+
+    def _update_server_info(self, urlobj):
+
+        self._latency = self._channeltimes[0]
+        HarvestManUrlConnector._update_server_info(self, urlobj)
+
+    def _update_server_throughput(self, urlobj, count):
+
+        self._elapsed = self._channeltimes[1]
+        HarvestManUrlConnector._update_server_throughput(self, urlobj, count)
+        
+    def connect(self, urltofetch, url_obj = None, fetchdata=True, retries=1, lastmodified=-1, etag=''):
+        """ Process the response for the passed url """
+
+        # The request was made by the engine,
+        # so it cannot be retried here.
+        return HarvestManUrlConnector.connect(self, urltofetch, url_obj, fetchdata, 0, lastmodified, etag)
+
+class HarvestManAsyncConnectorFactory(object):
+    """ Connector factory used during an asynchronous crawl. It
+    returns connectors for the responses read by the engine and
+    passes all other requests on to the regular connector factory """
+
+    def __init__(self, factory):
+        # The regular connector factory
+        self._factory = factory
+        # Responses read by the engine, indexed
+        # on the index of the url objects
+        self._responses = {}
+
+    def add_response(self, urlobj, response):
+        self._responses[urlobj.index] = response
+
+    def discard_response(self, urlobj):
+
+        try:
+            del self._responses[urlobj.index]
+        except KeyError:
+            pass
+
+    def get_factory(self):
+        """ Return the regular connector factory """
+
+        return self._factory
+
+    def push(self, connector):
+        self._factory.push(connector)
+
+    def create_connector(self, urlobj):
+
+        response = self._responses.pop(urlobj.index, None)
+        if response is None:
+            return self._factory.create_connector(urlobj)
+
+        return HarvestManAsyncConnector(response)
+
+    def remove_connector(self, conn):
+
+        if isinstance(conn, HarvestManAsyncConnector):
+            conn.release()
+        else:
+            self._factory.remove_connector(conn)
+
+class HarvestManAsyncChannel(asyncore.dispatcher):
+    """ Non-blocking HTTP/1.0 client channel, which
+    downloads the data of a single request """
+
+    # Size of blocks read from the socket
+    BLOCKSIZE = 1024*64
+
+    def __init__(self, engine, item, url, address, request):
+        asyncore.dispatcher.__init__(self, map=engine.get_map())
+        self._engine = engine
+        # Frontier item being downloaded
+        self.item = item
+        self.url = url
+        self._outbuf = request
+        # Data read before the end of headers
+        self._inbuf = ''
+        self._gotheaders = False
+        self._done = False
+        self.status = 0
+        self.reason = ''
+        self.headers = {}
+        self.blocks = []
+        self.length = 0
+        self.clength = -1
+        self.error = ''
+        # Flag set if the data exceeds maximum file size
+        self.toolarge = False
+        # Flag set if the rules prevent download of
+        # the data, as seen from the headers
+        self.rejected = False
+        # Time of the last socket activity
+        self.timestamp = time.time()
+        # Time taken for the server to respond
+        self.starttime = self.timestamp
+        self.latency = 0.0
+        # Reading is paused till this time
+        # if bandwidth is limited.
+        self._resume = 0.0
+        self._server = engine.get_server(url)
+
+        family, socktype, proto, canonname, sockaddr = address
+        try:
+            self.create_socket(family, socktype)
+            self.connect(sockaddr)
+        except socket.error, e:
+            self.error = str(e)
+            self.finish()
+
+    def readable(self):
+        return (self._resume == 0.0) or (time.time() >= self._resume)
+    
+    def writable(self):
+        return (not self.connected) or len(self._outbuf)>0
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+
+        sent = self.send(self._outbuf)
+        self._outbuf = self._outbuf[sent:]
+        self.timestamp = time.time()
+
+    def handle_read(self):
+
+        throttle = self._engine.get_throttle()
+        if throttle:
+            data = self.recv(min(self.BLOCKSIZE, throttle.get_blocksize()))
+        else:
+            data = self.recv(self.BLOCKSIZE)
+        if not data: return
+
+        self.timestamp = time.time()
+        if throttle:
+            # Stop reading from this channel till
+            # the bandwidth is available.
+            wait = throttle.reserve(self._server, len(data))
+            if wait > 0:
+                self._resume = self.timestamp + wait
+
+        if not self._gotheaders:
+            self._inbuf += data
+            index = self._inbuf.find('\r\n\r\n')
+            if index == -1:
+                index = self._inbuf.find('\n\n')
+                if index == -1: return
+                data = self._inbuf[index+2:]
+            else:
+                data = self._inbuf[index+4:]
+
+            if not self._parse_headers(self._inbuf[:index]):
+                return
+
+        if data:
+            self.blocks.append(data)
+            self.length += len(data)
+
+            if self.length > self._engine.get_maxsize():
+                self.toolarge = True
+                self.finish()
+            elif self.clength != -1 and self.length >= self.clength:
+                self.finish()
+
+    def _parse_headers(self, text):
+        """ Parse the status line and headers of the response """
+
+        self._gotheaders = True
+        self._inbuf = ''
+        self.latency = time.time() - self.starttime
+
+        lines = text.split('\n')
+        try:
+            parts = lines[0].split(None, 2)
+            self.status = int(parts[1])
+            self.reason = (parts[2:] or [''])[0].strip()
+        except (ValueError, IndexError):
+            self.error = 'Bad status line: %s' % lines[0].strip()
+            self.finish()
+            return False
+
+        for line in lines[1:]:
+            if line.find(':') == -1: continue
+            key, value = line.split(':', 1)
+            key, value = key.strip().lower(), value.strip()
+            if key in self.headers:
+                self.headers[key] = ', '.join((self.headers[key], value))
+            else:
+                self.headers[key] = value
+
+        try:
+            self.clength = int(self.headers.get('content-length','-1').split(',')[0])
+        except ValueError:
+            pass
+
+        if self.status < 300 and self._engine.check_headers(self.item[2], self.headers):
+            self.rejected = True
+            self.finish()
+            return False
+
+        if self.clength > self._engine.get_maxsize():
+            self.toolarge = True
+            self.finish()
+            return False
+
+        # Nothing more to read for these
+        if self.status == 304 or self.status == 204 or self.clength == 0:
+            self.finish()
+            return False
+
+        return True
+
+    def handle_close(self):
+
+        if not self._gotheaders and not self.error:
+            self.error = 'Connection closed before headers were read'
+        self.finish()
+
+    def handle_expt(self):
+
+        self.error = 'Socket exception'
+        self.finish()
+
+    def handle_error(self):
+
+        t, v = sys.exc_info()[:2]
+        self.error = str(v) or str(t)
+        self.finish()
+
+    def finish(self):
+        """ Close the channel and hand it to the engine """
+
+        if self._done: return
+        self._done = True
+        if self.socket is not None:
+            self.close()
+        self._engine.channel_done(self)
+
+    def is_congested(self):
+        """ Return whether the server showed signs of overload """
+
+        return (self.error != '' and not self.toolarge) or self.status >= 500
+
+    def get_response(self):
+        """ Return the response object for this channel """
+
+        return HarvestManAsyncResponse(self.url, self.status, self.reason,
+                                       self.headers, self.blocks, self.error,
+                                       self.latency, self.timestamp - self.starttime - self.latency)
+
+class HarvestManAsyncResult(object):
+    """ Result of processing a url object in a worker thread,
+    with the objects pushed by the downloader of the thread """
+
+    def __init__(self, urlobj, pushed):
+        self.urlobj = urlobj
+        # List of (object, role) tuples
+        self.pushed = pushed
+
+class HarvestManAsyncWorker(threading.Thread):
+    """ Thread which downloads, saves and parses the data of url
+    objects which the engine cannot download by itself, using the
+    regular (blocking) connector. The objects pushed by its
+    downloader are handed back to the engine when a url object
+    is done, through the list of finished channels of the engine """
+
+    def __init__(self, engine, index):
+        self._engine = engine
+        # Downloader object of this thread,
+        # which has this thread as its queue.
+        self._downloader = engine.make_downloader(index)
+        self._downloader._crawlerqueue = self
+        self._pushed = []
+        threading.Thread.__init__(self, None, None, 'Async worker ' + str(index))
+        self.setDaemon(True)
+
+    def push(self, obj, role):
+        """ Keep an object pushed by the downloader """
+
+        self._pushed.append((obj, role))
+        return 1
+
+    def run(self):
+
+        while True:
+            urlobj = self._engine.get_fallback()
+            if urlobj is None:
+                break
+
+            self._pushed = []
+            try:
+                self._downloader.set_url_object((urlobj.priority, urlobj))
+                self._downloader.process_url()
+            except Exception, e:
+                extrainfo('Error processing url', urlobj.get_full_url(), '=>', e)
+
+            self._engine.fallback_done(HarvestManAsyncResult(urlobj, self._pushed))
+
+class HarvestManAsyncEngine(object):
+    """ Asynchronous download engine which runs the download,
+    rules checking, parsing and saving of URLs on a single
+    event loop """
+
+    # Statuses of redirections which are followed
+    REDIRECTS = (301, 302, 303, 307)
+    # Maximum number of redirections followed for a URL
+    MAXREDIRECTS = 5
+    # Default ports of protocols
+    DEFAULTPORTS = { 'http' : '80', 'https' : '443', 'ftp' : '21' }
+
+    def __init__(self, downloader):
+        self._cfg = GetObject('config')
+        self._dmgr = GetObject('datamanager')
+        self._rules = GetObject('ruleschecker')
+        # Downloader object which saves and parses
+        # the data of URLs, and crawls their links.
+        # The engine acts as its queue.
+        self._downloader = downloader
+        self._downloader._crawlerqueue = self
+        self._factory = None
+        # Socket map for asyncore
+        self._map = {}
+        # Queues of URLs waiting to be downloaded
+        # for each server, kept as heaps
+        self._queues = {}
+        # Number of active connections to each server
+        self._active = {}
+        # Collections of links waiting to be crawled
+        self._colls = []
+        # Channels which have finished, and results
+        # of url objects processed by worker threads
+        self._done = []
+        # Url objects waiting for worker threads
+        self._fallbacks = Queue()
+        # Number of url objects handed to worker
+        # threads and not yet done
+        self._numfallbacks = 0
+        self._workers = []
+        # Cache of address information for servers
+        self._addrcache = {}
+        # URLs waiting to be retried, as a heap of
+        # (time, count, url object) tuples, where time
+        # is the earliest time for the retry.
+        self._retries = []
+        # Count of URLs queued, used to keep the
+        # order of URLs with the same priority
+        self._count = 0
+        self._requests = 0
+        self._maxactive = 0
+        self._endflag = False
+        # Bandwidth throttle
+        self._throttle = GetObject('connector').get_throttle()
+
+    def get_map(self):
+        return self._map
+
+    def get_server(self, url):
+        """ Return the server of the url, with the port if it is
+        not the default for the protocol. This is the same as the
+        server of a url object, on which the connector factory
+        keeps the request limits """
+
+        scheme, netloc = urlparse.urlsplit(url)[:2]
+        host, port = urllib2.splitport(netloc)
+        if port and port != self.DEFAULTPORTS.get(scheme.lower()):
+            return host + ':' + port
+
+        return host
+
+    def get_maxsize(self):
+        return self._cfg.maxfilesize
+
+    def get_throttle(self):
+        return self._throttle
+
+    def check_headers(self, urlobj, headers):
+        """ Return whether the rules prevent download of the
+        url object, as seen from the response headers """
+
+        return (self._rules.check_content_headers(urlobj, headers) != '')
+
+    def push(self, obj, role):
+        """ Push an object to the engine. This is called by
+        the downloader object in place of the queue """
+
+        if role == 'crawler':
+            self.add_url(obj)
+        elif role == 'fetcher':
+            self._colls.append(obj)
+
+        return 1
+
+    def add_url(self, urlobj, url='', redirects=0):
+        """ Queue the url object for download. The url, if given,
+        is the url of a redirection for the url object """
+
+        if not url:
+            url = urlobj.get_full_url()
+
+        server = self.get_server(url)
+        self._count += 1
+        heapq.heappush(self._queues.setdefault(server, []),
+                       (urlobj.priority, self._count, urlobj, url, redirects))
+
+    def add_retry(self, urlobj, notbefore):
+        """ Queue the url object for download after the
+        time 'notbefore' """
+
+        self._count += 1
+        heapq.heappush(self._retries, (notbefore, self._count, urlobj))
+
+    def push_retries(self):
+        """ Queue url objects whose retry is due """
+
+        t = time.time()
+        while self._retries and self._retries[0][0] <= t:
+            self.add_url(heapq.heappop(self._retries)[-1])
+            
+    def can_download(self, url):
+        """ Return whether the url can be downloaded by the engine """
+
+        if not url.lower().startswith('http://'):
+            return False
+
+        # The connector takes care of these
+        return not (self._cfg.proxy or self._cfg.username)
+
+    def get_address(self, server):
+        """ Return address information for the server """
+
+        try:
+            return self._addrcache[server]
+        except KeyError:
+            pass
+
+        host, port = urllib2.splitport(server)
+        try:
+            port = int(port or 80)
+            address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+        except (socket.error, ValueError), e:
+            address = None
+            extrainfo('Error resolving server', server, '=>', e)
+
+        self._addrcache[server] = address
+        return address
+
+    def make_request(self, url, urlobj):
+        """ Return the HTTP request for the url as a string """
+
+        scheme, server, path, query, fragment = urlparse.urlsplit(url)
+        if not path: path = '/'
+        if query: path = '?'.join((path, query))
+
+        lines = ['GET %s HTTP/1.0' % path,
+                 'Host: %s' % server,
+                 'User-Agent: %s' % GetObject('USER_AGENT'),
+                 'Accept: */*',
+                 'Connection: close']
+
+        if self._cfg.httpcompress:
+            lines.append('Accept-Encoding: gzip, deflate')
+
+        lmt, etag = self._dmgr.get_url_validators(urlobj)
+        if lmt != -1:
+            ts = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.localtime(lmt))
+            lines.append('If-Modified-Since: %s' % ts)
+        if etag:
+            lines.append('If-None-Match: %s' % etag)
+
+        return '\r\n'.join(lines) + '\r\n\r\n'
+
+    def start_requests(self):
+        """ Start downloads for servers which have URLs waiting,
+        keeping within the limits on number of connections """
+
+        self.push_retries()
+        
+        maxactive = self._cfg.asyncconnections
+        factory = self._factory.get_factory()
+        for server, queue in self._queues.items():
+            limit = factory.get_request_limit(server)
+            while queue and len(self._map) < maxactive and \
+                      self._active.get(server, 0) < limit:
+                item = heapq.heappop(queue)
+                self.start_request(server, item)
+
+            if not queue:
+                del self._queues[server]
+
+        self._maxactive = max(self._maxactive, len(self._map))
+
+    def start_request(self, server, item):
+        """ Start download of a frontier item """
+
+        priority, count, urlobj, url, redirects = item
+
+        if not redirects and self._dmgr.is_downloaded(url):
+            return
+
+        if not self.can_download(url):
+            self.add_fallback(urlobj)
+            return
+
+        address = self.get_address(server)
+        if address is None:
+            response = HarvestManAsyncResponse(url, 0, '', {}, [], 'Could not resolve server %s' % server)
+            self.process(urlobj, response)
+            return
+
+        self._requests += 1
+        self._active[server] = self._active.get(server, 0) + 1
+        HarvestManAsyncChannel(self, item, url, address, self.make_request(url, urlobj))
+
+    def channel_done(self, channel):
+        """ Callback from a channel when it has finished """
+
+        server = self.get_server(channel.url)
+        self._active[server] -= 1
+        self._done.append(channel)
+
+        # Adapt the request limit of the server
+        factory = self._factory.get_factory()
+        factory.update_request_limit(server, channel.is_congested(), channel.latency)
+
+    def check_timeouts(self):
+        """ Stop channels which have been idle for too long """
+
+        t = time.time()
+        for channel in self._map.values():
+            if t - channel.timestamp > self._cfg.socktimeout:
+                channel.error = 'Connection timed out'
+                channel.finish()
+
+    def handle_channel(self, channel):
+        """ Process a channel which has finished """
+
+        priority, count, urlobj, url, redirects = channel.item
+
+        location = channel.headers.get('location')
+        if channel.status in self.REDIRECTS and location and not channel.error:
+            if redirects < self.MAXREDIRECTS:
+                newurl = urlparse.urljoin(url, location)
+                extrainfo('Redirection from', url, 'to', newurl)
+                self._dmgr.update_redirect(url, newurl, channel.status)
+                self.add_url(urlobj, newurl, redirects + 1)
+                return
+            else:
+                channel.error = 'Too many redirections'
+
+        if channel.toolarge and channel.clength == -1:
+            # The server did not send the length, so
+            # the data is not downloaded again.
+            extrainfo('Aborting download of URL', url, '(size)')
+            self._dmgr.update_counter('_abortedsize')
+            self._dmgr.update_counter('_abortedbytes', channel.length)
+        elif channel.toolarge:
+            # Let the connector deal with this
+            # one, using multipart download.
+            self.add_fallback(urlobj)
+        elif channel.status == 304 and (urlobj.is_webpage() or urlobj.is_stylesheet()) and \
+                 self._dmgr.get_url_links(urlobj) is None:
+            # Nothing to parse and no saved links, the
+            # connector downloads it again.
+            self.add_fallback(urlobj)
+        else:
+            # The connector counts the downloads
+            # rejected by their headers.
+            self.process(urlobj, channel.get_response())
+
+    def process(self, urlobj, response):
+        """ Save and parse the data of the response for the url
+        object and crawl its links """
+
+        self._factory.add_response(urlobj, response)
+
+        try:
+            self._downloader.set_url_object((urlobj.priority, urlobj))
+            self._downloader.process_url()
+        finally:
+            self._factory.discard_response(urlobj)
+
+        self.crawl_collections()
+
+    def crawl_collections(self):
+        """ Crawl the links of the collections waiting """
+
+        while self._colls:
+            self._downloader.set_url_object2(self._colls.pop(0))
+            self._downloader.crawl_url()
+
+    def make_downloader(self, index):
+        """ Return a new downloader object like the one of
+        the engine, for a worker thread """
+
+        return self._downloader.__class__(index, None, False)
+
+    def add_fallback(self, urlobj):
+        """ Hand the url object to a worker thread, which
+        downloads it using the regular connector """
+
+        self._numfallbacks += 1
+        self._fallbacks.put(urlobj)
+
+        # Start threads as needed, up to the
+        # number of connections of the factory.
+        if len(self._workers) < min(self._numfallbacks, self._cfg.connections):
+            worker = HarvestManAsyncWorker(self, len(self._workers) + 1)
+            self._workers.append(worker)
+            worker.start()
+
+    def get_fallback(self):
+        """ Return the next url object for a worker thread,
+        blocking till there is one. Returns None when the
+        thread should stop """
+
+        return self._fallbacks.get()
+
+    def fallback_done(self, result):
+        """ Callback from a worker thread when it has
+        finished with a url object """
+
+        self._done.append(result)
+
+    def handle_result(self, result):
+        """ Process the result of a worker thread """
+
+        self._numfallbacks -= 1
+        for obj, role in result.pushed:
+            self.push(obj, role)
+
+        self.crawl_collections()
+
+    def stop_workers(self):
+        """ Stop the worker threads, after the url
+        objects they are working on """
+
+        for worker in self._workers:
+            self._fallbacks.put(None)
+        self._workers = []
+
+    def is_exit_condition(self):
+        """ Return whether there is no more work left """
+
+        if self._queues or self._map or self._done or self._colls or \
+               self._retries or self._numfallbacks:
+            return False
+
+        # Downloads in worker threads
+        return not self._dmgr.has_download_threads()
+
+    def crawl(self, urlobj):
+        """ Crawl starting from the passed url object """
+
+        factory = GetObject('connectorfactory')
+        self._factory = HarvestManAsyncConnectorFactory(factory)
+        SetObject(self._factory)
+
+        moreinfo('Starting asynchronous crawl with',self._cfg.asyncconnections,'connections...')
+        t1 = time.time()
+        lastcheck = t1
+
+        try:
+            self.add_url(urlobj)
+
+            while not self._endflag:
+                self.start_requests()
+
+                if self.is_exit_condition():
+                    break
+
+                if self._map:
+                    asyncore.loop(0.1, True, self._map, 1)
+                else:
+                    time.sleep(0.1)
+
+                while self._done and not self._endflag:
+                    item = self._done.pop(0)
+                    if isinstance(item, HarvestManAsyncResult):
+                        self.handle_result(item)
+                    else:
+                        self.handle_channel(item)
+
+                if time.time() - lastcheck > 1.0:
+                    self.check_timeouts()
+                    lastcheck = time.time()
+        finally:
+            self.close_channels()
+            self.stop_workers()
+            SetObject(factory)
+
+        extrainfo('Asynchronous crawl made',self._requests,'requests in',time.time() - t1,'seconds,')
+        extrainfo('with a maximum of',self._maxactive,'simultaneous connections.')
+
+    def close_channels(self):
+
+        for channel in self._map.values():
+            channel.close()
+        self._map.clear()
+
+    def stop(self):
+        """ Stop the engine """
+
+        self._endflag = True
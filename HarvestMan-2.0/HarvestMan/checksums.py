@@ -0,0 +1,357 @@
+# -- coding: latin-1
+""" checksums.py - Module which provides support for verifying
+the data downloaded by hget against expected checksums.
+
+The expected checksums come from the command line, from a
+checksum file in the format written by md5sum/sha1sum or
+from a metalink file. A metalink file can also list digests
+of the pieces of a file, which are checked as the data is
+written, so that only the pieces which fail verification
+need to be downloaded again.
+"""
+
+import os
+import re
+import md5
+import sha
+import threading as tg
+import xml.dom.minidom
+import mirrors
+
+try:
+    import hashlib
+except ImportError:
+    hashlib = None
+
+# Expected checksums of files, by file name. The
+# checksum for the empty name applies to any file.
+CHECKSUMS = {}
+
+# Hash types by the length of their hex digests
+HASHLENGTHS = { 32 : 'md5', 40 : 'sha1', 64 : 'sha256' }
+
+# Size of blocks read when verifying a file
+BLOCKSIZE = 64*1024
+
+def is_supported(hashtype):
+    """ Check whether the given hash type is supported """
+
+    if hashtype in ('md5', 'sha1'):
+        return True
+    elif hashtype == 'sha256':
+        return hashlib is not None
+
+    return False
+
+def new_hash(hashtype):
+    """ Return a new hash object of the given type """
+
+    if hashtype == 'md5':
+        return md5.new()
+    elif hashtype == 'sha1':
+        return sha.new()
+    else:
+        return hashlib.new(hashtype)
+
+class HarvestManChecksumError(Exception):
+    pass
+
+class HarvestManChecksum(object):
+    """ Expected checksum of a file, with the optional digests
+    of its pieces, and the state of verifying the data of a
+    download against it.
+
+    The url objects of the pieces of a multipart download are
+    copies of the url object of the download, which all share
+    the same checksum object """
+
+    def __init__(self, hashtype, digest='', piecetype='', piecelength=0, pieces=None):
+        self.hashtype = hashtype
+        self.digest = digest.lower()
+        # Pieces of 'piecelength' bytes, the
+        # last one can be shorter.
+        self.piecetype = piecetype
+        self.piecelength = piecelength
+        self.pieces = [x.lower() for x in (pieces or [])]
+        # Length of the file, set when it is known
+        self.length = 0
+        # Results of pieces verified as the
+        # data was written, by index.
+        self._results = {}
+        self._lock = tg.Lock()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def copy(self):
+        """ Return a copy of this checksum for a new download """
+
+        return HarvestManChecksum(self.hashtype, self.digest, self.piecetype,
+                                  self.piecelength, self.pieces)
+
+    def get_num_pieces(self):
+        """ Return the number of pieces which can be verified
+        for a file of the current length """
+
+        if not self.piecelength or not self.length:
+            return 0
+        return min(len(self.pieces), (self.length + self.piecelength - 1)/self.piecelength)
+
+    def get_piece_range(self, idx):
+        """ Return the byte range of the piece at 'idx'
+        as a (start, end) tuple """
+
+        start = idx*self.piecelength
+        return (start, min(start + self.piecelength, self.length))
+
+    def new_verifier(self, offset=0):
+        """ Return a verifier for data written from 'offset' """
+
+        return HarvestManStreamVerifier(self, offset)
+
+    def set_piece_result(self, idx, digest):
+        """ Record the digest of the piece at 'idx' computed
+        from the data written """
+
+        try:
+            self._lock.acquire()
+            if idx < len(self.pieces):
+                self._results[idx] = (digest == self.pieces[idx])
+        finally:
+            self._lock.release()
+
+    def reset_pieces(self, indices):
+        """ Forget the results of the pieces at 'indices',
+        before they are downloaded again """
+
+        try:
+            self._lock.acquire()
+            for idx in indices:
+                self._results.pop(idx, None)
+        finally:
+            self._lock.release()
+
+    def _hash_range(self, f, hashtype, start, end):
+        """ Return the hex digest of the bytes from 'start'
+        to 'end' of the file object 'f' """
+
+        h = new_hash(hashtype)
+        f.seek(start)
+        left = end - start
+        while left > 0:
+            block = f.read(min(BLOCKSIZE, left))
+            if not block: break
+            h.update(block)
+            left -= len(block)
+
+        return h.hexdigest()
+
+    def verify(self, f, digest=''):
+        """ Verify the data of the file object 'f'. Pieces which
+        were not verified as the data was written are read from
+        'f'. The digest of the whole file is read from 'f' too,
+        unless it is passed as 'digest' or all pieces are verified.
+
+        Returns a list of the indices of the pieces which failed
+        verification. Raises HarvestManChecksumError if the digest
+        of the file does not match and there are no pieces """
+
+        npieces = self.get_num_pieces()
+        failed = []
+        for idx in range(npieces):
+            result = self._results.get(idx)
+            if result is None:
+                start, end = self.get_piece_range(idx)
+                self.set_piece_result(idx, self._hash_range(f, self.piecetype, start, end))
+                result = self._results[idx]
+            if not result:
+                failed.append(idx)
+
+        # The pieces are enough if they cover the file
+        if failed or (npieces and npieces*self.piecelength >= self.length):
+            return failed
+
+        if self.digest:
+            if not digest:
+                digest = self._hash_range(f, self.hashtype, 0, self.length)
+            if digest != self.digest:
+                raise HarvestManChecksumError, '%s checksum mismatch, expected %s, got %s' % \
+                      (self.hashtype, self.digest, digest)
+
+        return []
+
+class HarvestManStreamVerifier(object):
+    """ Class which computes the digests of data as it is
+    written at increasing offsets of a file, for verifying it
+    against a checksum without reading it again """
+
+    def __init__(self, checksum, offset=0):
+        self._checksum = checksum
+        self._pos = offset
+        # Digest of the whole file, which is only
+        # known if the data is written from the start
+        self._hash = None
+        self._count = 0
+        if offset==0 and checksum.digest:
+            self._hash = new_hash(checksum.hashtype)
+
+        # Digest of the current piece, which is only
+        # known if the piece is written from its start
+        self._piecehash = None
+        if checksum.piecelength and offset % checksum.piecelength == 0:
+            self._piecehash = new_hash(checksum.piecetype)
+
+    def update(self, data):
+        """ Update the digests with data written at the
+        current offset """
+
+        if self._hash:
+            self._hash.update(data)
+            self._count += len(data)
+
+        checksum = self._checksum
+        if not checksum.piecelength or not checksum.length:
+            self._pos += len(data)
+            return
+
+        start = 0
+        while start < len(data):
+            idx = self._pos/checksum.piecelength
+            end = checksum.get_piece_range(idx)[1]
+            n = min(len(data) - start, end - self._pos)
+            if n <= 0:
+                # Past the end of the file
+                break
+
+            if self._piecehash:
+                self._piecehash.update(data[start:start + n])
+            start += n
+            self._pos += n
+
+            if self._pos == end:
+                if self._piecehash:
+                    checksum.set_piece_result(idx, self._piecehash.hexdigest())
+                self._piecehash = new_hash(checksum.piecetype)
+
+    def get_digest(self):
+        """ Return the digest of the whole file if all of
+        its data was written, else an empty string """
+
+        if self._hash and self._count == self._checksum.length:
+            return self._hash.hexdigest()
+        return ''
+
+def parse_checksum(value):
+    """ Return the checksum for a value given as 'TYPE:DIGEST'
+    or as a digest whose type is known from its length """
+
+    if ':' in value:
+        hashtype, digest = value.split(':', 1)
+        hashtype = hashtype.lower().replace('-', '')
+    else:
+        digest = value
+        hashtype = HASHLENGTHS.get(len(digest), '')
+
+    digest = digest.strip().lower()
+    if not is_supported(hashtype):
+        raise HarvestManChecksumError, 'Unsupported checksum type "%s"' % hashtype
+    if not re.match('^[0-9a-f]+$', digest) or HASHLENGTHS.get(len(digest)) != hashtype:
+        raise HarvestManChecksumError, 'Invalid %s checksum "%s"' % (hashtype, digest)
+
+    return HarvestManChecksum(hashtype, digest)
+
+def load_checksum_file(filename):
+    """ Load checksums from a file written by md5sum, sha1sum
+    or sha256sum, with lines like 'DIGEST  NAME'. Returns a
+    dictionary of the checksums by file name """
+
+    checksums = {}
+    for line in open(filename):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            digest, name = line.split(None, 1)
+        except ValueError:
+            continue
+        # Binary mode is marked with a '*'
+        name = os.path.basename(name.lstrip('*'))
+        checksums[name] = parse_checksum(digest)
+
+    return checksums
+
+def _get_text(node):
+    return ''.join([x.data for x in node.childNodes if x.nodeType==x.TEXT_NODE]).strip()
+
+def load_metalink_checksums(filename):
+    """ Load the checksums of the files of a metalink file, and
+    the checksums of their pieces. Returns a dictionary of the
+    checksums by file name """
+
+    checksums = {}
+    dom = xml.dom.minidom.parse(filename)
+    try:
+        for filenode in dom.getElementsByTagName('file'):
+            name = os.path.basename(filenode.getAttribute('name'))
+            hashes, piecetype, piecelength, pieces = {}, '', 0, []
+
+            for node in filenode.getElementsByTagName('hash'):
+                hashtype = node.getAttribute('type').lower().replace('-', '')
+                if node.parentNode.nodeName == 'pieces':
+                    continue
+                if is_supported(hashtype):
+                    hashes[hashtype] = _get_text(node)
+
+            for node in filenode.getElementsByTagName('pieces'):
+                hashtype = node.getAttribute('type').lower().replace('-', '')
+                if not is_supported(hashtype):
+                    continue
+                piecedigests = {}
+                for piece in node.getElementsByTagName('hash'):
+                    piecedigests[int(piece.getAttribute('piece'))] = _get_text(piece)
+                if piecedigests and sorted(piecedigests.keys()) == range(len(piecedigests)):
+                    piecetype = hashtype
+                    piecelength = int(node.getAttribute('length'))
+                    pieces = [piecedigests[x] for x in range(len(piecedigests))]
+                    break
+
+            # Prefer the strongest hash
+            hashtype, digest = '', ''
+            for x in ('sha256', 'sha1', 'md5'):
+                if x in hashes:
+                    hashtype, digest = x, hashes[x]
+                    break
+
+            if digest or pieces:
+                checksums[name] = HarvestManChecksum(hashtype, digest, piecetype,
+                                                     piecelength, pieces)
+    finally:
+        dom.unlink()
+
+    return checksums
+
+def load_checksums(value):
+    """ Load the expected checksums given by 'value', which is
+    either a checksum or the name of a checksum file or a metalink
+    file. Returns the number of checksums loaded """
+
+    global CHECKSUMS
+
+    if os.path.isfile(value):
+        if mirrors.is_metalink(value):
+            CHECKSUMS.update(load_metalink_checksums(value))
+        else:
+            CHECKSUMS.update(load_checksum_file(value))
+    else:
+        CHECKSUMS[''] = parse_checksum(value)
+
+    return len(CHECKSUMS)
+
+def find_checksum(filename):
+    """ Return the expected checksum for a download to the
+    file 'filename', or None if there is none """
+
+    checksum = CHECKSUMS.get(os.path.basename(filename), CHECKSUMS.get(''))
+    if checksum:
+        return checksum.copy()
+    return None
@@ -87,6 +87,7 @@ class Registry(object):
             self.mappings = { 'HarvestManStateObject' : 'config',
                               'HarvestManNetworkConnector' : 'connector',
                               'HarvestManUrlConnectorFactory' : 'connectorfactory',
+                              'HarvestManAsyncConnectorFactory' : 'connectorfactory',
                               'HarvestManDataManager' : 'datamanager',
                               'HarvestManRulesChecker' : 'ruleschecker',
                               'HarvestManCrawlerQueue' : 'trackerqueue',
@@ -0,0 +1,213 @@
+# -- coding: latin-1
+""" ftprange.py - Module which provides an FTP handler for urllib2
+that supports byte-range requests, for multipart downloads of
+FTP URLs with hget.
+
+The handler reads the 'Range' header of a request and restarts
+the transfer at the first byte of the range with the FTP REST
+command. Every request uses a connection of its own, so the
+pieces of a file are downloaded over parallel data connections.
+The response looks like that of an HTTP server which supports
+range requests, with the headers 'Content-Length', 'Content-Range',
+'Accept-Ranges' and 'Last-Modified', so it works with the
+multipart, progress and resume code of hget unchanged.
+
+>>> import urllib2
+>>> from ftprange import FTPRangeHandler
+>>> opener = urllib2.build_opener(FTPRangeHandler)
+>>> req = urllib2.Request('ftp://ftp.python.org/pub/python/README')
+>>> req.add_header('Range', 'bytes=100-199')
+>>> fo = opener.open(req)
+"""
+
+import urllib
+import urllib2
+import ftplib
+import mimetools
+import mimetypes
+import time
+import calendar
+import rfc822
+
+from cStringIO import StringIO
+
+class FTPRangeFile(object):
+    """ File like object for reading the data of an FTP
+    transfer, which stops at the end of the range """
+
+    def __init__(self, ftp, conn, length=None, partial=False):
+        self._ftp = ftp
+        self._conn = conn
+        self._fp = conn.makefile('rb')
+        # Bytes left to read, None if not known
+        self._left = length
+        # Whether the range ends before the end of
+        # the file, the server sends data till the
+        # end of the file anyway.
+        self._partial = partial
+
+    def read(self, amt=-1):
+        if self._left is not None:
+            if amt < 0 or amt > self._left:
+                amt = self._left
+            if amt == 0:
+                return ''
+
+        data = self._fp.read(amt)
+        if self._left is not None:
+            self._left -= len(data)
+        return data
+
+    def readline(self):
+        return self._fp.readline()
+
+    def readlines(self):
+        return self._fp.readlines()
+
+    def fileno(self):
+        return self._conn.fileno()
+
+    def close(self):
+        """ Close the data and control connections """
+
+        if self._fp is None:
+            return
+
+        self._fp.close()
+        self._conn.close()
+        self._fp = None
+
+        try:
+            if self._left or self._partial:
+                # The transfer was stopped before the end of
+                # the file, the server does not need to hear why.
+                self._ftp.close()
+            else:
+                self._ftp.voidresp()
+                self._ftp.quit()
+        except ftplib.all_errors:
+            self._ftp.close()
+
+class FTPRangeHandler(urllib2.FTPHandler):
+    """ urllib2 handler for FTP URLs with support
+    for byte-range requests using REST """
+
+    def ftp_open(self, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('ftp error: no host given')
+
+        host, port = urllib.splitport(host)
+        if port is None:
+            port = ftplib.FTP_PORT
+        else:
+            port = int(port)
+
+        user, host = urllib.splituser(host)
+        if user:
+            user, passwd = urllib.splitpasswd(user)
+        else:
+            passwd = None
+        host = urllib.unquote(host)
+        user = urllib.unquote(user or '')
+        passwd = urllib.unquote(passwd or '')
+
+        path, attrs = urllib.splitattr(req.get_selector())
+        dirs = [urllib.unquote(x) for x in path.split('/')]
+        dirs, filename = dirs[:-1], dirs[-1]
+        if dirs and not dirs[0]:
+            dirs = dirs[1:]
+
+        ftp = ftplib.FTP()
+        try:
+            ftp.connect(host, port)
+            ftp.login(user, passwd)
+            for d in dirs:
+                ftp.cwd(d)
+
+            if not filename:
+                return self._open_listing(ftp, req)
+
+            return self._open_file(ftp, filename, req)
+        except ftplib.all_errors, msg:
+            ftp.close()
+            raise urllib2.URLError('ftp error: %s' % msg)
+
+    def _open_listing(self, ftp, req):
+        """ Return a response for the listing of the
+        current directory """
+
+        ftp.voidcmd('TYPE A')
+        conn = ftp.transfercmd('LIST')
+        headers = mimetools.Message(StringIO('Content-type: text/plain\n'))
+
+        resp = urllib.addinfourl(FTPRangeFile(ftp, conn), headers, req.get_full_url())
+        resp.code, resp.msg = 200, 'OK'
+        return resp
+
+    def _open_file(self, ftp, filename, req):
+        """ Return a response for the file, or the range
+        of the file given in the request """
+
+        ftp.voidcmd('TYPE I')
+
+        headers = []
+        mtype = mimetypes.guess_type(req.get_full_url())[0]
+        if mtype:
+            headers.append('Content-type: %s' % mtype)
+
+        try:
+            size = ftp.size(filename)
+        except ftplib.error_perm:
+            size = None
+
+        try:
+            # Reply is like '213 20071019101500', in UTC
+            mtime = ftp.sendcmd('MDTM ' + filename).split()[1][:14]
+            t = calendar.timegm(time.strptime(mtime, '%Y%m%d%H%M%S'))
+            headers.append('Last-modified: %s' % rfc822.formatdate(t))
+        except (ftplib.error_perm, IndexError, ValueError):
+            pass
+
+        start, end = 0, None
+        if size is not None:
+            end = size - 1
+            if self._supports_rest(ftp):
+                headers.append('Accept-ranges: bytes')
+
+                rangeval = req.headers.get('Range', '')
+                if rangeval.startswith('bytes='):
+                    first, last = rangeval[6:].split('-', 1)
+                    start = int(first)
+                    if last:
+                        end = min(int(last), end)
+                    headers.append('Content-range: bytes %d-%d/%d' % (start, end, size))
+
+            headers.append('Content-length: %d' % (end - start + 1))
+
+        conn = ftp.transfercmd('RETR ' + filename, start or None)
+
+        length, partial = None, False
+        if end is not None:
+            length = end - start + 1
+            partial = (end < size - 1)
+
+        headers = mimetools.Message(StringIO('\n'.join(headers) + '\n'))
+        resp = urllib.addinfourl(FTPRangeFile(ftp, conn, length, partial), headers, req.get_full_url())
+        if start:
+            resp.code, resp.msg = 206, 'Partial Content'
+        else:
+            resp.code, resp.msg = 200, 'OK'
+
+        return resp
+
+    def _supports_rest(self, ftp):
+        """ Check whether the FTP server can restart
+        transfers at an offset """
+
+        try:
+            # Also resets the offset for the transfer
+            ftp.sendcmd('REST 0')
+            return True
+        except ftplib.all_errors:
+            return False
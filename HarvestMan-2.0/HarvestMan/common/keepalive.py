@@ -120,6 +120,7 @@ import urllib2
 import httplib
 import socket
 import thread
+import time
 
 class FakeLogger:
     def debug(self, msg, *args): print msg % args
@@ -137,12 +138,27 @@ class ConnectionManager:
     """
     The connection manager must be able to:
       * keep track of all existing
+      * limit the number of idle connections kept for a host
+      * close connections which have been idle for too long
+      * keep count of connections created and re-used
       """
-    def __init__(self):
+    def __init__(self, maxidle=0, idletimeout=0):
         self._lock = thread.allocate_lock()
         self._hostmap = {} # map hosts to a list of connections
         self._connmap = {} # map connections to host
         self._readymap = {} # map connection to ready state
+        self._idlemap = {} # map idle connection to time it became idle
+        # Maximum number of idle connections kept
+        # for a host, 0 means no limit.
+        self._maxidle = maxidle
+        # Idle connections are closed after this
+        # many seconds, 0 means never.
+        self._idletimeout = idletimeout
+        self._lastsweep = time.time()
+        # Statistics
+        self._created = 0
+        self._reused = 0
+        self._evicted = 0
 
     def add(self, host, connection, ready):
         self._lock.acquire()
@@ -151,42 +167,119 @@ class ConnectionManager:
             self._hostmap[host].append(connection)
             self._connmap[connection] = host
             self._readymap[connection] = ready
+            if ready: self._idlemap[connection] = time.time()
+            self._created += 1
         finally:
             self._lock.release()
 
+    def _remove(self, connection):
+        # Call with the lock held
+        try:
+            host = self._connmap[connection]
+        except KeyError:
+            pass
+        else:
+            del self._connmap[connection]
+            del self._readymap[connection]
+            if self._idlemap.has_key(connection): del self._idlemap[connection]
+            self._hostmap[host].remove(connection)
+            if not self._hostmap[host]: del self._hostmap[host]
+
     def remove(self, connection):
         self._lock.acquire()
         try:
-            try:
-                host = self._connmap[connection]
-            except KeyError:
-                pass
-            else:
-                del self._connmap[connection]
-                del self._readymap[connection]
-                self._hostmap[host].remove(connection)
-                if not self._hostmap[host]: del self._hostmap[host]
+            self._remove(connection)
         finally:
             self._lock.release()
 
+    def _evict(self, connection):
+        # Call with the lock held
+        self._remove(connection)
+        self._evicted += 1
+        try:
+            connection.close()
+        except (socket.error, httplib.HTTPException):
+            pass
+
+    def _evict_idle(self, host):
+        """ Close idle connections to the host which have timed out
+        or which exceed the maximum number of idle connections """
+
+        idle = [(self._idlemap[c], c) for c in self._hostmap.get(host, []) \
+                if self._idlemap.has_key(c)]
+        if not idle: return
+
+        # Newest first
+        idle.sort()
+        idle.reverse()
+        
+        now = time.time()
+        for count, (t, c) in enumerate(idle):
+            if self._maxidle and count >= self._maxidle:
+                self._evict(c)
+            elif self._idletimeout and now - t > self._idletimeout:
+                self._evict(c)
+
+    def _sweep(self):
+        """ Close idle connections to all hosts, at most
+        once a second """
+
+        if time.time() - self._lastsweep < 1.0: return
+        self._lastsweep = time.time()
+        
+        for host in self._hostmap.keys():
+            self._evict_idle(host)
+            
     def set_ready(self, connection, ready):
-        try: self._readymap[connection] = ready
-        except KeyError: pass
+        self._lock.acquire()
+        try:
+            # Connection could have been removed already
+            if self._connmap.has_key(connection):
+                self._readymap[connection] = ready
+                if ready:
+                    self._idlemap[connection] = time.time()
+                    self._evict_idle(self._connmap[connection])
+                elif self._idlemap.has_key(connection):
+                    del self._idlemap[connection]
+        finally:
+            self._lock.release()
         
     def get_ready_conn(self, host):
         conn = None
         self._lock.acquire()
         try:
+            self._sweep()
             if self._hostmap.has_key(host):
                 for c in self._hostmap[host]:
                     if self._readymap[c]:
                         self._readymap[c] = 0
+                        del self._idlemap[c]
                         conn = c
                         break
         finally:
             self._lock.release()
         return conn
 
+    def reused(self, connection):
+        """ Record a successful re-use of the connection """
+        
+        self._lock.acquire()
+        self._reused += 1
+        self._lock.release()
+
+    def get_stats(self):
+        """ Return a dictionary of connection statistics """
+
+        self._lock.acquire()
+        try:
+            return { 'created' : self._created,
+                     'reused' : self._reused,
+                     'evicted' : self._evicted,
+                     'open' : len(self._connmap),
+                     'idle' : len(self._idlemap) }
+        finally:
+            self._lock.release()
+
     def get_all(self, host=None):
         if host:
             return list(self._hostmap.get(host, []))
@@ -194,8 +287,10 @@ class ConnectionManager:
             return dict(self._hostmap)
 
 class KeepAliveHandler:
-    def __init__(self):
-        self._cm = ConnectionManager()
+    def __init__(self, cm=None):
+        # Handlers can share a connection manager
+        if cm is None: cm = ConnectionManager()
+        self._cm = cm
         
     #### Connection Management
     def open_connections(self):
@@ -240,7 +335,9 @@ class KeepAliveHandler:
 
                 # if this response is non-None, then it worked and we're
                 # done.  Break out, skipping the else block.
-                if r: break
+                if r:
+                    self._cm.reused(h)
+                    break
 
                 # connection is bad - possibly closed by server
                 # discard it and ask for the next free connection
@@ -346,8 +443,8 @@ class KeepAliveHandler:
         return NotImplementedError
 
 class HTTPHandler(KeepAliveHandler, urllib2.HTTPHandler):
-    def __init__(self):
-        KeepAliveHandler.__init__(self)
+    def __init__(self, cm=None):
+        KeepAliveHandler.__init__(self, cm)
 
     def http_open(self, req):
         return self.do_open(req)
@@ -356,8 +453,8 @@ class HTTPHandler(KeepAliveHandler, urllib2.HTTPHandler):
         return HTTPConnection(host)
 
 class HTTPSHandler(KeepAliveHandler, urllib2.HTTPSHandler):
-    def __init__(self, ssl_factory=None):
-        KeepAliveHandler.__init__(self)
+    def __init__(self, ssl_factory=None, cm=None):
+        KeepAliveHandler.__init__(self, cm)
         #if not ssl_factory:
         #    ssl_factory = sslfactory.get_factory()
         #self._ssl_factory = ssl_factory
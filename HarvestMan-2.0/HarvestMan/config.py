@@ -180,7 +180,29 @@ class HarvestManStateObject(dict):
         self.subdomain = True
         self.getquerylinks = False 
         self.requests = 5
-        self.bytes = 20.00 # Not used!
+        # Flag for adapting the limit on
+        # requests for each server to the
+        # response times and errors
+        self.adaptiverequests = True
+        # Upper bound for the adaptive limit
+        self.maxrequests = 20
+        # Maximum number of idle keep-alive
+        # connections kept for a server
+        self.idleconnections = 2
+        # Time after which idle keep-alive
+        # connections are closed
+        self.idletimeout = 30.0
+        # Limits on download bandwidth in KB/sec
+        # overall and for each server, 0 means
+        # no limit
+        self.bytes = 0.0
+        self.hostbytes = 0.0
+        # Flag for saving urls which failed with
+        # errors like 404, so that they are not
+        # requested again in later runs, and flag
+        # for purging the saved urls
+        self.failedcache = True
+        self.purgefailedcache = False
         self.projtimeout = 1800.00
         self.downloadtime = 0.0
         self.locale = 'C'
@@ -188,6 +210,12 @@ class HarvestManStateObject(dict):
         self.timelimit = -1
         self.terminate = False
         self.datacache = False
+        # Interval in seconds at which the project
+        # cache is written during the crawl, and
+        # number of updated entries after which
+        # it is written sooner
+        self.cacheflushinterval = 10.0
+        self.cacheflushcount = 100
         self.urlserver = False
         self.urlhost = '127.0.0.1'
         self.urlport = 0
@@ -200,6 +228,9 @@ class HarvestManStateObject(dict):
         self.urlfile = ''
         self.maxfilesize=5242880
         self.minfilesize=0
+        # Maximum depth of nested stylesheet
+        # imports that are followed
+        self.cssimportdepth = 5
         self.format = 'xml'
         self.rawsave = False
         self.fromprojfile = False
@@ -217,6 +248,12 @@ class HarvestManStateObject(dict):
         self.randomsleep = True
         # Internal flag for asyncore
         self.useasyncore = True
+        # Flag for downloading using the asynchronous
+        # engine instead of tracker threads
+        self.asyncmode = False
+        # Maximum number of simultaneous connections
+        # for the asynchronous engine
+        self.asyncconnections = 500
         # For http compression
         self.httpcompress = True
         # Type of URLs which can be
@@ -262,6 +299,19 @@ class HarvestManStateObject(dict):
         self.hgetverbose = False
         # Hget temp flag - default False
         self.hgetnotemp = False
+        # Hget flag for writing the pieces of a multipart
+        # download into a preallocated file instead of
+        # merging temporary files - default True
+        self.hgetprealloc = True
+        # Hget number of URLs of an input file to
+        # download at a time - default 1
+        self.hgetjobs = 1
+        # Hget report file for an input file of URLs
+        self.hgetreport = ''
+        # Hget file listing mirrors, or metalink file
+        self.hgetmirrors = ''
+        # Hget expected checksum, or file listing checksums
+        self.hgetchecksum = ''
         
     def copy(self):
         # Set non-picklable objects to None type
@@ -307,6 +357,8 @@ class HarvestManStateObject(dict):
 
                          'cache_status' : ('pagecache','int'),
                          'datacache_value' : ('datacache','int'),
+                         'cacheflush_interval' : ('cacheflushinterval','float'),
+                         'cacheflush_count' : ('cacheflushcount','int'),
 
                          'urllist': ('urlfile', 'str'),
                          'urltreefile' : ('urltreefile', 'str'),
@@ -328,8 +380,13 @@ class HarvestManStateObject(dict):
                          'maxextdirs_value' : ('maxextdirs','int'),
                          'maxfiles_value' : ('maxfiles','int'),
                          'maxfilesize_value' : ('maxfilesize','int'),
+                         'cssimportdepth_value' : ('cssimportdepth','int'),
                          'connections_value' : ('connections','int'),
+                         'connections_idle' : ('idleconnections','int'),
+                         'connections_idletimeout' : ('idletimeout','float'),
                          'requests_value' : ('requests','int'),
+                         'requests_adaptive' : ('adaptiverequests','int'),
+                         'requests_max' : ('maxrequests','int'),
                          'robots_value' : ('robots','int'),
                          'timelimit_value' : ('timelimit','int'),
                          'urlpriority' : ('urlpriority','str'),
@@ -345,6 +402,8 @@ class HarvestManStateObject(dict):
                          'trackers_timeout' : ('fetchertimeout','float'),                         
                          'locale' : ('locale','str'),
                          'fastmode_value': ('fastmode','int'),
+                         'asyncmode_value': ('asyncmode','int'),
+                         'asyncmode_connections': ('asyncconnections','int'),
                          'savesessions_value': ('savesessions','int'),
                          'timegap_value': ('sleeptime', 'float'),
                          'timegap_random': ('randomsleep', 'int'),
@@ -365,6 +424,10 @@ class HarvestManStateObject(dict):
                          'urlprioritydict_value': ('urlprioritydict', 'dict'),
                          'serverprioritydict_value': ('serverprioritydict', 'dict'),
                          'http_compress' : ('httpcompress', 'int'),
+                         'bandwidth_value' : ('bytes', 'float'),
+                         'bandwidth_host' : ('hostbytes', 'float'),
+                         'failedcache_value' : ('failedcache', 'int'),
+                         'failedcache_purge' : ('purgefailedcache', 'int'),
                          'plugin_name': ('plugins','func:set_plugin')
                          }
 
@@ -662,6 +725,14 @@ class HarvestManStateObject(dict):
                     if self.check_value(option,value): self.set_option_xml('savesessions_value', self.process_value(value))
                 elif option=='simulate':
                     self.set_option_xml('simulate_value', value)
+                elif option=='asyncmode':
+                    self.set_option_xml('asyncmode_value', value)
+                elif option=='bandwidth':
+                    if self.check_value(option,value): self.set_option_xml('bandwidth_value', self.process_value(value))
+                elif option=='hostbandwidth':
+                    if self.check_value(option,value): self.set_option_xml('bandwidth_host', self.process_value(value))
+                elif option=='purgefailed':
+                    self.set_option_xml('failedcache_purge', value)
                 elif option=='plugins':
                     # Plugin is specified as plugin1+plugin2+...
                     plugins = value.split('+')
@@ -707,6 +778,21 @@ class HarvestManStateObject(dict):
                         print 'Temporary files will be saved to current directory'
                         # Do not use temporary directory for saving intermediate files
                         self.hgetnotemp = True
+                elif option=='merge':
+                    if value:
+                        # Save pieces to temporary files and merge them
+                        self.hgetprealloc = False
+                elif option=='jobs':
+                    self.hgetjobs = abs(int(value))
+                    if self.hgetjobs == 0:
+                        print 'Error: Invalid value for number of jobs, value should be non-zero!'
+                        sys.exit(1)
+                elif option=='report':
+                    self.hgetreport = value
+                elif option=='mirrors':
+                    self.hgetmirrors = value
+                elif option=='checksum':
+                    self.hgetchecksum = value
                 elif option=='output':
                     self.hgetoutfile = value
                 elif option=='outputdir':
@@ -724,6 +810,8 @@ class HarvestManStateObject(dict):
                     if self.check_value(option,value): self.set_option_xml('proxypasswd', self.process_value(value))
                 elif option=='passwd':
                     if self.check_value(option,value): self.set_option_xml('passwd', self.process_value(value))
+                elif option=='bandwidth':
+                    if self.check_value(option,value): self.set_option_xml('bandwidth_value', self.process_value(value))
                 elif option=='username':
                     if self.check_value(option,value): self.set_option_xml('username', self.process_value(value))
                 elif option == 'single':
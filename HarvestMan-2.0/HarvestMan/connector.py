@@ -69,21 +69,24 @@ import threading as tg
 
 import urllib2 
 import urlparse
-import gzip
-import cStringIO
+import zlib
+import sha
 import os
 import shutil
-import glob
 import random
 import base64
 import mirrors
+import utils
+import checksums
 
 from common.common import *
 from common.methodwrapper import MethodWrapperMetaClass
 
 from urlparser import HarvestManUrlParser, HarvestManUrlParserError
 from httplib import BadStatusLine
+from cStringIO import StringIO
 from common import keepalive
+from common import ftprange
 
 # Defining pluggable functions
 __plugins__ = { 'save_url_plugin': 'HarvestManUrlConnector:save_url' }
@@ -103,10 +106,225 @@ URL_SOCKET_ERROR = 81
 URL_GENERAL_ERROR = 91
 
 DATA_READER_EXCEPTION = 101
+DATA_DECODER_EXCEPTION = 111
 
 class DataReaderException(Exception):
     pass
 
+class DataDecoderException(Exception):
+    pass
+
+class DataSizeException(DataDecoderException):
+    pass
+
+class DataDecoder(object):
+    """ Incremental decoder for HTTP compressed (gzip or
+    deflate) data, which is fed the data block by block """
+
+    # Maximum size of data decompressed in one go. This
+    # bounds the memory used by a block of highly compressed
+    # data (a 'gzip bomb').
+    CHUNKSIZE = 1024*64
+
+    def __init__(self, encoding, maxsize=0):
+        encoding = encoding.strip().lower()
+        # Maximum size of decoded data, 0 means no limit
+        self._maxsize = maxsize
+        # Size of data fed and size of decoded data
+        self._rawsize = 0
+        self._size = 0
+        self._first = True
+        self._deflate = False
+        self._decompressor = None
+
+        if encoding.find('gzip') != -1:
+            # Offsetting window bits by 16 makes zlib
+            # expect a gzip header and trailer.
+            self._decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+        elif encoding.find('deflate') != -1:
+            self._deflate = True
+            self._decompressor = zlib.decompressobj()
+
+    def is_compressed(self):
+        """ Return whether the data is being decompressed """
+
+        return (self._decompressor != None)
+
+    def _decompress(self, block):
+        """ Decompress a block of data in bounded chunks """
+
+        chunks = []
+        while block:
+            chunk = self._decompressor.decompress(block, self.CHUNKSIZE)
+            self._check_size(len(chunk))
+            chunks.append(chunk)
+            block = self._decompressor.unconsumed_tail
+            # Data after the end of the compressed
+            # stream is ignored.
+            if self._decompressor.unused_data: break
+
+        return ''.join(chunks)
+
+    def _check_size(self, count):
+
+        self._size += count
+        if self._maxsize and self._size > self._maxsize:
+            raise DataSizeException, 'Decoded data exceeds %d bytes' % self._maxsize
+
+    def decode(self, block):
+        """ Decode a block of data and return the result """
+
+        self._rawsize += len(block)
+
+        if not self._decompressor:
+            self._check_size(len(block))
+            return block
+
+        try:
+            data = self._decompress(block)
+        except zlib.error, e:
+            # Some servers say the data is compressed when it is not,
+            # and some send 'deflate' data without the zlib header.
+            # This can only be detected at the first block.
+            if not self._first or self._size:
+                raise DataDecoderException, str(e)
+
+            if self._deflate:
+                self._deflate = False
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                self._rawsize -= len(block)
+                return self.decode(block)
+            else:
+                self._decompressor = None
+                self._check_size(len(block))
+                data = block
+
+        self._first = False
+        return data
+
+    def flush(self):
+        """ Return any decoded data left over at the end """
+
+        if self._decompressor:
+            data = self._decompressor.flush()
+            self._check_size(len(data))
+            return data
+
+        return ''
+
+    def get_sizes(self):
+        """ Return size of data fed and size of decoded data as a tuple """
+
+        return (self._rawsize, self._size)
+
+class TokenBucket(object):
+    """ Token bucket for limiting the rate of data transfer.
+    Tokens (bytes) are added at the given rate up to the
+    capacity of the bucket """
+
+    def __init__(self, rate, capacity=0):
+        # Rate in bytes per second
+        self._rate = float(rate)
+        # By default the bucket allows a burst of
+        # a quarter of a second of data.
+        self._capacity = float(capacity or max(rate/4.0, 4096))
+        self._tokens = self._capacity
+        self._timestamp = time.time()
+        self._lock = tg.Lock()
+
+    def get_capacity(self):
+        return int(self._capacity)
+
+    def reserve(self, count):
+        """ Take 'count' tokens from the bucket and return the
+        time in seconds to wait before they are available """
+
+        # Tokens can go below zero, which makes the
+        # next caller wait longer. This serves threads
+        # in the order in which they reserve tokens.
+        self._lock.acquire()
+        try:
+            t = time.time()
+            self._tokens = min(self._capacity,
+                               self._tokens + (t - self._timestamp)*self._rate)
+            self._timestamp = t
+            self._tokens -= count
+
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens/self._rate
+        finally:
+            self._lock.release()
+
+class HarvestManBandwidthThrottle(object):
+    """ Bandwidth limiter with a global token bucket and
+    a token bucket for each server """
+
+    def __init__(self, rate, hostrate):
+        # Rates in bytes per second, 0 means no limit
+        self._bucket = None
+        if rate:
+            self._bucket = TokenBucket(rate)
+        self._hostrate = hostrate
+        self._buckets = {}
+        self._lock = tg.Lock()
+        # Size of block of data read in one go,
+        # which is kept below the bucket capacity
+        # to keep the rate smooth.
+        blocksizes = [b.get_capacity() for b in (self._bucket,) if b]
+        if hostrate:
+            blocksizes.append(TokenBucket(hostrate).get_capacity())
+        self._blocksize = min(blocksizes)
+
+    def get_blocksize(self):
+        return self._blocksize
+
+    def reserve(self, server, count):
+        """ Reserve bandwidth for 'count' bytes read from the
+        server and return the time in seconds to wait """
+
+        wait = 0.0
+        if self._bucket:
+            wait = self._bucket.reserve(count)
+
+        if self._hostrate:
+            self._lock.acquire()
+            try:
+                bucket = self._buckets.get(server)
+                if bucket is None:
+                    bucket = TokenBucket(self._hostrate)
+                    self._buckets[server] = bucket
+            finally:
+                self._lock.release()
+
+            wait = max(wait, bucket.reserve(count))
+
+        return wait
+
+    def throttle(self, server, count):
+        """ Wait till 'count' bytes can be read from the server """
+
+        wait = self.reserve(server, count)
+        if wait > 0:
+            time.sleep(wait)
+
+class HarvestManRedirectHandler(urllib2.HTTPRedirectHandler):
+    """ Redirect handler which saves the statuses of the
+    redirections followed for a request on the request """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+
+        newreq = urllib2.HTTPRedirectHandler.redirect_request(self, req, fp, code,
+                                                              msg, headers, newurl)
+        if newreq is not None:
+            # The list is shared by all requests of the
+            # chain, including the original one.
+            codes = req.__dict__.setdefault('redirectcodes', [])
+            codes.append(code)
+            newreq.redirectcodes = codes
+
+        return newreq
+    
 class DataReader(tg.Thread):
     """ Data reader thread class which is used by
     the HarvestMan hget interface """
@@ -117,20 +335,38 @@ class DataReader(tg.Thread):
     CONTENTLEN = []
     MULTIPART = False
     NETDATALEN = 0
-    
-    def __init__(self, request, urltofetch, filename, clength, mode = 0, index = 0):
+    # Limits for the block size, which adapts
+    # to the measured throughput.
+    MINBLOCKSIZE = 1024*8
+    MAXBLOCKSIZE = 1024*1024
+    # A full block read faster than this grows the
+    # block size, a read slower than this times four
+    # shrinks it.
+    BLOCKTIME = 0.05
+
+    def __init__(self, request, urltofetch, filename, clength, mode = 0, index = 0, offset = 0,
+                 server = ''):
         self._request = request
-        self._data = ''
+        # Blocks of data read so far, joined only
+        # when the data is asked for.
+        self._blocks = []
         self._clength = int(clength)
         self._url = urltofetch
-        self._bs = 1024*8
+        self._bs = self.MINBLOCKSIZE
         self._start = 0.0
         self._flag = False
         # Mode: 0 => flush data to file (default)
         #     : 1 => keep data in memory
+        #     : 2 => write data into a preallocated
+        #            file, starting at 'offset'
         self._mode = mode
+        # Files are not buffered, so that the resume journal
+        # of hget never records data which is not written.
         if self._mode==0:
-            self._tmpf = open(filename, 'wb')
+            self._tmpf = open(filename, 'wb', 0)
+        elif self._mode==2:
+            self._tmpf = open(filename, 'r+b', 0)
+            self._tmpf.seek(offset)
         else:
             self._tmpf = None
         # Content-length so far
@@ -141,6 +377,22 @@ class DataReader(tg.Thread):
         self._init = False
         # Last error
         self._lasterror = None
+        # Verifier of the checksum of the data, if any
+        self._verifier = None
+        # Bandwidth throttle, if any
+        self._throttle = None
+        # Server, keyed the same as everywhere else
+        # i.e without any user/password and with the
+        # port only if it is not the default one.
+        if not server:
+            try:
+                server = HarvestManUrlParser(urltofetch).get_domain_with_port()
+            except HarvestManUrlParserError:
+                pass
+        self._server = server
+        conn = GetObject('connector')
+        if conn:
+            self._throttle = conn.get_throttle()
         tg.Thread.__init__(self, None, None, 'data reader')
 
     def initialize(self):
@@ -149,59 +401,96 @@ class DataReader(tg.Thread):
 
     def is_initialized(self):
         return self._init
-    
+
     def set_request(self, request):
         self._request = request
-        
+
+    def set_verifier(self, verifier):
+        """ Set the verifier which checks the data as it is read """
+
+        self._verifier = verifier
+
+    def get_verifier(self):
+        return self._verifier
+    
+    def set_throughput(self, rate):
+        """ Set the block size to suit the given throughput
+        in bytes per second """
+
+        bs = int(rate*self.BLOCKTIME)
+        self._bs = max(min(bs, self.MAXBLOCKSIZE), self.MINBLOCKSIZE)
+
+    def _read_block(self):
+        """ Read the next block of data. Returns False if there is
+        no more data to read and True otherwise """
+
+        bs = self._bs
+        if self._throttle:
+            bs = min(bs, self._throttle.get_blocksize())
+        if self.__class__.MULTIPART and self._clength:
+            # Do not read past the end of this piece
+            bs = min(bs, self._clength - self._contentlen)
+
+        t = time.time()
+        block = self._request.read(bs)
+        if block=='':
+            self._flag = True
+            # Close the file
+            if self._mode != 1: self.close()
+            return False
+
+        if self._mode != 1:
+            # Write data to disk straight away
+            self._tmpf.write(block)
+        else:
+            self._blocks.append(block)
+        self._contentlen += len(block)
+        if self._verifier:
+            self._verifier.update(block)
+
+        self._adapt_blocksize(len(block), time.time() - t)
+
+        if self._throttle:
+            self._throttle.throttle(self._server, len(block))
+        return True
+
+    def _adapt_blocksize(self, count, elapsed):
+        """ Adapt the block size to the time taken to read
+        the last block of 'count' bytes """
+
+        if count==self._bs and elapsed < self.BLOCKTIME:
+            # Data is coming in faster than we read it
+            self._bs = min(self._bs*2, self.MAXBLOCKSIZE)
+        elif elapsed > self.BLOCKTIME*4:
+            self._bs = max(self._bs/2, self.MINBLOCKSIZE)
+
     def run(self):
         self.initialize()
 
         while not self._flag:
             try:
-                block = self._request.read(self._bs)
-                if block=='':
-                    self._flag = True
-                    # Close the file
-                    if self._mode==0: self.close()                
+                if not self._read_block():
                     break
-                else:
-                    self._data += block
-                    self._contentlen += len(block)
-                    # Flush data to disk
-                    if self._mode==0: self.flush()
-            
             except socket.error, e:
                 self._flag = True
                 self._lasterror = e
             except Exception, e:
                 self._flag = True
                 self._lasterror = e
-                
+
     def readNext(self):
 
         try:
-            block = self._request.read(self._bs)
-            if block=='':
-                self._flag = True
-                # Close the file
-                if self._mode==0: self.close()
-                return False
-            else:
-                self._data += block
-                self._contentlen += len(block)
-                # Flush data to disk
-                if self._mode==0: self.flush()
-
+            return self._read_block()
         except socket.error, e:
             raise DataReaderException, str(e)
         except Exception, e:
-            raise DataReaderException, str(e)               
+            raise DataReaderException, str(e)
 
     def flush(self):
         """ Flush data to disk """
 
-        self._tmpf.write(self._data)
-        self._data = ''
+        self._tmpf.flush()
 
     def close(self):
 
@@ -260,13 +549,28 @@ class DataReader(tg.Thread):
         return (per, pertotal, l, bandwidth, eta)
 
     def get_data(self):
-        return self._data
+        # Join the blocks once and keep the result
+        if len(self._blocks) > 1:
+            self._blocks = [''.join(self._blocks)]
+        if self._blocks:
+            return self._blocks[0]
+        return ''
 
     def get_datalen(self):
         return self._contentlen
 
+    def set_length(self, clength):
+        """ Set the length of the data to read, used when
+        the end of a piece of a multipart download moves """
+        
+        self._clength = clength
+        
     def set_index(self, idx):
         self._index = idx
+        # Pieces split off other pieces get new indices
+        kls = self.__class__
+        if kls.MULTIPART and idx >= len(kls.CONTENTLEN):
+            kls.CONTENTLEN.extend([0]*(idx + 1 - len(kls.CONTENTLEN)))
 
     def get_index(self):
         return self._index
@@ -296,6 +600,13 @@ class HarvestManNetworkConnector(object):
         self._proxydict = {}
         # dictionary of protocol:proxy auth values
         self._proxyauth = {}
+        # Pool of keep-alive connections
+        self._connpool = None
+        # Bandwidth throttle
+        self._throttle = None
+        if self._cfg.bytes or self._cfg.hostbytes:
+            self._throttle = HarvestManBandwidthThrottle(self._cfg.bytes*1024,
+                                                         self._cfg.hostbytes*1024)
         self.configure()
         
     def set_useproxy(self, val=True):
@@ -469,13 +780,21 @@ class HarvestManNetworkConnector(object):
                 cj = cookielib.MozillaCookieJar()
                 cookiehandler = urllib2.HTTPCookieProcessor(cj)
 
-        # HTTP/HTTPS handlers
+        # HTTP/HTTPS/FTP handlers
+        ftphandler = urllib2.CacheFTPHandler
         if self._cfg.appname == 'Hget':
             httphandler = urllib2.HTTPHandler
             httpshandler = urllib2.HTTPSHandler
+            # FTP handler which supports range requests
+            # for multipart downloads
+            ftphandler = ftprange.FTPRangeHandler
         else:
-            httphandler = keepalive.HTTPHandler
-            httpshandler = keepalive.HTTPSHandler
+            # HTTP and HTTPS keep-alive connections are
+            # kept in one pool indexed on the host.
+            self._connpool = keepalive.ConnectionManager(self._cfg.idleconnections,
+                                                         self._cfg.idletimeout)
+            httphandler = keepalive.HTTPHandler(self._connpool)
+            httpshandler = keepalive.HTTPSHandler(cm=self._connpool)
             
         # If we are behing proxies/firewalls
         if self._useproxy:
@@ -514,22 +833,22 @@ class HarvestManNetworkConnector(object):
             # build opener and install it
             if self._initssl:
                 opener = urllib2.build_opener(authhandler,
-                                              urllib2.HTTPRedirectHandler,
+                                              HarvestManRedirectHandler,
                                               proxy_support,
                                               httphandler,
                                               urllib2.HTTPDefaultErrorHandler,
-                                              urllib2.CacheFTPHandler,
+                                              ftphandler,
                                               urllib2.GopherHandler,
                                               httpshandler,
                                               urllib2.FileHandler,
                                               cookiehandler)
             else:
                 opener = urllib2.build_opener(authhandler,
-                                              urllib2.HTTPRedirectHandler,
+                                              HarvestManRedirectHandler,
                                               proxy_support,
                                               httphandler,
                                               urllib2.HTTPDefaultErrorHandler,
-                                              urllib2.CacheFTPHandler,
+                                              ftphandler,
                                               urllib2.GopherHandler,
                                               urllib2.FileHandler,
                                               cookiehandler)
@@ -538,9 +857,9 @@ class HarvestManNetworkConnector(object):
             # Direct connection to internet
             if self._initssl:
                 opener = urllib2.build_opener(authhandler,
-                                              urllib2.HTTPRedirectHandler,
+                                              HarvestManRedirectHandler,
                                               httphandler,
-                                              urllib2.CacheFTPHandler,
+                                              ftphandler,
                                               httpshandler,
                                               urllib2.GopherHandler,
                                               urllib2.FileHandler,
@@ -548,9 +867,9 @@ class HarvestManNetworkConnector(object):
                                               cookiehandler)
             else:
                 opener = urllib2.build_opener( authhandler,
-                                               urllib2.HTTPRedirectHandler,
+                                               HarvestManRedirectHandler,
                                                httphandler,
-                                               urllib2.CacheFTPHandler,
+                                               ftphandler,
                                                urllib2.GopherHandler,
                                                urllib2.FileHandler,
                                                urllib2.HTTPDefaultErrorHandler,
@@ -570,6 +889,19 @@ class HarvestManNetworkConnector(object):
     def get_proxy_info(self):
         return (self._proxydict, self._proxyauth)
 
+    def get_throttle(self):
+        """ Return the bandwidth throttle, if bandwidth is limited """
+
+        return self._throttle
+    
+    def get_connection_stats(self):
+        """ Return statistics of the keep-alive connection pool """
+
+        if self._connpool:
+            return self._connpool.get_stats()
+        else:
+            return {}
+
     def increment_socket_errors(self, val=1):
         self._sockerrs += val
 
@@ -583,6 +915,21 @@ class HarvestManUrlConnector(object):
     """ Class which helps to connect to the internet """
 
     __metaclass__ = MethodWrapperMetaClass
+
+    # Smallest download for which the throughput
+    # of the server is measured.
+    MINTHROUGHPUTSIZE = 1024*64
+    # Seconds between saves of the resume
+    # journal of an hget download.
+    JOURNALINTERVAL = 2.0
+    # Number of times the pieces of an hget download
+    # which fail verification are downloaded again.
+    MAXVERIFYTRIES = 3
+    # File names taken by downloads of hget, which
+    # may not exist yet when other downloads run
+    # at the same time.
+    hgetfiles = {}
+    hgetlock = tg.Lock()
     
     def __str__(self):
         return `self` 
@@ -621,6 +968,10 @@ class HarvestManUrlConnector(object):
         self._mode = 1
         # Temporary filename if any
         self._tmpfname = ''
+        # Resume journal of hget downloads and
+        # the time it was last saved
+        self._journal = None
+        self._journaltime = 0.0
         # Status of connection
         # 0 => no connection
         # 1 => connected, download in progress
@@ -631,6 +982,23 @@ class HarvestManUrlConnector(object):
         self._acquired = True
         # Url object
         self._urlobj = None
+        # Block size for streaming data to disk
+        self._bs = 1024*64
+        # Sha digest of data streamed to disk
+        self._digest = ''
+        # Time taken for the server to respond
+        self._latency = 0.0
+        # Flag set if the server showed signs of
+        # overload, used for adapting request limits
+        self._congested = False
+        # Class of the last error, used for deciding
+        # when to try the request again, and the delay
+        # asked for by the server, if any.
+        self._retryclass = ''
+        self._retryafter = 0
+        # Bytes read from the response of the
+        # current request
+        self._bytesread = 0
         
     def __del__(self):
         del self._data
@@ -706,7 +1074,18 @@ class HarvestManUrlConnector(object):
         else:
             return self._freq
     
-    def connect(self, urltofetch, url_obj = None, fetchdata=True, retries=1, lastmodified=-1):
+    def get_num_retries(self):
+        """ Return the number of times a failed request is tried
+        again straight away. This is zero if the crawler queue
+        schedules failed URLs to be tried again later """
+
+        tq = GetObject('trackerqueue')
+        if tq and tq.can_schedule_retries():
+            return 0
+
+        return self._cfg.retryfailed
+    
+    def connect(self, urltofetch, url_obj = None, fetchdata=True, retries=1, lastmodified=-1, etag=''):
         """ Connect to the Internet fetch the data of the passed url """
 
         # This routine has four possible return values
@@ -733,6 +1112,8 @@ class HarvestManUrlConnector(object):
         
         self._numtries = 0
         three_oh_four = False
+        # Digest of the data read
+        self._digest = ''
 
         # Reset the http headers
         self._headers.clear()
@@ -748,6 +1129,9 @@ class HarvestManUrlConnector(object):
                 self._error = { 'number' : 0,
                                  'msg' : '',
                                  'fatal' : False }
+                self._retryclass = ''
+                self._retryafter = 0
+                self._bytesread = 0
 
                 self._numtries += 1
 
@@ -759,6 +1143,8 @@ class HarvestManUrlConnector(object):
                                        time.localtime(lastmodified))
                     request.add_header('If-Modified-Since', ts)
 
+                if etag:
+                    request.add_header('If-None-Match', etag)
 
                 # Check for urlobject which is trying to do
                 # multipart download.
@@ -770,10 +1156,12 @@ class HarvestManUrlConnector(object):
 
                 # If we accept http-compression, add the required header.
                 if self._cfg.httpcompress:
-                    request.add_header('Accept-Encoding', 'gzip')
+                    request.add_header('Accept-Encoding', 'gzip, deflate')
 
                 debug("Making connection to",urltofetch,"...")
-                self._freq = urllib2.urlopen(request)
+                t1 = time.time()
+                self._freq = self.open_request(request)
+                self._latency = time.time() - t1
                 debug("Made connection to",urltofetch,"...")
                 
                 # Set status to 1
@@ -781,9 +1169,18 @@ class HarvestManUrlConnector(object):
                 
                 # Set http headers
                 self.set_http_headers()
+                self._update_server_info(url_obj)
 
                 clength = int(self.get_content_length())
                 if url_obj: url_obj.clength = clength
+
+                # Check the rules on the content type and the
+                # filename before reading any data.
+                if url_obj and fetchdata and not byterange:
+                    reason = rulesmgr.check_content_headers(url_obj, self._headers)
+                    if reason:
+                        self._abort_download(url_obj, reason)
+                        return 2
                 
                 trynormal = False
                 # Check constraint on file size, dont do this on
@@ -792,6 +1189,9 @@ class HarvestManUrlConnector(object):
                 if not byterange and not self.check_content_length():
                     maxsz = self._cfg.maxfilesize
                     extrainfo("Url",urltofetch,"does not match size constraints, trying multi-part download...")
+                    # This is known if the server sent an Accept-Ranges
+                    # header for this or an earlier request, also in an
+                    # earlier run.
                     supports_multipart = dmgr.supports_range_requests(url_obj)
                     
                     # Dont do range checking on FTP servers since they
@@ -804,24 +1204,39 @@ class HarvestManUrlConnector(object):
                         self._freq = urllib2.urlopen(request)
                         # Set http headers
                         self.set_http_headers()
-                        range_result = self._headers.get('accept-ranges')
+                        range_result = self._headers.get('accept-ranges', '')
 
                         if range_result.lower()=='bytes':
                             supports_multipart = 1
                         else:
-                            extrainfo('Server %s does not support multipart downloads' % url_obj.domain)
-                            extrainfo('Aborting download of  URL %s.' % urltofetch)
-                            return 2
+                            supports_multipart = -1
+                        dmgr.update_server_info(url_obj, {'accept-ranges' : supports_multipart})
 
                     if supports_multipart==1:
                         extrainfo('Server %s supports multipart downloads' % url_obj.domain)
                         dmgr.download_multipart_url(url_obj, clength)
                         return 3
+                    elif supports_multipart==-1:
+                        extrainfo('Server %s does not support multipart downloads' % url_obj.domain)
+                        self._abort_download(url_obj, 'size')
+                        return 2
                     
                 # The actual url information is used to
                 # differentiate between directory like urls
                 # and file like urls.
                 actual_url = self._freq.geturl()
+
+                # Save the redirection, so that other links
+                # to this url are replaced by its target. It
+                # is temporary if any of its steps was.
+                codes = getattr(request, 'redirectcodes', [])
+                if codes and actual_url and url_obj:
+                    status = codes[0]
+                    for code in codes:
+                        if code not in dmgr.PERMANENTREDIRECTS:
+                            status = code
+                            break
+                    dmgr.update_redirect(urltofetch, actual_url, status)
                 
                 # Replace the urltofetch in actual_url with null
                 if actual_url:
@@ -850,6 +1265,8 @@ class HarvestManUrlConnector(object):
                             # errors.
                             url_obj.url = actual_url
                             url_obj.wrapper_resolveurl()
+                            # Links to the new url are duplicates
+                            rulesmgr.add_link(url_obj)
                     
                 # Find the actual type... if type was assumed
                 # as wrong, correct it.
@@ -864,32 +1281,34 @@ class HarvestManUrlConnector(object):
                 # Update content info on urlobject
                 self.set_content_info(url_obj)
 
-                if fetchdata:
+                if fetchdata and self.can_stream(url_obj):
+                    # Files which are not parsed are streamed
+                    # to disk instead of being read into memory
+                    encoding = self.get_content_encoding()
+                    
+                    t1 = time.time()
+                    debug("Streaming data for",urltofetch,"...")
+                    self._datalen = self._stream_data(url_obj, encoding)
+                    debug("Streamed data for",urltofetch,".")
+
+                    self._elapsed = time.time() - t1
+                    self._freq.close()
+                    self._update_server_throughput(url_obj, self._datalen)
+                    
+                elif fetchdata:
                     try:
-                        # If gzip-encoded, need to deflate data
+                        # If compressed, data is decompressed
+                        # as it is read.
                         encoding = self.get_content_encoding()
 
                         t1 = time.time()
                         debug("Reading data for",urltofetch,"...")
-                        data = self._freq.read()
+                        data = self._read_data(url_obj, encoding)
                         debug("Read data for",urltofetch,".")                        
 
                         self._elapsed = time.time() - t1
-                        
-                        # Save a reference
-                        data0 = data
                         self._freq.close()                        
-                        dmgr.update_bytes(len(data))
-                        
-                        if encoding.strip().find('gzip') != -1:
-                            try:
-                                gzfile = gzip.GzipFile(fileobj=cStringIO.StringIO(data))
-                                data = gzfile.read()
-                                gzfile.close()
-                            except (IOError, EOFError), e:
-                                data = data0
-                                #extrainfo('Error deflating HTTP compressed data:',str(e))
-                                pass
+                        self._update_server_throughput(url_obj, len(data))
                             
                     except MemoryError, e:
                         # Catch memory error for sockets
@@ -920,6 +1339,10 @@ class HarvestManUrlConnector(object):
                 except:
                     pass
 
+                # Server errors are a sign of overload
+                if errnum >= 500:
+                    self._congested = True
+                    
                 if errnum==304:
                     # Page not modified
                     three_oh_four = True
@@ -931,13 +1354,13 @@ class HarvestManUrlConnector(object):
                     break
                 if errnum == 407: # Proxy authentication required
                     self._proxy_query(1, 1)
-                elif errnum == 503: # Service unavailable
-                    rulesmgr.add_to_filter(urltofetch)
-                    self._error['fatal']=True                        
-                elif errnum == 504: # Gateway timeout
-                    rulesmgr.add_to_filter(urltofetch)
-                    self._error['fatal']=True                        
-                elif errnum in range(500, 505): # Server error
+                    self._retryclass = 'error'
+                elif errnum in (500, 502, 503, 504):
+                    # Server error, bad gateway, service unavailable
+                    # or gateway timeout, which are usually temporary.
+                    self._retryclass = 'server'
+                    self._retryafter = self._get_retry_after(e)
+                elif errnum in range(500, 506): # Server error
                     self._error['fatal']=True
                 elif errnum == 404:
                     # Link not found, this might
@@ -979,17 +1402,19 @@ class HarvestManUrlConnector(object):
                     extrainfo('URLError:',urltofetch)
 
                 errnum = self._error['number']
+                self._retryclass = 'error'
                 if errnum == 10049 or errnum == 10061: # Proxy server error
                     self._proxy_query(1, 1)
-                elif errnum == 10055:
-                    # no buffer space available
+                elif errnum == 10055 or errnum == 10054 or errnum == 104:
+                    # No buffer space available or connection reset,
+                    # the connector factory reduces the request limit
+                    # for the server.
                     self.network_conn.increment_socket_errors()
-                    # If the number of socket errors is >= 4
-                    # we decrease max connections by 1
-                    sockerrs = self.network_conn.get_socket_errors()
-                    if sockerrs>=4:
-                        self._cfg.connections -= 1
-                        self.network_conn.decrement_socket_errors(4)
+                    self._congested = True
+                    self._retryclass = 'reset'
+                elif str(e).find('timed out') != -1:
+                    self._congested = True
+                    self._retryclass = 'timeout'
 
             except IOError, e:
                 self._error['number'] = URL_IO_ERROR
@@ -1003,6 +1428,8 @@ class HarvestManUrlConnector(object):
             except BadStatusLine, e:
                 self._error['number'] = URL_BADSTATUSLINE
                 self._error['msg'] = str(e)
+                # Server closed the connection without replying
+                self._retryclass = 'reset'
                 extrainfo(e, '=> ',urltofetch)
 
             except TypeError, e:
@@ -1020,6 +1447,20 @@ class HarvestManUrlConnector(object):
                 self._error['msg'] = str(e)
                 extrainfo(e ,'=> ',urltofetch)
 
+            except DataSizeException, e:
+                # Data exceeds the maximum file size, the
+                # rest of it is not read.
+                self._abort_download(url_obj, 'size')
+                return 2
+            
+            except DataDecoderException, e:
+                # Corrupt compressed data, no
+                # point in trying again.
+                self._error['number'] = DATA_DECODER_EXCEPTION
+                self._error['msg'] = str(e)
+                self._error['fatal'] = True
+                extrainfo('Error decoding data: ', e, '=> ',urltofetch)
+
             except socket.error, e:
                 self._error['msg'] = str(e)
                 self._error['number'] = URL_SOCKET_ERROR
@@ -1027,30 +1468,34 @@ class HarvestManUrlConnector(object):
 
                 extrainfo('Socket Error: ', errmsg,'=> ',urltofetch)
 
-                if errmsg.lower().find('connection reset by peer') != -1:
+                errmsg = errmsg.lower()
+                self._retryclass = 'error'
+                if errmsg.find('connection reset by peer') != -1:
                     # Connection reset by peer (socket error)
                     self.network_conn.increment_socket_errors()
-                    # If the number of socket errors is >= 4
-                    # we decrease max connections by 1
-                    sockerrs = self.network_conn.get_socket_errors()
-
-                    if sockerrs>=4:
-                        self._cfg.connections -= 1
-                        self.network_conn.decrement_socket_errors(4)
+                    self._congested = True
+                    self._retryclass = 'reset'
+                elif errmsg.find('timed out') != -1:
+                    self._congested = True
+                    self._retryclass = 'timeout'
             except Exception, e:
                 self._error['msg'] = str(e)
                 self._error['number'] = URL_GENERAL_ERROR
+                self._retryclass = 'error'
                 errmsg = self._error['msg']
             
                 extrainfo('General Error: ', errmsg,'=> ',urltofetch)
                 
             # attempt reconnect after some time
-            time.sleep(self._sleeptime)
+            if self._numtries <= retries and not self._error['fatal']:
+                time.sleep(self._sleeptime)
 
         
         if data: self._data = data
 
-        if url_obj and url_obj.status != 0:
+        # Save the error on the url object, the status
+        # was set to zero if the download succeeded.
+        if url_obj and self._error['number']:
             url_obj.status = self._error['number']
             url_obj.fatal = self._error['fatal']
 
@@ -1058,11 +1503,241 @@ class HarvestManUrlConnector(object):
         if three_oh_four:
             return 1
             
-        if data:
+        if data or self._tmpfname:
             return 0
         else:
             return -1
 
+    def open_request(self, request):
+        """ Open the request and return the response object """
+
+        return urllib2.urlopen(request)
+
+    def _abort_download(self, urlobj, reason):
+        """ Abort the download of the url object for the passed
+        reason, which is one of 'size', 'type' or 'name', without
+        reading the rest of the data """
+
+        extrainfo('Aborting download of URL', urlobj.get_full_url(), '(%s)' % reason)
+
+        dmgr = GetObject('datamanager')
+        if dmgr:
+            dmgr.update_counter('_aborted' + reason)
+            dmgr.update_counter('_abortedbytes', self._bytesread)
+
+        self._close_connection()
+
+    def _close_connection(self):
+        """ Close the response and its connection. A persistent
+        connection with unread data cannot be reused, so it is
+        not returned to the pool of keep-alive connections """
+
+        try:
+            if hasattr(self._freq, 'close_connection'):
+                self._freq.close_connection()
+            else:
+                self._freq.close()
+        except Exception, e:
+            debug('Error closing response:', str(e))
+
+    def _update_server_info(self, urlobj):
+        """ Save the capabilities of the server of the url
+        object, as seen from the response headers """
+
+        dmgr = GetObject('datamanager')
+        if not dmgr or not urlobj: return
+
+        d = {}
+        ranges = self._headers.get('accept-ranges', '').lower()
+        if ranges == 'bytes':
+            d['accept-ranges'] = 1
+        elif ranges == 'none':
+            d['accept-ranges'] = -1
+
+        encoding = self._headers.get('content-encoding', '').lower()
+        if encoding in ('gzip', 'deflate'):
+            d['compression'] = encoding
+
+        # Responses read over persistent connections
+        # know whether the server closes the connection.
+        will_close = getattr(self._freq, 'will_close', None)
+        if will_close is not None:
+            d['keep-alive'] = (will_close and -1) or 1
+
+        if self._latency:
+            d['latency'] = self._latency
+
+        dmgr.update_server_info(urlobj, d)
+
+    def _update_server_throughput(self, urlobj, count):
+        """ Save the throughput of the server of the url object
+        for a download of 'count' bytes """
+
+        # Small downloads mostly measure the latency
+        if count < self.MINTHROUGHPUTSIZE or self._elapsed <= 0:
+            return
+
+        dmgr = GetObject('datamanager')
+        if dmgr and urlobj:
+            dmgr.update_server_info(urlobj, {'throughput' : float(count)/self._elapsed})
+        
+    def _get_retry_after(self, e):
+        """ Return the delay in seconds asked for by the
+        server in the Retry-After header of the HTTP error """
+
+        try:
+            return max(int(e.hdrs.get('retry-after')), 0)
+        except (AttributeError, TypeError, ValueError):
+            return 0
+
+    def get_retry_info(self):
+        """ Return a tuple of the class of the last error and
+        the delay asked for by the server before trying again.
+        The class is one of 'timeout', 'server', 'reset' or
+        'error', and is empty if the request should not be
+        tried again """
+
+        if self._error['fatal']:
+            return ('', 0)
+        
+        return (self._retryclass, self._retryafter)
+
+    def can_stream(self, urlobj):
+        """ Return whether the data of the URL object can be
+        streamed to disk instead of being kept in memory """
+
+        # Web pages and stylesheets are parsed for links,
+        # so they are always kept in memory.
+        if urlobj is None or urlobj.is_webpage() or urlobj.is_stylesheet():
+            return False
+
+        # Pieces of a multipart download are joined
+        # in memory, unless data is flushed.
+        if urlobj.trymultipart and self._mode==1:
+            return False
+
+        return True
+    
+    def _read_block(self, urlobj):
+        """ Read a block of data of the current request, keeping
+        within the bandwidth limits if any """
+
+        throttle = self.network_conn.get_throttle()
+        if not throttle:
+            block = self._freq.read(self._bs)
+            self._bytesread += len(block)
+            return block
+
+        block = self._freq.read(min(self._bs, throttle.get_blocksize()))
+        self._bytesread += len(block)
+        if block and urlobj:
+            throttle.throttle(urlobj.get_domain_with_port(), len(block))
+        elif block:
+            throttle.throttle('', len(block))
+            
+        return block
+    
+    def _get_max_size(self, urlobj):
+        """ Return the maximum size of the decoded data of the
+        url object, 0 if there is no limit """
+
+        # Pieces of a multipart download are not limited,
+        # the download is multipart because the file is
+        # larger than the maximum size.
+        if urlobj and urlobj.range:
+            return 0
+        return self._cfg.maxfilesize
+    
+    def _read_data(self, urlobj, encoding):
+        """ Read data of the current request in blocks, decompressing
+        it on the fly if required, and return it """
+
+        dmgr = GetObject('datamanager')
+        decoder = DataDecoder(encoding, self._get_max_size(urlobj))
+        sh = sha.new()
+        blocks = []
+
+        while True:
+            block = self._read_block(urlobj)
+            if block=='': break
+
+            dmgr.update_bytes(len(block))
+            block = decoder.decode(block)
+            sh.update(block)
+            blocks.append(block)
+
+        block = decoder.flush()
+        sh.update(block)
+        blocks.append(block)
+        self.update_compression_stats(decoder)
+
+        self._digest = sh.hexdigest()
+        return ''.join(blocks)
+
+    def _stream_data(self, urlobj, encoding):
+        """ Read data of the current request in blocks and write it
+        to a temporary file, decompressing it on the fly if required.
+        Return the length of the data written """
+
+        dmgr = GetObject('datamanager')
+        decoder = DataDecoder(encoding, self._get_max_size(urlobj))
+
+        directory = self._cfg.projdir
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._tmpfname = self.make_tmp_fname(urlobj.get_filename(), directory)
+        sh = sha.new()
+        datalen = 0
+
+        try:
+            tmpf = open(self._tmpfname, 'wb')
+            try:
+                while True:
+                    block = self._read_block(urlobj)
+                    if block=='': break
+
+                    dmgr.update_bytes(len(block))
+                    block = decoder.decode(block)
+
+                    sh.update(block)
+                    tmpf.write(block)
+                    datalen += len(block)
+
+                block = decoder.flush()
+                sh.update(block)
+                tmpf.write(block)
+                datalen += len(block)
+            finally:
+                tmpf.close()
+        except:
+            self.discard_tmpfile()
+            raise
+
+        self.update_compression_stats(decoder)
+        self._digest = sh.hexdigest()
+        return datalen
+
+    def update_compression_stats(self, decoder):
+        """ Update compression statistics on the data manager
+        from the passed decoder object """
+
+        if decoder.is_compressed():
+            dmgr = GetObject('datamanager')
+            rawsize, size = decoder.get_sizes()
+            dmgr.update_counter('_compressedbytes', rawsize)
+            dmgr.update_counter('_decompressedbytes', size)
+
+    def discard_tmpfile(self):
+        """ Remove the temporary file data was streamed to, if any """
+
+        if self._tmpfname:
+            try:
+                os.remove(self._tmpfname)
+            except OSError, e:
+                pass
+            self._tmpfname = ''
+
     def set_progress_object(self, topic, n=0, subtopics=[], nolengthmode=False):
         """ Set the progress bar object with the given topic
         and sub-topics """
@@ -1095,6 +1770,57 @@ class HarvestManUrlConnector(object):
         else:
             pass
             
+    def preallocate(self, filename, size):
+        """ Create the file 'filename' with a size of 'size'
+        bytes. Return True on success and False otherwise """
+
+        try:
+            f = open(filename, 'wb')
+            # Extending the file does not write any data,
+            # on most file systems this creates a sparse file.
+            f.truncate(size)
+            f.close()
+            return True
+        except (IOError, OSError), e:
+            extrainfo('Error in preallocating file',filename,'=>',e)
+            return False
+
+    def save_journal(self, urlobj, interval=0):
+        """ Save the byte ranges of the url object downloaded so
+        far to the resume journal, if it was last saved more than
+        'interval' seconds ago. Returns True if it was saved """
+
+        journal = self._journal
+        if not journal or not journal.datafile:
+            return False
+
+        t = time.time()
+        if t - self._journaltime < interval:
+            return False
+        self._journaltime = t
+
+        if urlobj.trymultipart:
+            pool = GetObject('datamanager').get_url_threadpool()
+            journal.add_ranges(pool.get_segment_ranges(urlobj))
+        elif self._reader:
+            journal.add_ranges([(0, self._reader.get_datalen())])
+
+        return journal.write()
+    
+    def discard_journal(self):
+        """ Remove the resume journal and the data of the
+        unfinished download it belongs to """
+
+        journal = self._journal
+        if not journal: return
+        
+        if journal.datafile and os.path.isfile(journal.datafile):
+            try:
+                os.remove(journal.datafile)
+            except OSError, e:
+                print e
+        journal.remove()
+        
     def make_tmp_fname(self, filename, directory='.'):
         """ Create a temporary filename for download """
 
@@ -1133,6 +1859,8 @@ class HarvestManUrlConnector(object):
         # -1 => Could not connect to URL and download data due
         #       to some error.
         # 0 => Downloaded URL and got data without error.
+        # 4 => Not resuming since the file on the server is
+        #      not the file of the resume journal.
         
         data = '' 
         # print 'Resuming',resuming
@@ -1177,17 +1905,20 @@ class HarvestManUrlConnector(object):
                         
                     request.add_header('Range','bytes=%d-%d' % (range1,range2))
                 
+                t1 = time.time()
                 self._freq = urllib2.urlopen(request)
+                self._latency = time.time() - t1
 
                 # Set status to 1
                 self._status = 1
 
                 acturl = self._freq.geturl()
-                if acturl != urltofetch:
+                if acturl != urltofetch and showprogress:
                     logconsole('Redirected to %s...' % acturl)
                 
                 # Set http headers
                 self.set_http_headers()
+                self._update_server_info(urlobj)
 
                 encoding = self.get_content_encoding()
                 ctype = self.get_content_type()
@@ -1203,24 +1934,55 @@ class HarvestManUrlConnector(object):
                     clength_str = '%d bytes' % clength
 
                 if resuming or (not urlobj.range):
-                    if clength:
-                        logconsole('Length: %d (%s) Type: %s' % (clength, clength_str, ctype))
-                        nolengthmode = False
-                    else:
-                        logconsole('Length: (%s) Type: %s' % (clength_str, ctype))
-                        nolengthmode = True
+                    nolengthmode = not clength
+                    if showprogress:
+                        if clength:
+                            logconsole('Length: %d (%s) Type: %s' % (clength, clength_str, ctype))
+                        else:
+                            logconsole('Length: (%s) Type: %s' % (clength_str, ctype))
+
+                        logconsole('Content Encoding: %s\n' % encoding)
+
+                    # The pieces of the data are verified
+                    # against the length of the whole file.
+                    if urlobj.checksum:
+                        urlobj.checksum.length = clength
 
-                    logconsole('Content Encoding: %s\n' % encoding)
+                if resuming:
+                    if not self._journal.matches(self._headers, clength):
+                        return 4
+
+                    # The data is downloaded by the pieces
+                    self._close_connection()
+
+                    # Download the missing byte ranges in parallel
+                    # into the file of the unfinished download.
+                    missing = self._journal.get_missing_ranges()
+                    if showprogress:
+                        logconsole('Resuming download, %d of %d bytes left...' % (sum([y - x for x, y in missing]), clength))
+                    urlobj.trymultipart = True
+                    self._cfg.multipart = True
+
+                    dmgr.download_multipart_ranges(urlobj, missing)
+                    if showprogress:
+                        self.set_progress_object(filename,1,[filename],nolengthmode)
+                    return 2
+                elif self._journal and not byterange:
+                    # Only downloads from servers which accept
+                    # range requests can be resumed.
+                    if clength and dmgr.supports_range_requests(urlobj)==1:
+                        self._journal.start(urltofetch, self._headers, clength)
+                    else:
+                        self._journal = None
 
                 # FTP servers do not support HTTP like byte-range
-                # requests. The way to do multipart for FTP is to use
-                # the FTP restart (REST) command, but that requires writing
-                # new wrappers on top of ftplib instead of the current simpler
-                # way of routing everything using urllib2. This is planned
-                # for later.
+                # requests. The FTP handler of hget sends the range
+                # as a restart (REST) offset instead, and sets the
+                # Accept-Ranges header if the server supports it.
                 
-                if urlobj.protocol == 'ftp://':
-                    logconsole('FTP request, not trying multipart download, defaulting to single thread')
+                if urlobj.protocol == 'ftp://' and dmgr.supports_range_requests(urlobj) != 1:
+                    if showprogress:
+                        logconsole('FTP server does not support restarting transfers, not trying multipart download, defaulting to single thread')
                     trynormal = True
                 else:
                     trynormal = False
@@ -1231,22 +1993,35 @@ class HarvestManUrlConnector(object):
                     if self._cfg.forcesplit:
                         logconsole('Forcing download into %d parts' % self._cfg.numparts)
                         
-                    if (not self._headers.get('accept-ranges', '').lower() == 'bytes') and \
+                    # This is known if the server sent an Accept-Ranges
+                    # header, also for an earlier request or run.
+                    supports_multipart = dmgr.supports_range_requests(urlobj)
+                    
+                    if supports_multipart != 1 and \
                            not mirrors.is_multipart_download_supported(urlobj):
-                        logconsole('Checking whether server supports multipart downloads...')
-                        # See if the server supports 'Range' header
-                        # by requesting half the length
-                        self._headers.clear()
-                        request.add_header('Range','bytes=%d-%d' % (0,clength/2))
-                        self._freq.close()                        
-                        self._freq = urllib2.urlopen(request)
-
-                        # Set http headers
-                        self.set_http_headers()
-                        range_result = self._headers.get('accept-ranges', '')
-                        if range_result.lower()=='bytes':
+                        probed = False
+                        if supports_multipart == 0:
+                            logconsole('Checking whether server supports multipart downloads...')
+                            # See if the server supports 'Range' header
+                            # by requesting half the length
+                            self._headers.clear()
+                            request.add_header('Range','bytes=%d-%d' % (0,clength/2))
+                            self._close_connection()
+                            self._freq = urllib2.urlopen(request)
+                            probed = True
+
+                            # Set http headers
+                            self.set_http_headers()
+                            range_result = self._headers.get('accept-ranges', '')
+                            if range_result.lower()=='bytes':
+                                supports_multipart = 1
+                            else:
+                                supports_multipart = -1
+                            dmgr.update_server_info(urlobj, {'accept-ranges' : supports_multipart})
+                            
+                        if supports_multipart == 1:
                             logconsole('Server supports multipart downloads')
-                            self._freq.close()
+                            self._close_connection()
                         else:
                             logconsole('Server does not support multipart downloads')
                             resp = raw_input('Do you still want to download this URL [y/n] ?')
@@ -1254,25 +2029,56 @@ class HarvestManUrlConnector(object):
                                 logconsole('Aborting download.')
                                 return 3
                             else:
-                                # Create a fresh request object
-                                self._freq.close()
-                                request = self.create_request(urltofetch)
-                                self._freq = urllib2.urlopen(request)
+                                if probed:
+                                    # Create a fresh request object
+                                    self._close_connection()
+                                    request = self.create_request(urltofetch)
+                                    self._freq = urllib2.urlopen(request)
 
                                 logconsole('Downloading URL %s...' % urltofetch)
                                 trynormal = True
                     else:
                         logconsole('Server supports multipart downloads')
+                        self._close_connection()
 
                     if not trynormal:
                         logconsole('Trying multipart download...')
                         urlobj.trymultipart = True
+
+                        # Fall back to temporary files for the pieces
+                        # if the output file cannot be preallocated.
+                        if urlobj.partfile and not self.preallocate(urlobj.partfile, clength):
+                            urlobj.partfile = ''
+
+                        # Pieces saved to temporary files
+                        # are not resumed.
+                        if self._journal and urlobj.partfile:
+                            self._journal.datafile = os.path.abspath(urlobj.partfile)
+                        else:
+                            self._journal = None
+                        
+                        # Set flag which indicates a multipart
+                        # download is in progress. This has to be
+                        # set before the pieces start downloading.
+                        self._cfg.multipart = True
                         
                         ret = dmgr.download_multipart_url(urlobj, clength)
-                        if ret==0:
-                            # Set flag which indicates a multipart
-                            # download is in progress
-                            self._cfg.multipart = True
+                        if ret != 0:
+                            # No pieces were started, fall back
+                            # to a download in a single piece.
+                            self._cfg.multipart = False
+                            urlobj.trymultipart = False
+                            if urlobj.partfile:
+                                try:
+                                    os.remove(urlobj.partfile)
+                                except OSError, e:
+                                    pass
+                                urlobj.partfile = ''
+
+                            logconsole('Downloading URL %s...' % urltofetch)
+                            request = self.create_request(urltofetch)
+                            self._freq = urllib2.urlopen(request)
+                        else:
                             # Set progress object
                             if showprogress:
                                 self.set_progress_object(filename,1,[filename],nolengthmode)
@@ -1296,7 +2102,10 @@ class HarvestManUrlConnector(object):
                     ct = threading.currentThread()
 
                     # Only set tmpfname if this is a fresh download.
-                    if self._tmpfname=='':
+                    if self._tmpfname=='' and byterange and urlobj.partfile:
+                        # All pieces write into the same file
+                        self._tmpfname = urlobj.partfile
+                    elif self._tmpfname=='':
                         if not self._cfg.hgetnotemp:
                             tmpd = os.path.join(GetMyTempDir(), str(abs(hash(urlobj.get_full_url()))))
                         else:
@@ -1304,6 +2113,8 @@ class HarvestManUrlConnector(object):
                             
                         self._tmpfname = self.make_tmp_fname(filename, tmpd)
                         # print 'My temp fname=>',self._tmpfname
+                        if self._journal:
+                            self._journal.datafile = os.path.abspath(self._tmpfname)
 
                         debug(self._tmpfname, ct)
                     else:
@@ -1313,11 +2124,29 @@ class HarvestManUrlConnector(object):
                         ct.set_tmpfname(self._tmpfname)
 
                     if self._reader==None:
+                        mode, offset = self._mode, 0
+                        if byterange and urlobj.partfile:
+                            # Write at the offset of this piece
+                            mode, offset = 2, byterange[0]
+                            
                         self._reader = DataReader(self._freq,
                                                   urltofetch,
                                                   self._tmpfname,
                                                   clength,
-                                                  self._mode)
+                                                  mode,
+                                                  offset=offset,
+                                                  server=urlobj.get_domain_with_port())
+                        # Start with a block size which suits the
+                        # throughput seen from the server before.
+                        throughput = dmgr.get_server_info(urlobj).get('throughput', 0)
+                        if throughput:
+                            self._reader.set_throughput(throughput)
+                        # Verify the data as it is read, the
+                        # data of a piece starts at its range.
+                        if urlobj.checksum:
+                            pos = 0
+                            if byterange: pos = byterange[0]
+                            self._reader.set_verifier(urlobj.checksum.new_verifier(pos))
                     else:
                         self._reader.set_request(self._freq)
 
@@ -1337,13 +2166,28 @@ class HarvestManUrlConnector(object):
                             self._reader.start()
 
                     t1 = time.time()
-
+                    pool = dmgr.get_url_threadpool()
+                    
                     while True:
                         if self._cfg.multipart:
+                            # Another thread can take over the tail
+                            # of this piece, which moves its end back.
+                            end = pool.update_segment(urlobj, self._reader.get_datalen())
+                            self._reader.set_length(end - byterange[0])
                             self._reader.readNext()
+                        else:
+                            # Wait for the reader thread instead of
+                            # spinning, which slows down the other
+                            # threads of a batch download. The join
+                            # returns as soon as the reader is done,
+                            # else after 0.1 seconds, so that the
+                            # progress and the journal are still
+                            # updated while the data comes in.
+                            self._reader.join(0.1)
+                            self.save_journal(urlobj, self.JOURNALINTERVAL)
 
                         # Get number of active worker threads...
-                        nthreads = dmgr.get_url_threadpool().get_busy_count()
+                        nthreads = pool.get_busy_count()
                         # If no active worker threads, then there is at least
                         # the main thread which is active
                         if nthreads==0: nthreads = 1
@@ -1385,7 +2229,23 @@ class HarvestManUrlConnector(object):
                             mypercent += 2.0
                             if mypercent==100.0: mypercent=0.0
 
+                    if not self._cfg.multipart:
+                        # The reader thread may not have stored
+                        # the last block yet.
+                        self._reader.join()
+                        
                     self._elapsed = time.time() - t1
+                    self._update_server_throughput(urlobj, self._reader.get_datalen())
+
+                    # A piece stops at the end of its range without
+                    # reading till EOF, so the file is still open.
+                    if self._reader._mode==2:
+                        self._reader.close()
+
+                    # The tail of a piece which another thread took
+                    # over is not read, so the connection is closed.
+                    if self._cfg.multipart and end < byterange[-1] + 1:
+                        self._close_connection()
 
                     if self._reader._mode==1:
                         if not resuming:
@@ -1555,6 +2415,8 @@ class HarvestManUrlConnector(object):
             # Sometimes this could be two numbers
             # separated by commas.
             return clength.split(',')[0].strip()
+        elif self._tmpfname:
+            return self._datalen
         else:
             return len(self._data)
 
@@ -1650,6 +2512,24 @@ class HarvestManUrlConnector(object):
     def _write_url_filename(self, filename):
         """ Write downloaded data to the passed file """
 
+        # Data streamed to a temporary file, move it
+        # in place with a rename.
+        if self._tmpfname:
+            try:
+                extrainfo('Writing file ', filename)
+                try:
+                    os.rename(self._tmpfname, filename)
+                except OSError, e:
+                    # Target exists (Windows) or is on another device
+                    shutil.move(self._tmpfname, filename)
+            except (IOError, OSError), e:
+                debug('IO Exception' , str(e))
+                self.discard_tmpfile()
+                return 0
+
+            self._tmpfname = ''
+            return 1
+        
         if self._data=='':
             return 0
 
@@ -1674,29 +2554,47 @@ class HarvestManUrlConnector(object):
             return self.connect2(urlobj)
         else:
             url = urlobj.get_full_url()
-            # See if this URL is in cache, then get its lmt time & data
+            # See if this URL is in cache, then get its validators
             dmgr=GetObject('datamanager')
 
-            lmt,cache_data = dmgr.get_last_modified_time_and_data(urlobj)
-            return self.connect(url, urlobj, True, self._cfg.retryfailed, lmt)            
+            lmt, etag = dmgr.get_url_validators(urlobj)
+            return self.connect(url, urlobj, True, self.get_num_retries(), lmt, etag)            
                         
     def save_url(self, urlobj):
         """ Download data from the url <url> and write to
         the file <filename> """
 
         self._urlobj = urlobj
+
+        # Batch downloads of hget
+        if self._cfg.nocrawl:
+            start, res = time.time(), 0
+            try:
+                res = self.url_to_file(urlobj, False)
+            finally:
+                urlobj.hgetresult = (res, self._datalen or len(self._data), time.time() - start)
+            return res
         
         # Rearranged this to take care of http 304
         url = urlobj.get_full_url()
 
-        # See if this URL is in cache, then get its lmt time & data
+        # See if this URL is in cache, then get its validators
         dmgr=GetObject('datamanager')
-        lmt,cache_data = dmgr.get_last_modified_time_and_data(urlobj)
-        res = self.connect(url, urlobj, True, self._cfg.retryfailed, lmt)
+        lmt, etag = dmgr.get_url_validators(urlobj)
+        res = self.connect(url, urlobj, True, self.get_num_retries(), lmt, etag)
         debug('RES=>',res)
+
+        # The links of a page which is not modified are crawled
+        # from the cache. If they were not saved, as by an older
+        # run, the page is downloaded again for parsing.
+        if res==1 and (lmt != -1 or etag) and \
+               (urlobj.is_webpage() or urlobj.is_stylesheet()) and \
+               dmgr.get_url_links(urlobj) is None:
+            extrainfo('No saved links for', url, ', downloading it again')
+            res = self.connect(url, urlobj, True, self.get_num_retries())
         
         # If it was a rules violation, skip it
-        if res==2: return res
+        if res==2: return 5
 
         # If this became a request for multipart download
         # wait for the download to complete.
@@ -1706,6 +2604,10 @@ class HarvestManUrlConnector(object):
             while not pool.get_multipart_download_status(urlobj):
                 time.sleep(1.0)
 
+            if pool.get_multipart_download_failed(urlobj):
+                extrainfo('Multipart download of', url, 'failed')
+                return 0
+
             data = pool.get_multipart_url_data(urlobj)
             self._data = data
 
@@ -1733,8 +2635,11 @@ class HarvestManUrlConnector(object):
             # so nothing to be done.
             if res==1:
                 extrainfo("Project cache is uptodate =>", url)
-                # Set the data as cache-data
-                self._data = cache_data
+                # Set the data as cache-data, if it was cached.
+                # Otherwise the file on the disk is reused, and
+                # the links found in it before are crawled.
+                lmt, self._data = dmgr.get_last_modified_time_and_data(urlobj)
+                urlobj.notmodified = True
                 return 3
             
             # Most of the web-servers will work with above logic. For
@@ -1757,16 +2662,18 @@ class HarvestManUrlConnector(object):
                     # No need to download
                     if update and fileverified:
                         extrainfo("Project cache is uptodate =>", url)
+                        self.discard_tmpfile()
                         return 3                        
                 except ValueError, e:
                     pass
 
             else:
                 datalen = self.get_content_length()
-                update, fileverified = dmgr.is_url_cache_uptodate(urlobj, filename, datalen, self._data)
+                update, fileverified = dmgr.is_url_cache_uptodate(urlobj, filename, datalen, self._data, self._digest)
                 # No need to download
                 if update and fileverified:
                     extrainfo("Project cache is uptodate =>", url)
+                    self.discard_tmpfile()
                     return 3
 
             # If cache is up to date, but someone has deleted
@@ -1774,6 +2681,7 @@ class HarvestManUrlConnector(object):
             # write file from the cache.
             if update and not fileverified:
                 if dmgr.write_file_from_cache(urlobj):
+                    self.discard_tmpfile()
                     return 4
         else:
             # If no cache was loaded, then create the cache.
@@ -1785,9 +2693,13 @@ class HarvestManUrlConnector(object):
                     pass
             else:
                 datalen = self.get_content_length()
-                dmgr.wrapper_update_cache_for_url(urlobj, filename, datalen, self._data)
-
+                dmgr.wrapper_update_cache_for_url(urlobj, filename, datalen, self._data, self._digest)
 
+        # Save the validators for revalidating
+        # the url in the next crawl.
+        dmgr.update_url_validators(urlobj, self._headers.get('etag', ''), timestr,
+                                   self.get_content_length())
+        
         retval = self._write_url(urlobj)
             
         return retval
@@ -1847,25 +2759,46 @@ class HarvestManUrlConnector(object):
             return -1
             print e        
     
-    def url_to_file(self, urlobj):
+    def url_to_file(self, urlobj, showprogress=True):
         """ Save the contents of this url <url> to the file <filename>.
-        This is used by the -N option of HarvestMan """
+        This is used by the -N option of HarvestMan. If showprogress
+        is False, only errors are printed """
 
         if self._cfg.hgetoutfile:
             n, filename = 1, self._cfg.hgetoutfile
         else:
             n, filename = 1, urlobj.get_filename()
 
+        if self._cfg.hgetoutdir != '.':
+            outdir = self._cfg.hgetoutdir
+            if not os.path.isdir(outdir):
+                try:
+                    os.makedirs(outdir)
+                    # If an output director is specified, strip any directory
+                    # part from the filename
+                    filename = os.path.join(outdir, os.path.split(filename)[1]) 
+                except OSError, e:
+                    print 'Error in creating directory',e
+            else:
+                filename = os.path.join(outdir, os.path.split(filename)[1])
+
         origfilename = filename
         # filename.#n like wget.
-        while os.path.isfile(filename):
-            filename = ''.join((origfilename,'.',str(n)))
-            n += 1
+        self.hgetlock.acquire()
+        try:
+            while os.path.isfile(filename) or filename in self.hgetfiles:
+                filename = ''.join((origfilename,'.',str(n)))
+                n += 1
+            self.hgetfiles[filename] = True
+        finally:
+            self.hgetlock.release()
 
-        currtmpfiles = []
         resuming = False
         fullurl = urlobj.get_full_url()
 
+        if urlobj.checksum is None:
+            urlobj.checksum = checksums.find_checksum(urlobj.get_filename())
+
         # Create temp folders for download
         if not self._cfg.hgetnotemp:
             tmpd = os.path.join(GetMyTempDir(), str(abs(hash(fullurl))))
@@ -1881,121 +2814,159 @@ class HarvestManUrlConnector(object):
             tmpd =  '.'
             
         # Check if a previous unfinished download exists
-        # if so, only read from where we left off from
-        # previous download.
-        flist = glob.glob(os.path.join(tmpd, ''.join(('.', origfilename, '#*'))))
-        # print 'Flist=>',flist
-        # Check if there is an info file containing the headers
-        infof = os.path.join(tmpd, ''.join((".info#",
-                                            str(abs(hash(urlobj.get_full_url()))))))
-
-        if flist:
-            # Sort the files according to creation times
-            tmpcflist = [(os.path.getctime(fname), fname) for fname in flist]
-            tmpcflist.sort()
-            # print 'Sorted list=>',tmpcflist
-            cflist = [item[1] for item in tmpcflist]
+        # if so, only download the byte ranges which are
+        # missing, in parallel using the threads of the pool.
+        # Data kept in memory cannot be resumed.
+        self._journal = None
+        if self._mode==0 and not self._cfg.nomultipart:
+            journalf = os.path.join(tmpd, ''.join((".journal#", str(abs(hash(fullurl))))))
+            self._journal = utils.HarvestManResumeJournal(journalf)
             
-            if os.path.isfile(infof):
-                print 'Temporary files from previous download found, trying to resume download...'
-                # We can proceed only if this file is there, since it contains
-                # all the header information of the previous attempt.
-                try:
-                    hdict = eval(open(infof).read())
-                    # print 'Header dict=>',hdict
-                    # Get content length
-                    clength = hdict.get('content-length','')
-                    if clength: clength = int(clength)
-                    if clength:
-                        if len(cflist)>=3:
-                            print 'Warning: 3 or more temporary files found. Final file may have errors!'
-                        totsz = sum([os.path.getsize(fname) for fname in cflist])
-                        # Get difference in sizes
-                        sztoget = clength - totsz
-                        # If nothing to get, just save the temp file to
-                        # original
-                        if sztoget==0:
-                            ret = self.write_data_from_tempfiles(cflist, filename)
-                            if ret==0:
-                                print '\nSaved to %s.' % filename
-                                print 'No data was downloaded, data already present in temporary file for this URL'
-                                return 1
-                        else:
-                            # Append filename to list of current temp files
-                            # and set resuming to True
-                            if self._mode==0:
-                                currtmpfiles = cflist
-                            elif self._mode==1:
-                                for tmpf in cflist:
-                                    try:
-                                        self._data += open(tmpf, 'rb').read()
-                                    except IOError, e:
-                                        print e
-
-                                self._datalen = len(self._data)
-                                # print 'Datalen=>',self._datalen
-                                
-                            resuming = True
-                            # print 'Fize=>',totsz,clength
-                            urlobj.range = xrange(totsz, clength+1)
-                            # self._cfg.multipart = True                                    
-                            print 'Resuming download...'
-                except SyntaxError, e:
-                    print 'Error reading URL info file, cannot resume previous download...'
-                    pass
+            if self._journal.read() and self._journal.url==fullurl and \
+                   os.path.isfile(self._journal.datafile):
+                if showprogress:
+                    print 'Unfinished download found with %d of %d bytes, trying to resume download...' % \
+                          (self._journal.get_datalen(), self._journal.length)
+                resuming = True
+                urlobj.partfile = self._journal.datafile
+                
+        # In flush mode the pieces of a multipart download
+        # are written straight into a file preallocated to
+        # the full length, which needs no merging at the end.
+        if self._mode==0 and self._cfg.hgetprealloc and not resuming:
+            urlobj.partfile = filename + '.part'
 
         url = urlobj.get_full_url()
-        logconsole('Connecting to %s...' % urlobj.get_full_domain())
+        if showprogress:
+            logconsole('Connecting to %s...' % urlobj.get_full_domain())
 
         start = time.time()
-        ret = self.connect2(urlobj,resuming=resuming)
+        if resuming and not self._journal.get_missing_ranges():
+            if showprogress:
+                print 'No data to download, data already present in temporary file for this URL'
+            ret = 0
+            self._tmpfname = urlobj.partfile
+            self._datalen = self._journal.length
+        else:
+            ret = self.connect2(urlobj,showprogress,resuming)
+
+        if ret==4:
+            # Download the file again if it changed on the
+            # server since the download was interrupted.
+            print 'File has changed on the server, cannot resume previous download...'
+            self._close_connection()
+            self.discard_journal()
+            self._journal = utils.HarvestManResumeJournal(self._journal.filename)
+            resuming = False
+            urlobj.partfile = ''
+            if self._cfg.hgetprealloc:
+                urlobj.partfile = filename + '.part'
+            ret = self.connect2(urlobj,showprogress,resuming)
+            
         end = time.time()
         
         status = 0
 
-        if self._cfg.hgetoutdir != '.':
-            outdir = self._cfg.hgetoutdir
-            if not os.path.isdir(outdir):
-                try:
-                    os.makedirs(outdir)
-                    # If an output director is specified, strip any directory
-                    # part from the filename
-                    filename = os.path.join(outdir, os.path.split(filename)[1]) 
-                except OSError, e:
-                    print 'Error in creating directory',e
-            else:
-                filename = os.path.join(outdir, os.path.split(filename)[1])                 
-                    
         if ret==2:
             # Trying multipart download...
             pool = GetObject('datamanager').get_url_threadpool()
             while not pool.get_multipart_download_status(urlobj):
                 time.sleep(1.0)
+                self.save_journal(urlobj, self.JOURNALINTERVAL)
             end = time.time()
 
-            print 'Data download completed.'
-            if self._mode==1:
-                data = pool.get_multipart_url_data(urlobj)
-                self._data = data
-                if self._data: status = 1
+            if pool.get_multipart_download_failed(urlobj):
+                self._error['msg'] = 'Download of some pieces of data failed'
+            else:
+                if showprogress:
+                    print 'Data download completed.'
+                if self._mode==1:
+                    data = pool.get_multipart_url_data(urlobj)
+                    self._data = data
+                    if self._data: status = 1
                 
-            elif self._mode==0:
-                # Get url info
-                infolist = pool.get_multipart_url_info(urlobj)
-                infolist.sort()
-                # Get filenames
-                tmpflist = [item[1] for item in infolist]
-                # print tmpflist
-                # Temp file name
-                self._tmpfname = filename + '.tmp'
-
-                if self.write_data_from_tempfiles(tmpflist, self._tmpfname)==0:
+                elif self._mode==0 and urlobj.partfile:
+                    # Data is already in place
+                    self._tmpfname = urlobj.partfile
                     status = 1
+                
+                elif self._mode==0:
+                    # Get url info
+                    infolist = pool.get_multipart_url_info(urlobj)
+                    infolist.sort()
+                    # Get filenames
+                    tmpflist = [item[1] for item in infolist]
+                    # print tmpflist
+                    # Temp file name
+                    self._tmpfname = filename + '.tmp'
+
+                    if self.write_data_from_tempfiles(tmpflist, self._tmpfname)==0:
+                        status = 1
         else:
             if self._data or self._datalen:
                 status = 1
 
+        # Verify the data against its expected checksum. Pieces
+        # which fail verification are downloaded again, like the
+        # missing pieces of an unfinished download.
+        corrupt, tries = False, 0
+        while status and urlobj.checksum:
+            try:
+                failed = self.verify_download(urlobj)
+            except checksums.HarvestManChecksumError, e:
+                self._error['msg'] = str(e)
+                corrupt, status = True, 0
+                break
+
+            if not failed:
+                if showprogress:
+                    print 'Verified %s checksum of data.' % (urlobj.checksum.hashtype or urlobj.checksum.piecetype)
+                break
+
+            tries += 1
+            if not self._journal or tries > self.MAXVERIFYTRIES:
+                self._error['msg'] = '%d pieces of data failed verification' % len(failed)
+                corrupt, status = True, 0
+                break
+
+            print '%d pieces of data failed verification, downloading them again...' % len(failed)
+            ranges = [urlobj.checksum.get_piece_range(idx) for idx in failed]
+            urlobj.checksum.reset_pieces(failed)
+            self._journal.ranges = [(0, self._journal.length)]
+            self._journal.remove_ranges(ranges)
+            self._journal.write()
+
+            pool = GetObject('datamanager').get_url_threadpool()
+            pool.reset_multipart(urlobj)
+            DataReader.MULTIPART = False
+            urlobj.partfile = self._journal.datafile
+            
+            if self.connect2(urlobj, showprogress, True) != 2:
+                status = 0
+                break
+            
+            while not pool.get_multipart_download_status(urlobj):
+                time.sleep(1.0)
+                self.save_journal(urlobj, self.JOURNALINTERVAL)
+            self._tmpfname = urlobj.partfile
+            end = time.time()
+
+            if pool.get_multipart_download_failed(urlobj):
+                self._error['msg'] = 'Download of some pieces of data failed'
+                status = 0
+                break
+
         if status==0:
+            if corrupt:
+                # Nothing to resume from
+                if self._journal:
+                    self.discard_journal()
+                else:
+                    self.discard_tmpfile()
+            else:
+                # Save what was downloaded, to resume from
+                self.save_journal(urlobj)
+            urlobj.status = self._error['number']
             if self._error.get('msg'):
                 print 'Error:',self._error.get('msg')
             print 'Download of URL',url ,'not completed.\n'
@@ -2007,8 +2978,11 @@ class HarvestManUrlConnector(object):
         res = 0
 
         if self._mode==1:
+            # The data is in memory, the temporary file
+            # name was never written to.
+            self._tmpfname = ''
             res=self._write_url_filename(filename)
-            if res:
+            if res and showprogress:
                 sz = DataReader.NETDATALEN                
                 bw = float(sz)/float(1024*tgap)
                 print '\nSaved to %s.' % filename
@@ -2016,19 +2990,18 @@ class HarvestManUrlConnector(object):
 
         elif self._mode==0:
             if os.path.isfile(self._tmpfname):
-                if resuming:
-                    currtmpfiles.append(self._tmpfname)
-                    tmpflist = currtmpfiles
-                else:
-                    tmpflist = [self._tmpfname]
-                    
-                ret = self.write_data_from_tempfiles(tmpflist, filename)
+                # All data is in one file, just rename it
+                try:
+                    shutil.move(self._tmpfname, filename)
+                except (IOError, OSError), e:
+                    print e
 
                 if os.path.isfile(filename):
-                    print '\nSaved to %s.' % filename
-                    sz = DataReader.NETDATALEN
-                    bw = float(sz)/float(1024*tgap)
-                    print '%d bytes downloaded in %s hours at an average of %.2f kb/s.' % (sz, timestr, bw)
+                    if showprogress:
+                        print '\nSaved to %s.' % filename
+                        sz = DataReader.NETDATALEN
+                        bw = float(sz)/float(1024*max(tgap, 0.001))
+                        print '%d bytes downloaded in %s hours at an average of %.2f kb/s.' % (sz, timestr, bw)
 
                     res = 1
                 else:
@@ -2038,24 +3011,8 @@ class HarvestManUrlConnector(object):
 
         # Perform cleanups for successful downloads
         if res:
-            if os.path.isfile(infof):                
-                try:
-                    os.remove(infof)
-                except OSError, e:
-                    print e
-
-            # Clean up files if resuming
-            if resuming:
-                # If this was resumed using temp files then
-                # these files will be already cleaned up, but
-                # will remain if resumed using in-mem flag.
-                for f in currtmpfiles:
-                    if os.path.isfile(f):
-                        try:
-                            os.remove(f)
-                        except OSError, e:
-                            print e
-                pass
+            if self._journal:
+                self._journal.remove()
                         
             # Clean up temp directory if any
             if not self._cfg.hgetnotemp:
@@ -2070,6 +3027,35 @@ class HarvestManUrlConnector(object):
         
         return 0
 
+    def verify_download(self, urlobj):
+        """ Verify the data downloaded for urlobj against its
+        expected checksum. Returns the indices of the pieces which
+        failed verification. Raises HarvestManChecksumError if the
+        data is corrupt and has no pieces to download again """
+
+        checksum = urlobj.checksum
+        if self._mode==1:
+            f = StringIO(self._data)
+            length = len(self._data)
+        else:
+            f = open(self._tmpfname, 'rb')
+            length = os.path.getsize(self._tmpfname)
+
+        # The length is not known if the server did not send it
+        if not checksum.length:
+            checksum.length = length
+
+        # The digest of data read by one thread from the
+        # start does not need to be computed again.
+        digest = ''
+        if self._reader and self._reader.get_verifier() and not urlobj.trymultipart:
+            digest = self._reader.get_verifier().get_digest()
+
+        try:
+            return checksum.verify(f, digest)
+        finally:
+            f.close()
+        
     def get_urlobject(self):
         """ Return the URL object """
 
@@ -2100,6 +3086,21 @@ class HarvestManUrlConnector(object):
 
         return self._tmpfname
 
+    def get_latency(self):
+        """ Return the time taken by the server to respond """
+
+        return self._latency
+
+    def is_congested(self):
+        """ Return whether the server showed signs of overload """
+
+        return self._congested
+    
+    def get_digest(self):
+        """ Return sha digest of data streamed to disk, if any """
+
+        return self._digest
+
     def get_status(self):
         """ Return the status """
 
@@ -2144,6 +3145,15 @@ class HarvestManUrlConnector(object):
         self._numtries = 0
         # Urlobject
         self._urlobj = None
+        # Temporary filename and digest of streamed data
+        self._tmpfname = ''
+        self._digest = ''
+        self._journal = None
+        self._latency = 0.0
+        self._congested = False
+        self._retryclass = ''
+        self._retryafter = 0
+        self._bytesread = 0
 
         
 class HarvestManUrlConnectorFactory(object):
@@ -2153,10 +3163,32 @@ class HarvestManUrlConnectorFactory(object):
     to the same server """
 
     klass = HarvestManUrlConnector
+    # Request limits are adapted by additive-increase and
+    # multiplicative-decrease. The limit for a server is
+    # increased by one for each round of successful requests
+    # and is multiplied by this factor when the server shows
+    # signs of overload.
+    DECREASEFACTOR = 0.5
+    # A server whose smoothed response time grows beyond
+    # this many times the lowest one is overloaded.
+    LATENCYFACTOR = 3.0
+    # Lowest response time, in seconds, used for comparison
+    MINLATENCY = 0.1
     
     def __init__(self, maxsize):
-        # The requests dictionary
+        # The requests dictionary, keeping the number
+        # of active requests to each server
         self._requests = {}
+        # Server of each active connector
+        self._servers = {}
+        # Adaptive limits on requests for each server
+        self._limits = {}
+        # Smoothed response time and the lowest
+        # smoothed response time for each server
+        self._latency = {}
+        self._minlatency = {}
+        # Time of the last decrease of limit for each server
+        self._lastdecrease = {}
         self._sema = threading.BoundedSemaphore(maxsize)
         # tg.Condition object to control
         # number of simultaneous requests
@@ -2188,17 +3220,116 @@ class HarvestManUrlConnectorFactory(object):
         # the server is equal to the maximum allowd
         # this call will also block the calling
         # thread
+        server = urlobj.get_domain_with_port()
+        self.add_request(server)
+
+        # The limit per server is checked first, so that
+        # threads waiting on a slow server do not hold
+        # any of the connections.
         self._sema.acquire()
 
         if len(self._connstack):
-            return self._connstack.pop()
+            connector = self._connstack.pop()
+        else:
+            # Make a connector 
+            connector = self.__class__.klass()
+            self._count += 1
+            # print 'Connector returned, count is',self._count
+
+        self._servers[connector] = server
+        return connector
+
+    def add_request(self, server):
+        """ Add a request to the server, waiting till the
+        number of active requests to it is below the limit """
+
+        self._reqlock.acquire()
+        try:
+            while self._requests.get(server, 0) >= self.get_request_limit(server):
+                self._reqlock.wait()
+            self._requests[server] = self._requests.get(server, 0) + 1
+        finally:
+            self._reqlock.release()
+
+    def remove_request(self, server):
+        """ Remove a request to the server """
+
+        self._reqlock.acquire()
+        try:
+            count = self._requests.get(server, 0) - 1
+            if count > 0:
+                self._requests[server] = count
+            elif server in self._requests:
+                del self._requests[server]
+            self._reqlock.notifyAll()
+        finally:
+            self._reqlock.release()
+
+    def get_request_count(self, server):
+        """ Return the number of active requests to the server """
+
+        return self._requests.get(server, 0)
+
+    def get_request_limit(self, server):
+        """ Return the current limit on simultaneous
+        requests to the server """
+
+        if not self._cfg.adaptiverequests:
+            return self._cfg.requests
+        
+        return int(self._limits.get(server, self._cfg.requests))
+
+    def get_request_limits(self):
+        """ Return a dictionary of the current request
+        limits of servers """
+
+        limits = {}
+        for server in self._limits.keys():
+            limits[server] = self.get_request_limit(server)
+
+        return limits
+    
+    def update_request_limit(self, server, congested, latency=0.0):
+        """ Adapt the request limit of the server for the result
+        of a request. The 'congested' flag is True if the request
+        showed signs of overload of the server. The 'latency' is
+        the time taken by the server to respond """
+
+        if not self._cfg.adaptiverequests:
+            return
         
-        # Make a connector 
-        connector = self.__class__.klass()
-        self._count += 1
-        # print 'Connector returned, count is',self._count
+        self._reqlock.acquire()
+        try:
+            limit = self._limits.get(server, float(self._cfg.requests))
             
-        return connector
+            if latency:
+                avg = self._latency.get(server, latency)
+                avg = 0.8*avg + 0.2*latency
+                minavg = min(self._minlatency.get(server, avg), avg)
+                self._latency[server] = avg
+                self._minlatency[server] = minavg
+                
+                if avg > self.LATENCYFACTOR*max(minavg, self.MINLATENCY):
+                    congested = True
+            else:
+                avg = 0.0
+
+            if congested:
+                # Decrease at most once in a round trip, since
+                # requests in progress report the same overload.
+                now = time.time()
+                if now - self._lastdecrease.get(server, 0) > max(avg, 1.0):
+                    limit = max(1.0, limit*self.DECREASEFACTOR)
+                    self._lastdecrease[server] = now
+                    extrainfo('Reducing request limit for server',server,'to',int(limit))
+            else:
+                limit = min(limit + 1.0/limit, float(self._cfg.maxrequests))
+
+            self._limits[server] = limit
+            # Waiting threads can proceed if the limit grew
+            self._reqlock.notifyAll()
+        finally:
+            self._reqlock.release()
         
     def remove_connector(self, conn):
         """ Remove a connector after use """
@@ -2207,7 +3338,10 @@ class HarvestManUrlConnectorFactory(object):
         # the internal count
         # Decrease the internal request count on
         # the server
-        # self.remove_request(conn.get_urlobject().get_domain())
+        server = self._servers.pop(conn, None)
+        if server is not None:
+            self.update_request_limit(server, conn.is_congested(), conn.get_latency())
+            self.remove_request(server)
         self._count -= 1
         # print 'Connector removed, count is',self._count
         conn.release()
@@ -490,8 +490,13 @@ class HarvestManUrlCrawler(HarvestManBaseUrlCrawler):
             # Check for status flag to end loop
             if self._endflag: break
             if not url_obj: continue
-            
+
+            # Links to urls known to be redirected are
+            # replaced by their targets before the checks.
+            mgr.apply_redirect(url_obj)
             if ruleschecker.is_duplicate_link(url_obj): continue
+            # Skip links which failed before
+            if mgr.is_failed_url(url_obj): continue
 
             url_obj.generation = self._urlobject.generation + 1
             typ = url_obj.get_type()
@@ -659,6 +664,91 @@ class HarvestManUrlFetcher(HarvestManBaseUrlCrawler):
         else:
             return links[:offset_end]
         
+    def push_links(self, url_obj, links):
+        """ Create a collection of url objects for the (type, url)
+        tuples in 'links', found in the web page of the url object,
+        and post it to the data queue """
+
+        mgr = GetObject('datamanager')
+        
+        # Create collection object
+        coll = HarvestManAutoUrlCollection(url_obj)
+
+        for typ, url in links:
+            is_cgi, is_php = False, False
+
+            #if url.find('#') != -1:
+            #    extrainfo('URL: %s, type: %s' % (url, typ))
+
+            if url.find('php?') != -1: is_php = True
+            if typ == 'form' or is_php: is_cgi = True
+
+            if not url: continue
+
+            try:
+                child_urlobj = urlparser.HarvestManUrlParser(url,
+                                                             typ,
+                                                             is_cgi,
+                                                             url_obj)
+
+                child_urlobj.set_index()
+                mgr.add_url(child_urlobj)
+                coll.addURL(child_urlobj)
+
+                # extrainfo('URL: %s FROMURL: %s' % (url, self._urlobject.get_full_url()))
+                # extrainfo('CONSTRUCTED URL: %s' % child_urlobj.get_full_url())
+
+            except urlparser.HarvestManUrlParserError, e:
+                debug('Error: ',e)
+                continue
+
+        if not self._crawlerqueue.push((url_obj.priority, coll), 'fetcher'):
+            if self._pushflag: self.buffer.append((url_obj.priority, coll))
+
+        # Update links called here
+        mgr.update_links(coll)
+
+    def push_css_links(self, links):
+        """ Create a collection of url objects for the (type, url)
+        tuples in 'links', found in the stylesheet of the url object,
+        and post it to the data queue """
+
+        mgr = GetObject('datamanager')
+        
+        # Create collection object
+        coll = HarvestManAutoUrlCollection(self._urlobject)
+
+        # Depth of the stylesheets imported by this one
+        importdepth = self._urlobject.importdepth + 1
+            
+        # Add these links to the queue
+        for urltyp, url in links:
+            # Do not follow chains of @imports indefinitely
+            if urltyp == TYPE_STYLESHEET and importdepth > self._configobj.cssimportdepth:
+                extrainfo('Skipping stylesheet', url, '=> import depth exceeded')
+                continue
+                    
+            try:
+                child_urlobj =  urlparser.HarvestManUrlParser(url,
+                                                              urltyp,
+                                                              False,
+                                                              self._urlobject)
+
+                if urltyp == TYPE_STYLESHEET:
+                    child_urlobj.importdepth = importdepth
+                child_urlobj.set_index()
+                mgr.add_url(child_urlobj)                    
+                coll.addURL(child_urlobj)
+                    
+            except urlparser.HarvestManUrlParserError:
+                continue
+
+        if not self._crawlerqueue.push((self._urlobject.priority, coll), 'fetcher'):
+            if self._pushflag: self.buffer.append((self._urlobject.priority, coll))
+
+        # Update links called here
+        mgr.update_links(coll)
+        
     def process_url(self):
         """ This function downloads the data for a url and writes its files.
         It also posts the data for web pages to a data queue """
@@ -685,6 +775,35 @@ class HarvestManUrlFetcher(HarvestManBaseUrlCrawler):
         # download the url
         url_obj = self._urlobject
 
+        if self._urlobject.is_stylesheet() and self._urlobject.notmodified and not data:
+            # The stylesheet was not modified since the last
+            # crawl, so crawl the links found in it then.
+            cached = mgr.get_url_links(self._urlobject)
+            if cached:
+                extrainfo("Crawling saved links of stylesheet", self._url)
+                self.push_css_links(cached[1])
+            return ''
+        
+        if self._urlobject.is_webpage() and self._urlobject.notmodified and not data:
+            # The page was not modified since the last crawl,
+            # so crawl the links found in it then.
+            cached = mgr.get_url_links(self._urlobject)
+            if cached:
+                baseurl, links = cached
+                extrainfo("Crawling saved links of web page", self._url)
+                if baseurl:
+                    url_obj = urlparser.HarvestManUrlParser(baseurl,
+                                                            TYPE_BASE,
+                                                            0,
+                                                            self._urlobject,
+                                                            self._configobj.projdir)
+                    url_obj.set_index()
+                    mgr.add_url(url_obj)
+                    self._tempobj = url_obj
+
+                self.push_links(url_obj, links)
+            return ''
+        
         if self._urlobject.is_webpage() and data:
 
             # Check if this page was already crawled
@@ -707,16 +826,22 @@ class HarvestManUrlFetcher(HarvestManBaseUrlCrawler):
             extrainfo("Parsing web page", self._url)
 
             links = []
+            baseurl = ''
 
-            # Perform any Javascript based redirection etc
-            try:
-                parser = pageparser.HarvestManJSParser()
-                parser.feed(data)
-                if parser.redirectedurl:
-                    extrainfo("Javascript redirection to",parser.redirectedurl)
-                    links.append((urlparser.TYPE_WEBPAGE, parser.redirectedurl))
-            except Exception, e:
-                extrainfo("Error while parsing Javascript", e)
+            # Perform any Javascript based redirection etc. Most pages
+            # do not have any redirect statements, so do a cheap pre-scan
+            # of the content before running the Javascript parser.
+            if pageparser.HarvestManJSParser.needs_parsing(data):
+                try:
+                    parser = pageparser.HarvestManJSParser()
+                    parser.feed(data)
+                    if parser.redirectedurl:
+                        extrainfo("Javascript redirection to",parser.redirectedurl)
+                        links.append((urlparser.TYPE_WEBPAGE, parser.redirectedurl))
+                except Exception, e:
+                    extrainfo("Error while parsing Javascript", e)
+            else:
+                mgr.update_counter('_jsfastpath')
                 
             try:
                 self.wp.reset()
@@ -741,6 +866,7 @@ class HarvestManUrlFetcher(HarvestManBaseUrlCrawler):
                         # Save a reference otherwise
                         # proxy might be deleted
                         self._tempobj = url_obj
+                        baseurl = url
 
                 self.wp.close()
             except (SGMLParseError, IOError), e:
@@ -753,6 +879,7 @@ class HarvestManUrlFetcher(HarvestManBaseUrlCrawler):
                 # Check for NOFOLLOW tag
                 if not self.wp.can_follow:
                     extrainfo('URL %s defines META Robots NOFOLLOW flag, not following its children...' % self._url)
+                    mgr.update_url_links(self._urlobject, '', [])
                     return data
 
             # print 'LINKS=>',self.wp.links
@@ -772,44 +899,12 @@ class HarvestManUrlFetcher(HarvestManBaseUrlCrawler):
             # print 'Links=>',links
             links = self.offset_links(links)
             # print 'Links=>',links
-            
-            # Create collection object
-            coll = HarvestManAutoUrlCollection(url_obj)
-            
-            for typ, url in links:
-                is_cgi, is_php = False, False
-
-                #if url.find('#') != -1:
-                #    extrainfo('URL: %s, type: %s' % (url, typ))
-                    
-                if url.find('php?') != -1: is_php = True
-                if typ == 'form' or is_php: is_cgi = True
-
-                if not url: continue
-
-                try:
-                    child_urlobj = urlparser.HarvestManUrlParser(url,
-                                                                 typ,
-                                                                 is_cgi,
-                                                                 url_obj)
-                    
-                    child_urlobj.set_index()
-                    mgr.add_url(child_urlobj)
-                    coll.addURL(child_urlobj)
-
-                    # extrainfo('URL: %s FROMURL: %s' % (url, self._urlobject.get_full_url()))
-                    # extrainfo('CONSTRUCTED URL: %s' % child_urlobj.get_full_url())
-                    
-                except urlparser.HarvestManUrlParserError, e:
-                    debug('Error: ',e)
-                    continue
-                
-            if not self._crawlerqueue.push((url_obj.priority, coll), 'fetcher'):
-                if self._pushflag: self.buffer.append((url_obj.priority, coll))
-
-            # Update links called here
-            mgr.update_links(coll)
 
+            # Save the links, so that the page need not be
+            # parsed again if it is not modified.
+            mgr.update_url_links(self._urlobject, baseurl, links)
+            
+            self.push_links(url_obj, links)
             return data
         
         elif self._urlobject.is_stylesheet() and data:
@@ -820,41 +915,27 @@ class HarvestManUrlFetcher(HarvestManBaseUrlCrawler):
             sp.feed(data)
 
             contained_urls = self.offset_links(sp.links)
-            
-            # Create collection object
-            coll = HarvestManAutoUrlCollection(self._urlobject)
-            
-            # Add these links to the queue
+            imported_urls = dict.fromkeys(sp.csslinks)
+
+            links = []
             for url in contained_urls:
                 if not url: continue
 
-                # There is no type information - so look at the
-                # extension of the URL. If ending with .css then
-                # add as stylesheet type, else as generic type.
+                # Imported URLs are stylesheets. For the others there
+                # is no type information - so look at the extension of
+                # the URL. If ending with .css then add as stylesheet
+                # type, else as generic type.
 
-                if url.lower().endswith('.css'):
-                    urltyp = TYPE_STYLESHEET
+                if url in imported_urls or url.lower().endswith('.css'):
+                    links.append((TYPE_STYLESHEET, url))
                 else:
-                    urltyp = TYPE_ANY
-                    
-                try:
-                    child_urlobj =  urlparser.HarvestManUrlParser(url,
-                                                                  urltyp,
-                                                                  False,
-                                                                  self._urlobject)
-
-                    child_urlobj.set_index()
-                    mgr.add_url(child_urlobj)                    
-                    coll.addURL(child_urlobj)
-                    
-                except urlparser.HarvestManUrlParserError:
-                    continue
+                    links.append((TYPE_ANY, url))
 
-            if not self._crawlerqueue.push((self._urlobject.priority, coll), 'fetcher'):
-                if self._pushflag: self.buffer.append((self._urlobject.priority, coll))
+            # Save the links, so that the stylesheet need
+            # not be parsed again if it is not modified.
+            mgr.update_url_links(self._urlobject, '', links)
 
-            # Update links called here
-            mgr.update_links(coll)
+            self.push_css_links(links)
 
             # Successful return returns data
             return data
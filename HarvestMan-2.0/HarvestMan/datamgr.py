@@ -64,34 +64,68 @@ class HarvestManDataManager(object):
 
     # For supporting callbacks
     __metaclass__ = MethodWrapperMetaClass
+
+    # Information on servers saved by earlier runs
+    # is used for this many seconds.
+    SERVERCACHETIMEOUT = 7*86400.0
+    # Permanent redirections saved by earlier
+    # runs are used for this many seconds.
+    REDIRECTCACHETIMEOUT = 30*86400.0
+    # Statuses of permanent redirections
+    PERMANENTREDIRECTS = (301, 308)
+    # Maximum length of a chain of redirections
+    # followed in the redirection cache
+    MAXREDIRECTS = 5
+    # Time in seconds for which urls which failed with
+    # these HTTP statuses are not requested again. The
+    # time is doubled each time a url fails again.
+    FAILEDCACHETIMEOUTS = { 404 : 7*86400.0,
+                            410 : 30*86400.0,
+                            500 : 3600.0,
+                            502 : 3600.0,
+                            503 : 3600.0,
+                            504 : 3600.0 }
+    MAXFAILEDCACHETIMEOUT = 30*86400.0
     
     def __init__(self):
 
         self._numfailed = 0
-        self._projectcache = {}
+        # Project cache, opened by read_project_cache
+        self._projectcache = None
         self._downloaddict = { '_savedfiles': MyDeque(),
                                '_deletedfiles': MyDeque(),
                                '_failedurls' : MyDeque(),
                                '_doneurls': MyDeque(),
                                '_collections': MyDeque(),
                                '_reposfiles' : 0,
-                               '_cachefiles': 0
+                               '_cachefiles': 0,
+                               '_jsfastpath': 0
                              }
         # Config object
         self._cfg = GetObject('config')
         # Dictionary of servers crawled and
-        # their meta-data. Meta-data is
-        # a dictionary which currently
-        # has only one entry.
-        # i.e accept-ranges.
+        # their meta-data. Meta-data is a
+        # dictionary with the entries
+        # accept-ranges, compression, keep-alive,
+        # latency, throughput and timestamp.
+        # This is saved across runs.
         self._serversdict = {}
+        self._serverslock = tg.Lock()
+        # Dictionary of urls which were redirected,
+        # mapping each url to a dictionary with the
+        # entries url, status and timestamp. This is
+        # saved in the project cache.
+        self._redirects = {}
+        # Dictionary of urls which failed, mapping each
+        # url to a dictionary with the entries status,
+        # count, timestamp and expires. This is saved
+        # across runs.
+        self._failedcache = {}
         # Url dictionary, storing all url objects
         # w.r.t their index
         self._urldict = {}
         # byte count
         self._bytes = 0L
-        # Redownload flag
-        self._redownload = False
         # Cached list of failed sf mirrors
         self._failedsfmirrors = []
         # Event object for holding threads
@@ -101,6 +135,9 @@ class HarvestManDataManager(object):
     def initialize(self):
         """ Do initializations per project """
 
+        self.read_server_cache()
+        self.read_failed_cache()
+
         # Url thread group class for multithreaded downloads
         if self._cfg.usethreads and self._cfg.fastmode:
             self._urlThreadPool = HarvestManUrlThreadPool()
@@ -120,6 +157,8 @@ class HarvestManDataManager(object):
         d['_downloaddict'] = self._downloaddict
         d['_urldict'] = self._urldict
         d['_serversdict'] = self._serversdict
+        d['_redirects'] = self._redirects
+        d['_failedcache'] = self._failedcache
         d['_bytes'] = self._bytes
 
         dcopy = copy.deepcopy(d)
@@ -134,6 +173,8 @@ class HarvestManDataManager(object):
         self._downloaddict = state.get('_downloaddict', self._downloaddict)
         self._urldict = state.get('_urldict', self._urldict)
         self._serversdict = state.get('_serversdict', self._serversdict)        
+        self._redirects = state.get('_redirects', self._redirects)
+        self._failedcache = state.get('_failedcache', self._failedcache)
         self._bytes = state.get('_bytes', 0L)
 
         
@@ -195,6 +236,30 @@ class HarvestManDataManager(object):
     def get_server_dictionary(self):
         return self._serversdict
 
+    def get_server_info(self, urlobj):
+        """ Return the meta-data dictionary of the
+        server of the given url object """
+
+        return self._serversdict.get(urlobj.get_full_domain_with_port(), {})
+
+    def update_server_info(self, urlobj, info):
+        """ Update the meta-data of the server of the given url
+        object with the dictionary 'info'. Latency and throughput
+        are smoothed over the values seen before """
+
+        server = urlobj.get_full_domain_with_port()
+        
+        try:
+            self._serverslock.acquire()
+            d = self._serversdict.setdefault(server, {})
+            for key, value in info.items():
+                if key in ('latency', 'throughput') and d.has_key(key):
+                    value = 0.8*d[key] + 0.2*value
+                d[key] = value
+            d['timestamp'] = time.time()
+        finally:
+            self._serverslock.release()
+            
     def supports_range_requests(self, urlobj):
         """ Check whether the given url object
         supports range requests """
@@ -206,12 +271,86 @@ class HarvestManDataManager(object):
         # -1 => does not accept
         
         # Look up its server in the dictionary
-        server = urlobj.get_full_domain()
-        if server in self._serversdict:
-            d = self._serversdict[server]
-            return d.get('accept-ranges', 0)
+        return self.get_server_info(urlobj).get('accept-ranges', 0)
 
-        return 0
+    def read_server_cache(self):
+        """ Read information on servers saved by earlier runs
+        of HarvestMan or Hget """
+
+        if not self._cfg.userdir: return
+        
+        cachereader = utils.HarvestManCacheReaderWriter(self._cfg.userdir)
+        serversdict = cachereader.read_server_cache()
+
+        t = time.time()
+        for server, d in serversdict.items():
+            if t - d.get('timestamp', 0) < self.SERVERCACHETIMEOUT:
+                self._serversdict.setdefault(server, d)
+
+    def write_server_cache(self):
+        """ Save information on servers for later runs """
+
+        if not self._cfg.userdir or not self._serversdict: return
+
+        cachewriter = utils.HarvestManCacheReaderWriter(self._cfg.userdir)
+        cachewriter.write_server_cache(self._serversdict)
+        
+    def read_failed_cache(self):
+        """ Read the urls which failed in earlier runs, or
+        remove them if the cache is to be purged """
+
+        if not self._cfg.userdir or not self._cfg.failedcache: return
+
+        cachereader = utils.HarvestManCacheReaderWriter(self._cfg.userdir)
+        if self._cfg.purgefailedcache:
+            cachereader.purge_failed_cache()
+            info('Purged the cache of failed urls.')
+            return
+
+        # Expired entries are kept for a while, so that
+        # urls which fail again are skipped for longer.
+        t = time.time()
+        for url, d in cachereader.read_failed_cache().items():
+            if t - d['expires'] < self.MAXFAILEDCACHETIMEOUT:
+                self._failedcache.setdefault(url, d)
+
+    def write_failed_cache(self):
+        """ Save the urls which failed for later runs """
+
+        if not self._cfg.userdir or not self._cfg.failedcache: return
+
+        cachewriter = utils.HarvestManCacheReaderWriter(self._cfg.userdir)
+        cachewriter.write_failed_cache(self._failedcache, time.time() - self.MAXFAILEDCACHETIMEOUT)
+
+    def is_failed_url(self, urlobj):
+        """ Return whether the url of the url object failed in
+        this or an earlier run with an error which is not likely
+        to have gone away, so that it need not be requested """
+
+        d = self._failedcache.get(urlobj.get_full_url())
+        if d is None or time.time() >= d['expires']:
+            return False
+
+        extrainfo('Url', urlobj.get_full_url(), 'failed with error', d['status'], 'before, skipping it')
+        self.update_counter('_failedcached')
+        return True
+
+    def update_failed_cache(self, urlobj, status):
+        """ Save the failure of the url of the url
+        object with the given HTTP status """
+
+        timeout = self.FAILEDCACHETIMEOUTS.get(status)
+        if not timeout or not self._cfg.failedcache: return
+
+        url = urlobj.get_full_url()
+        count = self._failedcache.get(url, {}).get('count', 0) + 1
+        timeout = min(timeout*2**(count-1), self.MAXFAILEDCACHETIMEOUT)
+
+        t = time.time()
+        self._failedcache[url] = { 'status' : status,
+                                   'count' : count,
+                                   'timestamp' : t,
+                                   'expires' : t + timeout }
         
     def read_project_cache(self):
         """ Try to read the project cache file """
@@ -222,47 +361,105 @@ class HarvestManDataManager(object):
         obj, found = cachereader.read_project_cache()
         self._cfg.cachefound = found
         self._projectcache = obj
+        # Write the cache as the crawl goes on, so that
+        # it is not lost if the program is killed.
+        obj.start_writer(self._cfg.cacheflushinterval, self._cfg.cacheflushcount)
+
+        # Temporary redirections are not used
+        # after the run in which they were seen.
+        t = time.time()
+        for url, d in obj.get('_redirects', {}).items():
+            if d['status'] in self.PERMANENTREDIRECTS and \
+                   t - d['timestamp'] < self.REDIRECTCACHETIMEOUT:
+                self._redirects.setdefault(url, d)
+
+    def get_redirect(self, url):
+        """ Return the url to which the given url is known to be
+        redirected, following redirections of the target, or an
+        empty string if the url is not known to be redirected """
+
+        target = ''
+        for x in range(self.MAXREDIRECTS):
+            d = self._redirects.get(url)
+            if d is None: break
+            url = target = d['url']
+
+        return target
+
+    def update_redirect(self, url, newurl, status):
+        """ Save the redirection of the given url to the url
+        'newurl', with the HTTP status of the redirection """
+
+        if url != newurl:
+            self._redirects[url] = { 'url' : newurl,
+                                     'status' : status,
+                                     'timestamp' : time.time() }
+
+    def apply_redirect(self, urlobj):
+        """ Replace the url of the url object by the url to which
+        it is known to be redirected, saving a request for it.
+        Returns True if the url was replaced and False otherwise """
+
+        url = urlobj.get_full_url()
+        target = self.get_redirect(url)
+        if not target: return False
+
+        extrainfo('Replacing redirected url', url, 'with', target)
+        urlobj.url = target
+        urlobj.wrapper_resolveurl()
+        self.update_counter('_redirectscached')
+
+        return True
+    
+    def get_cache_entry(self, urlobj):
+        """ Return the entry of the given url object in the
+        project cache, or None if it is not in the cache """
+
+        if self._projectcache is None:
+            return None
+        return self._projectcache.get(urlobj.get_full_url())
+
+    def put_cache_entry(self, urlobj, cachekey):
+        """ Save the entry of the given url object
+        in the project cache """
 
+        if self._projectcache is not None:
+            self._projectcache.put(urlobj.get_full_url(), cachekey)
+        
     def write_file_from_cache(self, urlobj):
         """ Write file from url cache. This
-        works only if the cache dictionary of this
-        url has a key named 'data' """
+        works only if the data of this url is in
+        the blob store of the cache """
 
         ret = False
 
-        d = self._projectcache.get(urlobj.get_domain_hash(), {})
-
-        url = urlobj.get_full_url()
-        
-        if d.has_key(url):
-            # Value itself is a dictionary
-            content = d[url]
-            if content:
-                fileloc = content['location']
-                if not content.has_key('data'):
-                    return ret
-                else:
-                    urladta = content['data']
-                    if urldata:
-                        # Write file
-                        extrainfo("Updating file from cache=>", fileloc)
-                        try:
-                            f=open(fileloc, 'wb')
-                            f.write(data)
-                            f.close()
-                            ret = True
-                        except IOError, e:
-                            debug('IO Exception', e)
+        # Value itself is a dictionary
+        content = self.get_cache_entry(urlobj)
+        if content:
+            fileloc = content['location']
+            # The data is read only if it is needed
+            urldata = self._projectcache.get_data(urlobj.get_full_url())
+            if urldata:
+                # Write file
+                extrainfo("Updating file from cache=>", fileloc)
+                try:
+                    f=open(fileloc, 'wb')
+                    f.write(urldata)
+                    f.close()
+                    ret = True
+                except IOError, e:
+                    debug('IO Exception', e)
                                 
         return ret
 
-    def wrapper_update_cache_for_url(self, urlobj, filename, contentlen, urldata):
+    def wrapper_update_cache_for_url(self, urlobj, filename, contentlen, urldata, digest1=''):
         """ Wrapper for update_cache_for_url which is called from connector module """
 
         # Created this method - Anand Jan 10 06
-        digest1 = ''
-        if urldata:
-            sh = sha.new(urldata).hexdigest()
+        # The connector computes the digest of
+        # the data as it is read.
+        if urldata and not digest1:
+            digest1 = sha.new(urldata).hexdigest()
             
         return self.update_cache_for_url(urlobj, filename, contentlen, urldata, digest1)
 
@@ -276,9 +473,6 @@ class HarvestManDataManager(object):
         """ Method to update the cache information for the URL 'url'
         associated to file 'filename' on the disk """
 
-        url = urlobj.get_full_url()
-        domkey = urlobj.get_domain_hash()
-        
         # Jan 10 06 - Anand, Created by moving code from is_url_cache_uptodate
         # Update all cache keys
         cachekey = {}
@@ -290,19 +484,12 @@ class HarvestManDataManager(object):
         if self._cfg.datacache:
             cachekey['data'] = urldata
 
-        
-        d = self._projectcache.get(domkey, {})
-        d[url] = cachekey
-        
-        self._projectcache[domkey] = d
+        self.put_cache_entry(urlobj, cachekey)
         
     def update_cache_for_url2(self, urlobj, filename, lmt, urldata):
         """ Second method to update the cache information for the URL 'url'
         associated to file 'filename' on the disk """
 
-        url = urlobj.get_full_url()
-        domkey = urlobj.get_domain_hash()
-        
         # Jan 10 06 - Anand, Created by moving code from is_url_uptodate.
         # Update all cache keys
         cachekey = {}
@@ -313,10 +500,7 @@ class HarvestManDataManager(object):
         if self._cfg.datacache:
             cachekey['data'] = urldata
 
-        d = self._projectcache.get(domkey, {})
-        d[url] = cachekey
-        
-        self._projectcache[domkey] = d                
+        self.put_cache_entry(urlobj, cachekey)
         
     def get_last_modified_time_and_data(self, urlobj, check_file_exists=True):
         """ Return last-modified-time and data of the given URL if it
@@ -333,14 +517,10 @@ class HarvestManDataManager(object):
         if (not self._cfg.pagecache) or (not self._cfg.datacache):
             return (-1, '')
 
-        # Reference to dictionary in the cache list
-        d = self._projectcache.get(urlobj.get_full_domain(), {})
-        # Cache dictionary is indexed by domain names
+        cachekey = self.get_cache_entry(urlobj)
         url = urlobj.get_full_url()
 
-        if url in d:
-            cachekey = d[url]
-            
+        if cachekey:
             # File check is enabled - return True only if
             # downloaded file is found.
             if check_file_exists:
@@ -349,7 +529,7 @@ class HarvestManDataManager(object):
                     filename = urlobj.get_full_filename()
                     if os.path.abspath(fileloc) == os.path.abspath(filename):
                         # Check if we have the data for the URL
-                        data = cachekey.get('data','')
+                        data = self._projectcache.get_data(url)
                         if len(data):
                             return (cachekey.get('last-modified', -1), data)
                         else:
@@ -357,12 +537,88 @@ class HarvestManDataManager(object):
 
             else:
                 # Get the data
-                data = cachekey.get('data','')
+                data = self._projectcache.get_data(url)
                 return (cachekey.get('last-modified', -1), data)
 
         return (-1, '')
                                
-    def is_url_cache_uptodate(self, urlobj, filename, contentlen, urldata):
+    def get_url_cache_entry(self, urlobj):
+        """ Return the cache dictionary of the given url object,
+        if it is in the cache and its file was found on the disk """
+
+        if not self._cfg.pagecache:
+            return {}
+
+        cachekey = self.get_cache_entry(urlobj) or {}
+
+        fileloc = cachekey.get('location', '')
+        if fileloc and os.path.isfile(fileloc) and \
+               os.path.abspath(fileloc) == os.path.abspath(urlobj.get_full_filename()):
+            return cachekey
+
+        return {}
+        
+    def get_url_validators(self, urlobj):
+        """ Return the last-modified time and entity tag of the
+        given url object if it was found in the cache, for making
+        a conditional request. The data of the url need not be in
+        the cache, since the file on the disk can be reused.
+
+        For web pages and stylesheets there is nothing to parse if
+        the server replies 304, so the validators are only returned
+        if the links found in them were saved """
+
+        cachekey = self.get_url_cache_entry(urlobj)
+        if (urlobj.is_webpage() or urlobj.is_stylesheet()) and \
+               cachekey.get('links') is None:
+            return (-1, '')
+        
+        return (cachekey.get('last-modified', -1), cachekey.get('etag', ''))
+
+    def update_url_validators(self, urlobj, etag, timestr, contentlen):
+        """ Save the entity tag, last-modified time and content
+        length of the given url object in its cache entry """
+
+        if not self._cfg.pagecache:
+            return
+
+        cachekey = self.get_cache_entry(urlobj)
+        if cachekey is None:
+            return
+
+        if etag:
+            cachekey['etag'] = etag
+        if timestr:
+            try:
+                lmt = time.mktime(time.strptime(timestr, "%a, %d %b %Y %H:%M:%S GMT"))
+                cachekey['last-modified'] = lmt
+            except ValueError:
+                pass
+        cachekey['content-length'] = contentlen
+        self.put_cache_entry(urlobj, cachekey)
+
+    def get_url_links(self, urlobj):
+        """ Return the base url and the links found in the web
+        page or stylesheet of the given url object when it was
+        parsed last """
+
+        cachekey = self.get_url_cache_entry(urlobj)
+        return cachekey.get('links')
+
+    def update_url_links(self, urlobj, baseurl, links):
+        """ Save the base url and the links found in the web
+        page or stylesheet of the given url object in its cache
+        entry """
+
+        if not self._cfg.pagecache:
+            return
+
+        cachekey = self.get_cache_entry(urlobj)
+        if cachekey is not None:
+            cachekey['links'] = (baseurl, links)
+            self.put_cache_entry(urlobj, cachekey)
+        
+    def is_url_cache_uptodate(self, urlobj, filename, contentlen, urldata, digest1=''):
         """ Check with project cache and find out if the
         content needs update """
         
@@ -383,24 +639,16 @@ class HarvestManDataManager(object):
 
         # Anand 10/1/06 - Fix: need to update sha object with data to
         # get digest! (This line somehow has got deleted)
-        digest1 = ''
-        if urldata:
-            sh = sha.new(urldata).hexdigest()
+        if urldata and not digest1:
+            digest1 = sha.new(urldata).hexdigest()
         
         # Assume that cache is not uptodate apriori
         uptodate=False
         fileverified=False
 
-        # Reference to dictionary in the cache list
-        domkey = urlobj.get_domain_hash()
-        cachekey = {}
+        cachekey = self.get_cache_entry(urlobj)
         
-        d = self._projectcache.get(domkey, {})
-
-        url = urlobj.get_full_url()
-        
-        if d.has_key(url):
-            cachekey = d[url]
+        if cachekey:
             cachekey['updated']=False
 
             fileloc = cachekey['location']
@@ -437,17 +685,9 @@ class HarvestManDataManager(object):
         uptodate=False
         fileverified=False
 
-        # Reference to dictionary in the cache list
-        cachekey = {}
-        domkey = urlobj.get_domain_hash()
+        cachekey = self.get_cache_entry(urlobj)
         
-        d = self._projectcache.get(domkey, {})
-        # Cache dictionary is indexed by domain names
-        url = urlobj.get_full_url()
-        
-        if d.has_key(url):
-            cachekey = d[url]
-
+        if cachekey:
             cachekey['updated']=False
 
             fileloc = cachekey['location']
@@ -472,21 +712,16 @@ class HarvestManDataManager(object):
         return (uptodate, fileverified)
 
     def conditional_cache_set(self):
-        """ A utility function to conditionally enable/disable
-        the cache mechanism """
-
-        # If already page cache is disabled, do not do anything
-        if not self._cfg.pagecache:
-            return
-        
-        # If the cache file exists for this project, disable
-        # cache, else enable it.
-        cachefilename = self.get_proj_cache_filename()
+        """ Write the entries of the project cache which are
+        waiting to be written, called after an interrupt """
 
-        if os.path.exists(cachefilename) and os.path.getsize(cachefilename):
-            self._cfg.pagecache = False
-        else:
-            self._cfg.pagecache = True
+        # The cache is written entry by entry in the
+        # background, so the cache on the disk is
+        # consistent at any point of the crawl and
+        # need not be left alone after an interrupt.
+        if self._projectcache is not None:
+            self._projectcache.put('_redirects', self._redirects)
+            self._projectcache.flush()
 
     def post_download_setup(self):
         """ Actions to perform after project is complete """
@@ -494,35 +729,20 @@ class HarvestManDataManager(object):
         # Clear event to block all threads
         self._evt.clear()
         
-        if self._cfg.retryfailed:
-            self._numfailed = len(self._downloaddict['_failedurls'])
-            moreinfo(' ')
-            # try downloading again
-            # mod: made this multithreaded
-            if self._numfailed:
-                moreinfo('Redownloading failed links...',)
-                self._redownload=True
-
-                # FIXME: Since a copy of urlobject is made, we need to
-                # modify the logic in update_file_stats function for failedurls.
-                failedurls = self._downloaddict['_failedurls']
-
-                for urlobj in failedurls:
-                    # If this is the base URL, skip it
-                    if urlobj.index==0: continue
-                    if not urlobj.fatal:
-                        print 'Re-downloading',urlobj.get_full_url()
-                        self.thread_download(urlobj)
-
         # bugfix: Moved the time calculation code here.
         t2=time.time()
 
         self._cfg.endtime = t2
 
         # Write cache file
-        if self._cfg.pagecache:
+        if self._projectcache is not None:
+            self._projectcache.put('_redirects', self._redirects)
             cachewriter = utils.HarvestManCacheReaderWriter(self.get_proj_cache_directory())
             cachewriter.write_project_cache(self._projectcache)
+            self._projectcache = None
+
+        self.write_server_cache()
+        self.write_failed_cache()
 
         # If url header dump is enabled, dump it
         if self._cfg.urlheaders:
@@ -557,8 +777,19 @@ class HarvestManDataManager(object):
         numfiles = len(self._downloaddict['_savedfiles'])
         numfilesinrepos = self._downloaddict['_reposfiles']
         numfilesincache = self._downloaddict['_cachefiles']
-
-        numretried = self._numfailed  - numstillfailed
+        numjsfastpath = self._downloaddict.get('_jsfastpath', 0)
+        compressedbytes = self._downloaddict.get('_compressedbytes', 0)
+        decompressedbytes = self._downloaddict.get('_decompressedbytes', 0)
+        abortedsize = self._downloaddict.get('_abortedsize', 0)
+        abortedtype = self._downloaddict.get('_abortedtype', 0)
+        abortedname = self._downloaddict.get('_abortedname', 0)
+        abortedbytes = self._downloaddict.get('_abortedbytes', 0)
+        redirectscached = self._downloaddict.get('_redirectscached', 0)
+        failedcached = self._downloaddict.get('_failedcached', 0)
+        connstats = GetObject('connector').get_connection_stats()
+        requestlimits = GetObject('connectorfactory').get_request_limits()
+
+        numretried = self._downloaddict.get('_refetched', 0)
         fetchtime = float((math.modf((self._cfg.endtime-self._cfg.starttime)*100.0)[1])/100.0)
 
         statsd = { 'links' : nlinks,
@@ -571,6 +802,18 @@ class HarvestManDataManager(object):
                    'filesincache' : numfilesincache,
                    'retries' : numretried,
                    'fetchtime' : fetchtime,
+                   'jsfastpath' : numjsfastpath,
+                   'compressedbytes' : compressedbytes,
+                   'decompressedbytes' : decompressedbytes,
+                   'abortedsize' : abortedsize,
+                   'abortedtype' : abortedtype,
+                   'abortedname' : abortedname,
+                   'abortedbytes' : abortedbytes,
+                   'redirectscached' : redirectscached,
+                   'failedcached' : failedcached,
+                   'connections' : connstats.get('created', 0),
+                   'reusedconnections' : connstats.get('reused', 0),
+                   'requestlimits' : requestlimits,
                 }
 
         self.print_project_info(statsd)
@@ -580,14 +823,55 @@ class HarvestManDataManager(object):
 
         self._bytes += count
 
+    def update_counter(self, key, count=1):
+        """ Update the statistics counter 'key' by 'count' """
 
-    def update_failed_files(self, urlObject):
-        """ Add the passed information to the failed files list """
+        self._downloaddict[key] = self._downloaddict.get(key, 0) + count
 
-        if self._redownload: return -1
+
+    def schedule_retry(self, urlObject, retryinfo):
+        """ Schedule the url object to be downloaded again later,
+        if the error was temporary. Returns True if the url object
+        was scheduled and False otherwise """
+
+        retryclass, retryafter = retryinfo
+        if not retryclass or urlObject.retries >= self._cfg.retryfailed:
+            return False
+
+        # Pieces of multipart downloads are not retried
+        if urlObject.range: return False
+        
+        tq = GetObject('trackerqueue')
+        if not tq or not tq.can_schedule_retries():
+            return False
+
+        urlObject.retries += 1
+        
+        # Allow the url to be downloaded again
+        try:
+            self._downloaddict['_doneurls'].remove(urlObject.get_full_url())
+        except ValueError:
+            pass
+
+        tq.schedule_retry(urlObject, retryclass, retryafter)
+        return True
+        
+    def update_failed_files(self, urlObject, retryinfo=('', 0)):
+        """ Add the passed information to the failed files list,
+        or schedule the url to be downloaded again if the error
+        was temporary """
 
         # Wait on the event
         self._evt.wait()
+
+        if urlObject.retries==0:
+            self._numfailed += 1
+
+        if self.schedule_retry(urlObject, retryinfo):
+            return 0
+
+        if not urlObject.range:
+            self.update_failed_cache(urlObject, urlObject.status)
         
         try:
             self._downloaddict['_failedurls'].index(urlObject)
@@ -640,6 +924,21 @@ class HarvestManDataManager(object):
             self._downloaddict['_cachefiles'] += 1            
         #else:
         #    return -1
+
+        # Downloaded after failing before
+        if urlObject.retries:
+            self.update_counter('_refetched')
+
+        # The failure is replaced by an entry which has
+        # expired, so that it also replaces the failure
+        # saved by earlier runs when the cache is written.
+        url = urlObject.get_full_url()
+        if self._failedcache.has_key(url):
+            t = time.time()
+            self._failedcache[url] = { 'status' : 0,
+                                       'count' : 0,
+                                       'timestamp' : t,
+                                       'expires' : t }
         
         # If this was present in failed urls list, remove it
         try:
@@ -742,41 +1041,48 @@ class HarvestManDataManager(object):
 
         # First add entry of this domain in
         # dictionary, if not there
-        domain = urlobj.get_full_domain()
-        try:
-            self._serversdict[domain]
-        except KeyError:
-            self._serversdict[domain] = {'accept-ranges': True}
+        self.update_server_info(urlobj, {'accept-ranges' : 1})
 
         if mirrors.supported_server(urlobj):
             return mirrors.download_multipart_url(urlobj, clength, self._cfg.numparts, self._urlThreadPool)
-        
+
+        return self.download_multipart_ranges(urlobj, [(0, clength)])
+
+    def download_multipart_ranges(self, urlobj, ranges):
+        """ Download the given byte ranges of a URL in parts using
+        range headers. The ranges are split into about as many pieces
+        as the number of parts, in proportion to their sizes. This is
+        also used for resuming an interrupted download """
+
         parts = self._cfg.numparts
-        # Calculate size of each piece
-        piecesz = clength/parts
-        
-        # Calculate size of each piece
-        pcsizes = [piecesz]*parts
-        # For last URL add the reminder
-        pcsizes[-1] += clength % parts 
-        # Create a URL object for each and set range
-        urlobjects = []
-        for x in range(parts):
-            urlobjects.append(copy.deepcopy(urlobj))
-
-        prev = 0
-        for x in range(parts):
-            curr = pcsizes[x]
-            next = curr + prev
-            urlobject = urlobjects[x]
-            urlobject.trymultipart = True
-            urlobject.clength = clength
-            urlobject.range = xrange(prev, next)
-            urlobject.mindex = x
-            prev = next
-            self._urlThreadPool.push(urlobject)
+        # Amount of data to download, the length
+        # against which the progress is shown.
+        total = sum([end - start for start, end in ranges])
+
+        mindex = 0
+        for start, end in ranges:
+            # Number of pieces for this range
+            n = int(round(float(parts)*(end - start)/total))
+            n = min(max(n, 1), end - start)
+            # Calculate size of each piece
+            pcsizes = [(end - start)/n]*n
+            # For last URL add the reminder
+            pcsizes[-1] += (end - start) % n
+
+            prev = start
+            for curr in pcsizes:
+                next = curr + prev
+                # Create a URL object for each and set range
+                urlobject = copy.deepcopy(urlobj)
+                urlobject.trymultipart = True
+                urlobject.clength = total
+                urlobject.range = xrange(prev, next)
+                urlobject.mindex = mindex
+                mindex += 1
+                prev = next
+                # Push this URL objects to the pool
+                self._urlThreadPool.push(urlobject)
             
-        # Push this URL objects to the pool
         return 0
 
     def download_url(self, caller, urlobj):
@@ -839,14 +1145,17 @@ class HarvestManDataManager(object):
 
                 self.update_file_stats( urlobj, res )
 
+                # Update pagehash on the URL object, the
+                # connector computes it as the data is read.
                 data = conn.get_data()
-                # Update pagehash on the URL object
-                if data: urlobj.pagehash = sha.new(data).hexdigest()
+                urlobj.pagehash = conn.get_digest()
+                if not urlobj.pagehash and data:
+                    urlobj.pagehash = sha.new(data).hexdigest()
                 
             else:
                 fetchurl = urlobj.get_full_url()
                 extrainfo( "Failed to download url", fetchurl)
-                self.update_failed_files(urlobj)
+                self.update_failed_files(urlobj, conn.get_retry_info())
 
             del conn
         else:
@@ -956,14 +1265,10 @@ class HarvestManDataManager(object):
                     # Get headers
                     headers = urlobj.get_url_content_info()
                     if headers:
-                        dom = urlobj.get_full_domain()
-                        if self._projectcache.has_key(dom):
-                            urldict = self._projectcache[dom]
-                            try:
-                                d = urldict[url]
-                                d['headers'] = headers
-                            except KeyError, e:
-                                pass
+                        d = self.get_cache_entry(urlobj)
+                        if d is not None:
+                            d['headers'] = headers
+                            self.put_cache_entry(urlobj, d)
 
     def dump_headers(self):
         """ Dump the headers of the web pages
@@ -1172,6 +1477,19 @@ class HarvestManDataManager(object):
         fetchtime = statsd['fetchtime']
         nfilesincache = statsd['filesincache']
         nfilesinrepos = statsd['filesinrepos']
+        njsfastpath = statsd.get('jsfastpath', 0)
+        compressedbytes = statsd.get('compressedbytes', 0)
+        decompressedbytes = statsd.get('decompressedbytes', 0)
+        nabortedsize = statsd.get('abortedsize', 0)
+        nabortedtype = statsd.get('abortedtype', 0)
+        nabortedname = statsd.get('abortedname', 0)
+        abortedbytes = statsd.get('abortedbytes', 0)
+        naborted = nabortedsize + nabortedtype + nabortedname
+        nredirectscached = statsd.get('redirectscached', 0)
+        nfailedcached = statsd.get('failedcached', 0)
+        nconnections = statsd.get('connections', 0)
+        nreused = statsd.get('reusedconnections', 0)
+        requestlimits = statsd.get('requestlimits', {})
 
         # Bug fix, download time to be calculated
         # precisely...
@@ -1181,7 +1499,10 @@ class HarvestManDataManager(object):
         strings = [('link', nlinks), ('server', nservers),
                    ('file', nfiles), ('file', nfilesinrepos),
                    ('directory', ndirs), ('link', numfailed), ('link', fatal),
-                   ('link', nretried), ('file', nfilesincache) ]
+                   ('link', nretried), ('file', nfilesincache),
+                   ('page', njsfastpath), ('connection', nconnections),
+                   ('request', nreused), ('download', naborted),
+                   ('link', nredirectscached), ('request', nfailedcached) ]
 
         fns = map(plural, strings)
         info(' ')
@@ -1220,8 +1541,30 @@ class HarvestManDataManager(object):
             info(nfilesinrepos,fns[3],wasOrWere(nfilesinrepos),'already uptodate in the repository for this project and',wasOrWere(nfilesinrepos),'not updated.')
         if nfilesincache:
             info(nfilesincache,fns[8],wasOrWere(nfilesincache),'updated from the project cache.')
+        if njsfastpath:
+            info(njsfastpath,fns[9],wasOrWere(njsfastpath),'not parsed for Javascript.')
             
         if fatal: info(fatal,fns[6],'had fatal errors and failed to download.')
+        if compressedbytes:
+            ratio = float(decompressedbytes)/float(compressedbytes)
+            ratio = float((math.modf(ratio*100.0))[1]/100.0)
+            info(compressedbytes,'bytes of compressed data expanded to',decompressedbytes,'bytes.')
+            info('Compression ratio was',ratio,'and saved',decompressedbytes - compressedbytes,'bytes.')
+        if naborted:
+            info(naborted,fns[12],wasOrWere(naborted),'aborted,',nabortedsize,'for size,',nabortedtype,'for type and',nabortedname,'for filename.')
+            moreinfo(abortedbytes,'bytes were read for aborted downloads.')
+        if nfailedcached:
+            info(nfailedcached,fns[14],'for links which failed before',wasOrWere(nfailedcached),'avoided.')
+        if nredirectscached:
+            moreinfo(nredirectscached,fns[13],wasOrWere(nredirectscached),'replaced by known redirection targets.')
+        if nconnections:
+            reuserate = 100.0*float(nreused)/float(nconnections + nreused)
+            reuserate = float((math.modf(reuserate*100.0))[1]/100.0)
+            moreinfo(nconnections,fns[10],'opened,',nreused,fns[11],'re-used a kept-alive connection','(%s%%).' % reuserate)
+        servers = requestlimits.keys()
+        servers.sort()
+        for server in servers:
+            moreinfo('Limit on simultaneous requests to server',server,'is',requestlimits[server],'.')
         if bytes: info(bytes,' bytes received at the rate of',bps,ratespec,'.\n')
         info('*** Log Completed ***\n')
         
@@ -1253,6 +1596,15 @@ class HarvestManDataManager(object):
             infostr +='elapsed:'+str(fetchtime)+','
             infostr +='fps:'+str(fps)+','
             infostr +='kbps:'+str(bps)+','
+            infostr +='jsfastpath:'+str(njsfastpath)+','
+            infostr +='compressed:'+str(compressedbytes)+','
+            infostr +='decompressed:'+str(decompressedbytes)+','
+            infostr +='connections:'+str(nconnections)+','
+            infostr +='reused:'+str(nreused)+','
+            infostr +='aborted:'+str(naborted)+','
+            infostr +='abortedbytes:'+str(abortedbytes)+','
+            infostr +='redirectscached:'+str(nredirectscached)+','
+            infostr +='failedcached:'+str(nfailedcached)+','
             infostr +='timestamp:'+tstamp
             infostr +='\n'
             
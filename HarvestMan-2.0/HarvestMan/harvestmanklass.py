@@ -444,8 +444,7 @@ class HarvestMan(object):
            if not self._cfg.ignoreinterrupts:
                self._cfg.keyboardinterrupt = True
                logconsole('Exception received=>',str(e))
-               # dont allow to write cache, since it
-               # screws up existing cache.
+               # Write the cache entries which are waiting
                GetObject('datamanager').conditional_cache_set()
                self.save_current_state()
                 
@@ -553,8 +552,7 @@ class HarvestMan(object):
                             self.start_project()
                     except (KeyboardInterrupt, EOFError, Exception):
                         if not self._cfg.ignoreinterrupts:
-                            # dont allow to write cache, since it
-                            # screws up existing cache.
+                            # Write the cache entries which are waiting
                             GetObject('datamanager').conditional_cache_set()
                             # Disable tracebacks
                             sys.excepthook = None
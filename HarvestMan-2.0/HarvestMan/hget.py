@@ -39,9 +39,13 @@ Copyright(C) 2007, Anand B Pillai
 
 import sys, os
 import re
+import time
+import datetime
 import shutil
 import connector
 import urlparser
+import mirrors
+import checksums
 import config
 import logger
 import datamgr
@@ -85,6 +89,101 @@ class Hget(HarvestMan):
             
         # monitor.stop()
 
+    def grab_urls(self, urls):
+        """ Download a list of URLs, a number of them at a time
+        using the threads of the thread pool """
+
+        urlobjs = []
+        for url in urls:
+            try:
+                urlobjs.append(urlparser.HarvestManUrlParser(url))
+            except urlparser.HarvestManUrlParserError, e:
+                print 'Error: Invalid URL "%s"' % url
+
+        jobs, total = self._cfg.hgetjobs, len(urlobjs)
+        print 'Downloading %d URLs, %d at a time...' % (total, jobs)
+        
+        prog = self._cfg.progressobj
+        prog.setTopic('Batch download')
+        prog.set(100, 100)
+        prog.setHasSub(True)
+
+        pending = urlobjs[:]
+        start = time.time()
+        
+        try:
+            while True:
+                # Only keep a few URLs in the queue of the
+                # pool, since pushing blocks if it is full.
+                while pending and self._pool.qsize() < jobs:
+                    self._pool.push(pending.pop(0))
+
+                results = [u.hgetresult for u in urlobjs if u.hgetresult]
+                done = len(results)
+                nbytes = sum([r[1] for r in results])
+                
+                elapsed = time.time() - start
+                bw = 0.0
+                if elapsed: bw = nbytes/(1024.0*elapsed)
+                
+                failed = len([r for r in results if not r[0]])
+                infostring = '%d/%d done %d failed %.1fK/s' % (done, total, failed, bw)
+                prog.setScreenWidth(prog.getScreenWidth())
+                prog.setSubTopic(1, infostring)
+                if total:
+                    prog.setSub(1, 100.0*done/total, 100)
+                prog.show()
+                
+                if done==total:
+                    break
+                time.sleep(0.5)
+        except KeyboardInterrupt, e:
+            print '\n\nDownload aborted by user interrupt.'
+            print 'Waiting for threads to finish...'
+            self._pool.end_all_threads()
+
+        print ''
+        self.write_report(urlobjs, time.time() - start)
+
+    def write_report(self, urlobjs, elapsed):
+        """ Print a summary of a batch download, and write a report
+        of the status, bytes downloaded and time taken for each URL to
+        the report file, if one was given """
+
+        lines = []
+        saved, failed, nbytes = 0, 0, 0
+        
+        for urlobj in urlobjs:
+            if urlobj.hgetresult==None:
+                status, datalen, tgap = 'ABORTED', 0, 0.0
+            else:
+                res, datalen, tgap = urlobj.hgetresult
+                if res:
+                    status = 'OK'
+                    saved += 1
+                else:
+                    status = 'FAILED'
+                    if urlobj.status:
+                        status = 'FAILED(%s)' % urlobj.status
+                    failed += 1
+                nbytes += datalen
+                
+            lines.append('%s %s %d %.2f' % (urlobj.get_full_url(), status, datalen, tgap))
+
+        timestr = str(datetime.timedelta(seconds=int(elapsed)))
+        print 'Saved %d of %d URLs, %d failed.' % (saved, len(urlobjs), failed)
+        print '%d bytes downloaded in %s hours.' % (nbytes, timestr)
+
+        if self._cfg.hgetreport:
+            try:
+                f = open(self._cfg.hgetreport, 'w')
+                f.write('# URL status bytes seconds\n')
+                f.write('\n'.join(lines) + '\n')
+                f.close()
+                print 'Report written to %s.' % self._cfg.hgetreport
+            except (IOError, OSError), e:
+                print 'Error writing report:',e
+
     def clean_up(self, conn, urlobj, exception=None):
 
         reader = conn.get_reader()
@@ -96,28 +195,6 @@ class Hget(HarvestMan):
         if self._cfg.flushdata:
             print 'Cleaning up temporary files...'
             fname1 = conn.get_tmpfname()
-            fullurl = urlobj.get_full_url()
-            range_request = conn._headers.get('accept-ranges','').lower()
-            # If server supports range requests, then do not
-            # clean up temp file, since we can start from where
-            # we left off, if this file is requested again.
-            if not range_request=='bytes':
-                if fname1:
-                    try:
-                        os.remove(fname1)
-                    except OSError, e:
-                        print e
-            elif fname1:
-                # Dump an info file consisting of the header
-                # information to a file, so that we can use it
-                # to resume downloading from where we left off
-                infof = os.path.join(os.path.dirname(fname1), ''.join((".info#",
-                                                                       str(abs(hash(fullurl))))))
-                if not os.path.isfile(infof):
-                    try:
-                        open(infof, 'wb').write(str(conn._headers))
-                    except (OSError, IOError), e:
-                        print e
 
             lthreads = self._pool.get_threads()
             lfiles = []
@@ -129,13 +206,30 @@ class Hget(HarvestMan):
             print 'Waiting for threads to finish...'
             self._pool.end_all_threads()
 
+            # If the download can be resumed, save the byte
+            # ranges downloaded so far and keep the data, so
+            # that we can start from where we left off, if
+            # this file is requested again.
+            if conn.save_journal(urlobj):
+                print 'Saved state of download for resuming it later.'
+                keepfile = conn._journal.datafile
+                lfiles = [f for f in lfiles if os.path.abspath(f) != keepfile]
+            elif fname1:
+                try:
+                    os.remove(fname1)
+                except OSError, e:
+                    print e
+
             # For currently running multipart download, clean
             # up all pieces since there is no guarantee that
             # the next request will be for the same number of
             # pieces of files, though the server supports
             # multipart downloads.
-            if lfiles:
-                tmpdir = os.path.dirname(lfiles[0])
+            # Pieces written into a preallocated file are not
+            # in the temporary directory.
+            tmpfiles = [f for f in lfiles if f != urlobj.partfile]
+            if tmpfiles:
+                tmpdir = os.path.dirname(tmpfiles[0])
             else:
                 tmpdir = ''
                 
@@ -202,6 +296,13 @@ class Hget(HarvestMan):
         self._cfg.requests = 2*self._cfg.numparts
         # Thread pool size need to be only equal to numparts
         # self._cfg.threadpoolsize = self._cfg.numparts
+        if self._cfg.hgetjobs > 1:
+            # For batch downloads, each thread of the pool
+            # downloads a URL in one piece. The limit on
+            # requests to a server still holds.
+            self._cfg.threadpoolsize = self._cfg.hgetjobs
+            self._cfg.connections = max(self._cfg.connections, self._cfg.hgetjobs)
+            self._cfg.nomultipart = True
         # Set verbosity
         # print self._cfg.hgetverbose
         if self._cfg.hgetverbose:
@@ -228,24 +329,70 @@ class Hget(HarvestMan):
             print 'Error: No input URL/file given. Run with -h or no arguments to see usage.\n'
             return -1
 
+        # A metalink file given as argument lists the mirrors
+        # of a file, download the file from them.
+        mirrorfile = self._cfg.hgetmirrors
+        if os.path.isfile(arg) and mirrors.is_metalink(arg):
+            mirrorfile = arg
+            
+        if mirrorfile:
+            try:
+                print 'Loaded %d mirrors from %s' % (mirrors.load_mirrors(mirrorfile), mirrorfile)
+            except Exception, e:
+                print 'Error: Could not load mirrors from %s: %s' % (mirrorfile, e)
+                return -1
+
+            if mirrorfile == arg:
+                if not mirrors.MIRRORS:
+                    print 'Error: No http URLs found in metalink file %s' % arg
+                    return -1
+                arg = mirrors.MIRRORS[0]
+
+        # Checksums to verify the downloads against, a
+        # metalink file also lists the checksums of files.
+        checksumfiles = []
+        if mirrorfile and mirrors.is_metalink(mirrorfile):
+            checksumfiles.append(mirrorfile)
+        if self._cfg.hgetchecksum:
+            checksumfiles.append(self._cfg.hgetchecksum)
+
+        for value in checksumfiles:
+            try:
+                checksums.load_checksums(value)
+            except Exception, e:
+                print 'Error: Could not load checksums from %s: %s' % (value, e)
+                return -1
+
         # Check if the argument is a file, if so
         # download URLs specified in the file.
         if os.path.isfile(arg):
             # Open it, read URL per line and schedule download
             print 'Input file %s found, scheduling download of URLs...' % arg
             try:
-                for line in file(arg):
-                    url = line.strip()
-                    print ''
-                    self.grab_url(url)
-                    # Reset progress object
-                    self._cfg.reset_progress()
+                if self._cfg.hgetjobs > 1:
+                    urls, seen = [], {}
+                    for line in file(arg):
+                        url = line.strip()
+                        if url and url not in seen:
+                            urls.append(url)
+                            seen[url] = True
+                    self.grab_urls(urls)
+                else:
+                    for line in file(arg):
+                        url = line.strip()
+                        print ''
+                        self.grab_url(url)
+                        # Reset progress object
+                        self._cfg.reset_progress()
             except IOError, e:
                 print 'Error:',e
             except Exception, e:
                 raise
         else:
             self.grab_url(arg)
+
+        # Save what we learned about the servers
+        dmgr.write_server_cache()
         
     def main(self):
         """ Main routine """
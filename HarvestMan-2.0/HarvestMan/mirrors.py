@@ -6,10 +6,13 @@ Author - Anand B Pillai <anand at harvestmanontheweb.com>
 Created,  Anand B Pillai 14/08/07.
 
 Copyright (C) 2007 Anand B Pillai.
-    
+
 """
 
-import random
+import time
+import urllib2
+import threading as tg
+import xml.dom.minidom
 import urlparser
 from common.common import *
 
@@ -25,32 +28,120 @@ SFMIRRORS = ['http://umn.dl.sourceforge.net','http://jaist.dl.sourceforge.net',
              'http://easynews.dl.sourceforge.net','http://belnet.dl.sourceforge.net',
              'http://puzzle.dl.sourceforge.net','http://internap.dl.sourceforge.net']
 
-def supported_server(urlobj):
+# Mirrors loaded from a mirror list or a metalink
+# file. These are base URLs, the path of a file
+# below one of them is the same on all of them.
+MIRRORS = []
+
+# Number of bytes requested from a mirror
+# for measuring its latency and throughput
+PROBESIZE = 64*1024
+# Time in seconds to wait for the probes
+PROBETIMEOUT = 15.0
+# Rankings older than this are measured again
+RANKINGTIMEOUT = 86400.0
+# Mirrors too slow for a piece of this
+# size are not used
+MINPIECESIZE = 256*1024
+
+def is_metalink(filename):
+    """ Check whether the given file is a metalink file """
+
+    if filename.lower().endswith('.metalink'):
+        return True
+
+    try:
+        f = open(filename)
+        data = f.read(1024)
+        f.close()
+    except IOError, e:
+        return False
+
+    return data.find('<metalink') != -1
 
-    flag = False
+def load_mirrors(filename):
+    """ Load the mirrors from the given file, which is either a
+    metalink file or a list of mirror URLs, one on each line. Returns
+    the number of mirrors loaded """
 
-    if is_sourceforge_url(urlobj):
-        global SOURCEFORGE
-        SOURCEFORGE = True
-        flag = True
+    global MIRRORS
 
-    return flag
+    mirrorlist = []
+
+    if is_metalink(filename):
+        # The metalink lists complete URLs of the file.
+        # Only http mirrors support range requests.
+        dom = xml.dom.minidom.parse(filename)
+        for node in dom.getElementsByTagName('url'):
+            url = ''.join([x.data for x in node.childNodes if x.nodeType==x.TEXT_NODE]).strip()
+            if url.lower().startswith('http'):
+                mirrorlist.append(url)
+        dom.unlink()
+    else:
+        for line in open(filename):
+            url = line.strip().rstrip('/')
+            if url and not url.startswith('#'):
+                mirrorlist.append(url)
+
+    MIRRORS = mirrorlist
+    return len(MIRRORS)
+
+def find_mirror(url):
+    """ Return the mirror which serves the given URL,
+    or an empty string if there is none """
+
+    found = ''
+    for mirror in MIRRORS:
+        if url.startswith(mirror) and len(mirror) > len(found):
+            rest = url[len(mirror):]
+            if rest=='' or rest[0] in '/?':
+                found = mirror
+
+    return found
+
+def supported_server(urlobj):
 
-def log_mirror_message():
+    global SOURCEFORGE
+    SOURCEFORGE = is_sourceforge_url(urlobj)
+
+    return SOURCEFORGE or (find_mirror(urlobj.get_full_url()) != '')
+
+def log_mirror_message(count):
 
     if SOURCEFORGE:
         logconsole('Sourceforge URL found - Splitting download across sourceforge.net mirrors...\n')
+    else:
+        logconsole('Splitting download across %d mirrors...\n' % count)
 
 def get_mirrors():
     """ Return a list of mirrors for the current server """
 
     if SOURCEFORGE:
         return SFMIRRORS
+    else:
+        return MIRRORS
+
+def get_mirror_urls(urlobj):
+    """ Return the URLs of the file of the given url
+    object on all of its mirrors """
+
+    if SOURCEFORGE:
+        # Get relative path of the URL w.r.t root
+        relpath = 'sourceforge' + urlobj.get_relative_url()
+        return [urlparser.HarvestManUrlParser(relpath,baseurl=x).get_full_url() for x in SFMIRRORS]
+
+    url = urlobj.get_full_url()
+    mirror = find_mirror(url)
+    if not mirror:
+        return []
+
+    rest = url[len(mirror):]
+    return [x + rest for x in MIRRORS]
 
 def is_multipart_download_supported(urlobj):
     """ Check whether this URL (server) supports multipart downloads """
 
-    return is_sourceforge_url(urlobj)
+    return is_sourceforge_url(urlobj) or (find_mirror(urlobj.get_full_url()) != '')
 
 def is_sourceforge_url(urlobj):
     """ Is this a download from sourceforge ? """
@@ -58,48 +149,145 @@ def is_sourceforge_url(urlobj):
     return (urlobj.domain in ('downloads.sourceforge.net', 'prdownloads.sourceforge.net') or \
            urlobj.get_full_domain() in SFMIRRORS )
 
-def create_multipart_urls(urlobj, numparts):
+def probe_mirror(urlobj, clength, results):
+    """ Request the first bytes of the file of the url object
+    and save the latency and throughput of its server in the
+    dictionary 'results'. A mirror whose copy of the file is
+    not of length 'clength' gets a throughput of zero """
 
-    urlobjects = []
-    relpath = ''
+    speed, latency = 0.0, 0.0
 
-    if SOURCEFORGE:
-        # Get relative path of the URL w.r.t root
-        relpath = urlobj.get_relative_url()
-        relpath = 'sourceforge' + relpath
-
-    # Get a random list of servers
-    sf = random.sample(get_mirrors(), numparts)
-    
-    for x in range(numparts):
-        # urlobjects.append(copy.deepcopy(urlobj))
-        newurlobj = urlparser.HarvestManUrlParser(relpath,baseurl=sf[x])
-        print newurlobj.get_full_url()
+    try:
+        request = urllib2.Request(urlobj.get_full_url())
+        request.add_header('Range', 'bytes=0-%d' % (PROBESIZE - 1))
+
+        t1 = time.time()
+        f = urllib2.urlopen(request)
+        t2 = time.time()
+        latency = t2 - t1
+
+        # The mirror should send the requested range
+        # of a file of the same size.
+        crange = f.info().get('content-range', '')
+        if crange.endswith('/%d' % clength):
+            data = f.read(PROBESIZE)
+            # Include the latency, for a small probe it
+            # weighs as much as the transfer itself.
+            speed = len(data)/max(time.time() - t1, 0.001)
+        f.close()
+    except Exception, e:
+        extrainfo('Error probing mirror', urlobj.get_full_url(), '=>', e)
+
+    results[urlobj.get_full_url()] = (speed, latency)
+
+def rank_mirrors(urls, clength, count):
+    """ Return the mirror URLs of a file of length 'clength'
+    which have the file, with their throughput, fastest first.
+
+    The mirrors are probed in parallel and the measurements are
+    saved with the server information of the data manager, which
+    is kept on the disk. If the rankings of at least 'count' of
+    the mirrors are recent, only the fastest 'count' of them are
+    probed, to check that they have the file """
+
+    dmgr = GetObject('datamanager')
+
+    urlobjs = [urlparser.HarvestManUrlParser(x) for x in urls]
+    t = time.time()
+
+    known = []
+    for urlobj in urlobjs:
+        info = dmgr.get_server_info(urlobj)
+        if t - info.get('mirrorprobed', 0) < RANKINGTIMEOUT:
+            known.append((info.get('mirrorspeed', 0.0), urlobj))
+
+    if len(known) >= count:
+        known.sort(lambda x, y: cmp(y[0], x[0]))
+        urlobjs = [x[1] for x in known[:count]]
+
+    results, threads = {}, []
+    for urlobj in urlobjs:
+        thread = tg.Thread(target=probe_mirror, args=(urlobj, clength, results))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+
+    moreinfo('Probing %d mirrors...' % len(threads))
+
+    for thread in threads:
+        thread.join(max(PROBETIMEOUT - (time.time() - t), 0))
+
+    ranking = []
+    for urlobj in urlobjs:
+        url = urlobj.get_full_url()
+        # Mirrors which did not reply in time or do not
+        # have the file are not saved, whether the file
+        # is there depends on the file.
+        speed, latency = results.get(url, (0.0, 0.0))
+        if speed > 0:
+            dmgr.update_server_info(urlobj, {'mirrorspeed' : speed,
+                                             'mirrorlatency' : latency,
+                                             'mirrorprobed' : t})
+            ranking.append((speed, -latency, url))
+
+    ranking.sort()
+    ranking.reverse()
+
+    return [(url, speed) for speed, latency, url in ranking]
+
+def create_multipart_urls(urlobj, clength, numparts):
+    """ Return url objects for the fastest 'numparts' mirrors
+    of the file of length 'clength' and their throughputs """
+
+    ranking = rank_mirrors(get_mirror_urls(urlobj), clength, numparts)[:numparts]
+
+    urlobjects, speeds = [], []
+
+    for url, speed in ranking:
+        newurlobj = urlparser.HarvestManUrlParser(url)
+        extrainfo('Mirror %s, %.1f KB/s' % (url, speed/1024.0))
         urlobjects.append(newurlobj)
+        speeds.append(speed)
+
+    return urlobjects, speeds
+
+def get_piece_sizes(clength, speeds):
+    """ Split a length of 'clength' into pieces in
+    proportion to the given throughputs, which are sorted
+    fastest first. Slow mirrors are left out if their
+    pieces would be too small, so there may be fewer
+    pieces than throughputs """
+
+    speeds = speeds[:]
+    while len(speeds)>1 and clength*speeds[-1]/sum(speeds) < MINPIECESIZE:
+        speeds.pop()
+
+    total = sum(speeds)
+    pcsizes = [int(clength*x/total) for x in speeds]
+    # For last URL add the reminder
+    pcsizes[-1] += clength - sum(pcsizes)
+
+    return pcsizes
 
-    return urlobjects
-    
 def download_multipart_url(urlobj, clength, numparts, threadpool):
-    """ Download URL multipart from supported servers """
+    """ Download URL multipart from supported servers. Returns
+    -1 if none of the mirrors could be used """
 
-    log_mirror_message()
-    
-    # List of servers - note that we are not doing
-    # any kind of search for the nearest servers. Instead
-    # a random list is created.
-    # Calculate size of each piece
-    piecesz = clength/numparts
+    # Faster mirrors get larger pieces, so that all
+    # pieces take about the same time to download.
+    urlobjects, speeds = create_multipart_urls(urlobj, clength, numparts)
+    if not urlobjects:
+        logconsole('No mirrors found for %s' % urlobj.get_full_url())
+        return -1
 
     # Calculate size of each piece
-    pcsizes = [piecesz]*numparts
-    # For last URL add the reminder
-    pcsizes[-1] += clength % numparts 
-    # Create a URL object for each and set range
-    urlobjects = create_multipart_urls(urlobj, numparts)
+    pcsizes = get_piece_sizes(clength, speeds)
+
+    log_mirror_message(len(pcsizes))
 
     prev = 0
 
-    for x in range(numparts):
+    for x in range(len(pcsizes)):
         curr = pcsizes[x]
         next = curr + prev
         urlobject = urlobjects[x]
@@ -107,11 +295,10 @@ def download_multipart_url(urlobj, clength, numparts, threadpool):
         urlobject.clength = clength
         urlobject.range = xrange(prev, next)
         urlobject.mindex = x
+        urlobject.partfile = urlobj.partfile
         prev = next
 
         # Push this URL objects to the pool
         threadpool.push(urlobject)
 
     return 0
-
-
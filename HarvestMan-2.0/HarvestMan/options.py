@@ -29,6 +29,10 @@ hman_options=\
   ('proxyuser', 'short=U','long=proxyuser','help=Set username for proxy server to USERNAME','meta=USERNAME'),
   ('proxypasswd', 'short=W','long=proxypass','help= Set password for proxy server to PASSWORD','meta=PASSWORD'),
   ('connections', 'short=n','long=connections','help=Limit number of simultaneous network connections to NUMCONNECTIONS','meta=NUMCONNECTIONS'),
+  ('asyncmode', 'short=a','long=async','help=Download urls using non-blocking sockets on a single event loop instead of tracker threads','type=bool'),
+  ('bandwidth', 'short=B','long=bandwidth','help=Limit the download bandwidth to RATE KB/sec','meta=RATE'),
+  ('hostbandwidth', 'short=k','long=hostbandwidth','help=Limit the download bandwidth from each server to RATE KB/sec','meta=RATE'),
+  ('purgefailed', 'short=N','long=purgefailed','help=Purge the saved list of urls which failed in earlier runs, so that they are requested again','type=bool'),
   ('cache', 'short=c','long=cache',"help=Enable/disable caching of downloaded files. If enabled(default), files won't be saved unless their timestamp is newer than the cache timestamp"),
   ('depth', 'short=d','long=depth','help=Set the limit on the depth of urls to DEPTH','meta=DEPTH'),
   ('workers', 'short=w','long=workers','help=Enable worker threads and set the number of worker threads to NUMWORKERS','meta=NUMWORKERS'),
@@ -53,8 +57,14 @@ hget_options=\
   ('numparts','short=P','long=numparts','help=Force-split download into <NUMPARTS> parts (max 10)'),
   ('memory','short=m','long=inmem','help=Keep data in memory instead of flushing to disk', 'type=bool' ,'default=False'),
   ('notempdir','short=n','long=notemp','help=Use current directory instead of system temp directory for saving intermediate files','type=bool'),
+  ('merge','short=M','long=merge','help=Save the pieces of a multipart download to temporary files and merge them, instead of writing them into the output file directly','type=bool'),
+  ('jobs','short=j','long=jobs','meta=N','help=Download N URLs of an input file at a time'),
+  ('report','short=r','long=report','meta=FILE','help=Write the status, size and time taken for each URL of an input file to FILE'),
+  ('mirrors','short=f','long=mirrors','meta=FILE','help=Split multipart downloads across the fastest mirrors listed in FILE, a list of mirror URLs or a metalink file'),
+  ('checksum','short=c','long=checksum','meta=CHECKSUM','help=Verify downloads against CHECKSUM, given as TYPE:DIGEST with TYPE one of md5, sha1 or sha256, or as a checksum file or metalink file listing the checksums of files'),
   ('output','short=o','long=output','meta=FILE','help=Save document to FILE'),
   ('outputdir','short=d','long=outputdir','meta=DIRECTORY','help=Save document to directory'), 
+  ('bandwidth', 'short=B','long=bandwidth','help=Limit the download bandwidth to RATE KB/sec','meta=RATE'),
   ] 
 
 def getOptList(appname):
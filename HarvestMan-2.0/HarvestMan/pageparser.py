@@ -376,11 +376,29 @@ class HarvestManSGMLOpParser(HarvestManSimpleParser):
 class HarvestManCSSParser(object):
     """ Class to parse stylesheets and extract URLs """
 
-    # Regexp to parse stylesheet imports
-    importcss1 = re.compile(r'(\@import\s+\"?)(?!url)([\w.-:/]+)(\"?)', re.MULTILINE|re.LOCALE|re.UNICODE)
-    importcss2 = re.compile(r'(\@import\s+url\(\"?)([\w.-:/]+)(\"?\))', re.MULTILINE|re.LOCALE|re.UNICODE)
-    # Regexp to parse URLs inside CSS files
-    cssurl = re.compile(r'(url\()([^\)]+)(\))', re.LOCALE|re.UNICODE)
+    # Single regular expression which tokenizes a stylesheet in
+    # one pass. Comments and quoted strings are matched as tokens
+    # of their own so that any url(...) or @import text inside them
+    # is skipped over. Every alternative starts with a literal
+    # character, which lets the regex engine skip quickly over
+    # positions where no token can start - so the case-insensitive
+    # parts are spelt out instead of using re.IGNORECASE. Comments
+    # are matched without backtracking, an unterminated comment runs
+    # to the end of the data.
+    #
+    # The groups are, in order, @import url(...), @import "...",
+    # bare @import, url(...) and URL(...) values.
+    csstoken = re.compile(r'''
+    /\*[^*]*(?:\*+[^*/][^*]*)*(?:\*+/|\**\Z)
+    | @[iI][mM][pP][oO][rR][tT]\s*
+      (?:[uU][rR][lL]\(\s*("[^"]*"|'[^']*'|[^)\s]*)\s*\)
+      | ("[^"]*"|'[^']*')
+      | (?![uU][rR][lL]\()([^\s;"']+))
+    | u[rR][lL]\(\s*("[^"]*"|'[^']*'|[^)]*?)\s*\)
+    | U[rR][lL]\(\s*("[^"]*"|'[^']*'|[^)]*?)\s*\)
+    | "(?:[^"\\\n]|\\.)*"
+    | '(?:[^'\\\n]|\\.)*'
+    ''', re.VERBOSE|re.DOTALL)
 
     def __init__(self):
         # Any imported stylesheet URLs
@@ -394,31 +412,29 @@ class HarvestManCSSParser(object):
     def _parse(self, data):
         """ Parse stylesheet data and extract imported css links, if any """
 
-        # Return is a list of imported css links.
         # This subroutine uses the specification mentioned at
         # http://www.w3.org/TR/REC-CSS2/cascade.html#at-import
         # for doing stylesheet imports.
 
         # This takes care of @import "style.css" and
         # @import url("style.css") and url(...) syntax.
-        # Media types specified if any, are ignored.
+        # Media types specified if any, are ignored. URLs
+        # are collected in document order, without duplicates.
+        seen = {}
         
-        # Matches for @import "style.css"
-        l1 = self.importcss1.findall(data)
-        # Matches for @import url("style.css")
-        l2 = self.importcss2.findall(data)
-        # Matches for url(...)
-        l3 = self.cssurl.findall(data)
-        
-        for item in (l1+l2):
-            if not item: continue
-            url = item[1].replace("'",'').replace('"','')
-            self.csslinks.append(url)
-            self.links.append(url)
+        for importurl, importstr, importbare, url1, url2 in self.csstoken.findall(data):
+            url = importurl or importstr or importbare or url1 or url2
+            # Comments and strings have all groups empty
+            if not url: continue
+            
+            # Strip quotes and whitespace
+            if url[0] in ('"', "'"):
+                url = url[1:-1].strip()
+            if not url or url in seen: continue
             
-        for item in l3:
-            if not item: continue
-            url = item[1].replace("'",'').replace('"','')
+            seen[url] = True
+            if not (url1 or url2):
+                self.csslinks.append(url)
             self.links.append(url)
 
 class HarvestManJSParser(JSParser):
@@ -436,6 +452,10 @@ class HarvestManJSParser(JSParser):
     # Form => window.location.href="<url>" or location.href="<url>"
     jsredirect2 = re.compile(r'([window\.]?location\.href\s*\=\s*)(.*)', re.IGNORECASE)
     quotechars = re.compile(r'[\'\"]*')
+    # Pre-scan regular expression. Both the redirect forms above
+    # need one of these tokens, so a page which does not match this
+    # cannot produce a redirect and need not be tokenized at all.
+    jsprescan = re.compile(r'location\.(replace|assign|href)', re.IGNORECASE)
     
     def __init__(self):
         self.links = []
@@ -446,6 +466,14 @@ class HarvestManJSParser(JSParser):
         super(HarvestManJSParser, self).reset()
         self.links = []
         self.redirectedurl = ''        
+
+    def needs_parsing(cls, data):
+        """ Return True if the page content 'data' can contain
+        any Javascript which this parser acts upon """
+
+        return (cls.jsprescan.search(data) != None)
+
+    needs_parsing = classmethod(needs_parsing)
         
     def feed(self, data):
         """ Parse the HTML/XHTML content and perform JS processing """
@@ -33,6 +33,8 @@ import re
 import os
 import time
 import copy
+import mimetypes
+import urlparse
 
 import robotparser
 
@@ -58,6 +60,8 @@ class HarvestManRulesChecker(object):
     __metaclass__ = MethodWrapperMetaClass
     # Regular expression for matching www. infront of domains
     wwwre = re.compile(r'^www\.')
+    # Regular expression for the filename in Content-Disposition
+    dispositionre = re.compile(r'filename\s*=\s*[\'"]?([^\'";]+)', re.IGNORECASE)
 
     def __init__(self):
 
@@ -466,6 +470,54 @@ class HarvestManRulesChecker(object):
         # We wont reach here
         return 0
 
+    def check_content_headers(self, urlObj, headers):
+        """ Check the content type and the filename in the
+        content disposition of the response headers of the url
+        object against the rules, before its data is read.
+        Returns 'type' or 'name' if the rules prevent download
+        of the url and an empty string otherwise """
+
+        if urlObj.starturl or urlObj.typ in self._configobj.skipruletypes:
+            return ''
+
+        url = urlObj.get_full_url()
+        ctype = headers.get('content-type', '').split(';')[0].strip().lower()
+
+        # Images served from urls without an image extension
+        if ctype.startswith('image/') and not self._configobj.images:
+            extrainfo("Image filter - filtered", url)
+            return 'type'
+
+        # Filters on file extensions also apply to urls
+        # which do not have the extension of their type.
+        # Generic binary data could be of any type.
+        if ctype and ctype != 'application/octet-stream' and self._configobj.exclfilter:
+            extn = mimetypes.guess_extension(ctype)
+            if extn and not url.lower().endswith(extn) and self._apply_exclusion_filter(url + extn):
+                extrainfo("Custom filter - filtered type", ctype, "of", url)
+                return 'type'
+
+        m = self.dispositionre.search(headers.get('content-disposition', ''))
+        if m:
+            filename = os.path.basename(m.group(1).strip().replace('\\', '/'))
+            if filename and self._apply_exclusion_filter(urlparse.urljoin(url, filename)):
+                extrainfo("Custom filter - filtered file", filename, "of", url)
+                return 'name'
+
+        return ''
+
+    def _apply_exclusion_filter(self, url):
+        """ Return whether the exclusion filter blocks the url
+        and the inclusion filter does not explicitly allow it """
+
+        for f in self._configobj.exclfilter:
+            if f.search(url):
+                for g in self._configobj.inclfilter:
+                    if g.search(url): return False
+                return True
+
+        return False
+        
     def apply_server_filter(self, urlObj):
         """ See if we have a filter matching the server of
         this url. Return 1 on success(blocked) and 0 on failure
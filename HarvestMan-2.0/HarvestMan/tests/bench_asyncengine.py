@@ -0,0 +1,133 @@
+# -- coding: latin-1
+""" Benchmark for the asynchronous download engine.
+
+Starts a number of local HTTP servers, each of which serves
+a web site whose pages link to each other and to the pages
+of the other servers. Every request is delayed to simulate
+network latency. The sites are crawled with the tracker
+threads and with the asynchronous engine and the time taken
+is printed for both.
+
+The number of servers and number of pages per server can be
+given as arguments, default is 8 servers with 100 pages.
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import sys, os
+import time
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+class BenchHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handler which serves linked pages """
+
+    # Ports of all servers
+    ports = []
+    npages = 0
+    # Delay for each request in seconds
+    latency = 0.05
+
+    def do_GET(self):
+        time.sleep(self.latency)
+
+        path = self.path.strip('/')
+        if path == '':
+            path = 'index.html'
+
+        if path == 'index.html':
+            page = 0
+        elif path.startswith('page') and path.endswith('.html'):
+            try:
+                page = int(path[4:-5])
+            except ValueError:
+                page = self.npages
+        else:
+            page = self.npages
+
+        if page >= self.npages:
+            self.send_error(404)
+            return
+
+        links = []
+        # Pages on this server
+        for x in range(page*2+1, min(page*2+3, self.npages)):
+            links.append('/page%d.html' % x)
+        # Same page on the other servers
+        for port in self.ports:
+            links.append('http://127.0.0.1:%d/page%d.html' % (port, page))
+
+        body = ['<html><head><title>Page %d</title></head><body>' % page]
+        for link in links:
+            body.append('<a href="%s">%s</a>' % (link, link))
+        body.append('</body></html>')
+        data = '\n'.join(body)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def bench(url, asyncmode):
+    """ Crawl the url and return the time taken and the
+    number of files saved """
+
+    basedir = tempfile.mkdtemp()
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'harvestman.py')
+
+    args = [sys.executable, script, '-p', 'bench', '-b', basedir,
+            '-f', '4', '-c', 'no', '-S', 'no', '-V', '0', '-l', 'no']
+    if asyncmode:
+        args.append('-a')
+    args.append(url)
+
+    try:
+        t1 = time.time()
+        os.spawnv(os.P_WAIT, sys.executable, args)
+        t2 = time.time()
+
+        count = 0
+        for root, dirs, files in os.walk(basedir):
+            count += len([f for f in files if f.endswith('.html')])
+    finally:
+        shutil.rmtree(basedir, True)
+
+    return t2 - t1, count
+
+if __name__=="__main__":
+    nservers, npages = 8, 100
+    if len(sys.argv)>1:
+        nservers = int(sys.argv[1])
+    if len(sys.argv)>2:
+        npages = int(sys.argv[2])
+
+    BenchHandler.npages = npages
+    servers = []
+    for x in range(nservers):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), BenchHandler)
+        BenchHandler.ports.append(server.server_address[1])
+        t = threading.Thread(target=server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        servers.append(server)
+
+    url = 'http://127.0.0.1:%d/index.html' % BenchHandler.ports[0]
+
+    for asyncmode, name in ((0, 'threads'), (1, 'async')):
+        elapsed, count = bench(url, asyncmode)
+        print '%s: %d pages from %d servers in %.2f seconds' % (name, count, nservers, elapsed)
+
+    for server in servers:
+        server.shutdown()
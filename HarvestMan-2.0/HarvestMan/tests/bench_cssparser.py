@@ -0,0 +1,112 @@
+# -- coding: latin-1
+""" Benchmark for the HarvestManCSSParser class of the pageparser module.
+
+Parses a typical stylesheet, which has few url(...) values
+among a lot of rules, and a stylesheet which is dense with
+url(...) values, with the current single-pass parser and with
+the older parser which used three regular expressions. The
+size of the stylesheets in KB can be given as an argument,
+default is 1024 KB.
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import sys, os
+import re
+import time
+
+test_base.setUp()
+
+from pageparser import HarvestManCSSParser
+
+class OldCSSParser(object):
+    """ The older stylesheet parser, which made three
+    passes over the data """
+
+    importcss1 = re.compile(r'(\@import\s+\"?)(?!url)([\w.-:/]+)(\"?)', re.MULTILINE|re.LOCALE|re.UNICODE)
+    importcss2 = re.compile(r'(\@import\s+url\(\"?)([\w.-:/]+)(\"?\))', re.MULTILINE|re.LOCALE|re.UNICODE)
+    cssurl = re.compile(r'(url\()([^\)]+)(\))', re.LOCALE|re.UNICODE)
+
+    def __init__(self):
+        self.csslinks = []
+        self.links = []
+
+    def feed(self, data):
+        l1 = self.importcss1.findall(data)
+        l2 = self.importcss2.findall(data)
+        l3 = self.cssurl.findall(data)
+
+        for item in (l1+l2):
+            if not item: continue
+            url = item[1].replace("'",'').replace('"','')
+            self.csslinks.append(url)
+            self.links.append(url)
+
+        for item in l3:
+            if not item: continue
+            url = item[1].replace("'",'').replace('"','')
+            self.links.append(url)
+
+# A rule as found in most stylesheets
+rule = '''
+/* Rule %(n)d */
+#content .item-%(n)d, #sidebar ul li.item-%(n)d a:hover {
+    font-family: "Lucida Grande", Verdana, Arial, sans-serif;
+    font-size: 0.85em; line-height: 1.4em;
+    color: #333; background-color: #fafafa;
+    margin: 0 auto 10px auto; padding: 4px 8px;
+    border-bottom: 1px solid #ddd;
+    text-decoration: underline; text-transform: uppercase;
+}
+'''
+
+# A rule with several url(...) values
+urlrule = '''
+.icon-%(n)d { background: url(images/icons/%(n)d.png) no-repeat; }
+.icon-%(n)d:hover { background-image: url("images/icons/%(n)d-hover.png"); }
+.cursor-%(n)d { cursor: url('cursors/%(n)d.cur'), auto; }
+'''
+
+def make_stylesheet(size, dense):
+    """ Return a stylesheet of about 'size' bytes. One
+    in ten of the rules has a url(...) value, unless dense
+    is True when all of them have """
+
+    rules = ['@import url("base.css");\n@import "print.css" print;\n']
+    n, length = 0, 0
+    while length < size:
+        if dense or n % 10==0:
+            text = urlrule % {'n' : n}
+        else:
+            text = rule % {'n' : n}
+        rules.append(text)
+        length += len(text)
+        n += 1
+
+    return ''.join(rules)
+
+def bench(klass, data, count=5):
+    """ Parse data with an instance of klass 'count' times
+    and return the average time taken and the parser """
+
+    total = 0.0
+    for x in range(count):
+        parser = klass()
+        t1 = time.time()
+        parser.feed(data)
+        total += time.time() - t1
+
+    return total/count, parser
+
+if __name__=="__main__":
+    kb = 1024
+    if len(sys.argv)>1:
+        kb = int(sys.argv[1])
+
+    for dense, name in ((False, 'typical'), (True, 'url-dense')):
+        data = make_stylesheet(kb * 1024, dense)
+        t1, old = bench(OldCSSParser, data)
+        t2, new = bench(HarvestManCSSParser, data)
+        print '%s stylesheet, %d KB: old %.4f seconds (%d links), new %.4f seconds (%d links)' % \
+              (name, len(data)/1024, t1, len(old.links), t2, len(new.links))
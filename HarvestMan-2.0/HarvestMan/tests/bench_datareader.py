@@ -0,0 +1,82 @@
+# -- coding: latin-1
+""" Benchmark for the DataReader class of the connector module.
+
+Downloads a file from a local HTTP server, with the data
+flushed to a temporary file and with the data kept in
+memory. The size of the file in MB can be given as an
+argument, default is 500 MB.
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import sys, os
+import time
+import tempfile
+import threading
+import urllib2
+import BaseHTTPServer
+
+test_base.setUp()
+
+from connector import DataReader
+
+class BenchHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handler which serves 'size' bytes of data for any URL """
+
+    size = 0
+    block = 'x' * 1024 * 1024
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(self.size))
+        self.end_headers()
+
+        sent = 0
+        while sent < self.size:
+            block = self.block[:self.size - sent]
+            self.wfile.write(block)
+            sent += len(block)
+
+    def log_message(self, *args):
+        pass
+
+def bench(url, size, mode):
+    """ Download url with a DataReader in the given mode
+    and return the time taken """
+
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        t1 = time.time()
+        reader = DataReader(urllib2.urlopen(url), url, filename, size, mode)
+        reader.run()
+        if mode==1:
+            assert(len(reader.get_data())==size)
+        t2 = time.time()
+    finally:
+        os.remove(filename)
+
+    assert(reader.get_datalen()==size)
+    return t2 - t1
+
+if __name__=="__main__":
+    mb = 500
+    if len(sys.argv)>1:
+        mb = int(sys.argv[1])
+
+    BenchHandler.size = mb * 1024 * 1024
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), BenchHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+
+    url = 'http://127.0.0.1:%d/bench.bin' % server.server_address[1]
+
+    for mode, name in ((0, 'flush'), (1, 'memory')):
+        elapsed = bench(url, BenchHandler.size, mode)
+        print '%s mode: %d MB in %.2f seconds, %.2f MB/sec' % (name, mb, elapsed, mb/elapsed)
+
+    server.shutdown()
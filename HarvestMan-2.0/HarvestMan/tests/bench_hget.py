@@ -0,0 +1,176 @@
+# -- coding: latin-1
+""" Benchmark for multipart downloads with hget.
+
+Downloads a file in parts from a local HTTP server which
+supports byte-range requests, once with the pieces written
+into a preallocated output file and once with the pieces
+saved to temporary files which are merged at the end. The
+time taken, the peak memory used and the number of blocks
+written by hget are printed for both, and the output file
+is checked for errors.
+
+Then the file is downloaded again with the connection for
+the first piece throttled. Other threads take over the tail
+of the slow piece as they finish, so the download should
+take much less time than the slow piece would take alone.
+
+The size of the file in MB and the number of parts can be
+given as arguments, default is 200 MB in 4 parts.
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import sys, os
+import time
+import shutil
+import tempfile
+import threading
+import socket
+import BaseHTTPServer
+import SocketServer
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class BenchHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handler which serves 'size' bytes of data for any URL,
+    with support for byte-range requests """
+
+    size = 0
+    # Rate in bytes per second for the connection
+    # which downloads the first piece, if not zero
+    slowrate = 0
+    # The byte at offset n is chr(n % 251), so that
+    # pieces written at the wrong place are caught.
+    period = 251
+    pattern = ''.join([chr(x) for x in range(period)]) * (1024*1024/period + 2)
+
+    def do_GET(self):
+        start, end = 0, self.size - 1
+        rangeval = self.headers.get('Range', '')
+        blocksize, delay = 1024*1024, 0
+        if rangeval.startswith('bytes='):
+            first, last = rangeval[6:].split('-')
+            start = int(first)
+            if start==0 and self.slowrate:
+                blocksize = 64*1024
+                delay = float(blocksize)/self.slowrate
+            if last: end = min(int(last), end)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, self.size))
+        else:
+            self.send_response(200)
+
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        pos = start
+        while pos <= end:
+            count = min(blocksize, end - pos + 1)
+            offset = pos % self.period
+            self.wfile.write(self.pattern[offset:offset+count])
+            pos += count
+            if delay: time.sleep(delay)
+
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error, e:
+            # hget closes the first connection once
+            # it has read the headers
+            pass
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error, e:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+def verify(filename, size):
+    """ Return whether filename has the data served by BenchHandler """
+
+    if os.path.getsize(filename) != size:
+        return False
+
+    f = open(filename, 'rb')
+    pos = 0
+    while True:
+        block = f.read(1024*1024)
+        if not block:
+            break
+        offset = pos % BenchHandler.period
+        if block != BenchHandler.pattern[offset:offset+len(block)]:
+            f.close()
+            return False
+        pos += len(block)
+
+    f.close()
+    return True
+
+def bench(url, size, parts, merge):
+    """ Download url with hget and return the time taken,
+    the peak memory in KB and the blocks written """
+
+    outdir = tempfile.mkdtemp()
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hget.py')
+
+    args = [sys.executable, script, '-P', str(parts), '-d', outdir, '-o', 'bench.bin']
+    if merge:
+        args.append('-M')
+    args.append(url)
+
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    stdout = os.dup(1)
+    try:
+        t1 = time.time()
+        # Silence the progress bar
+        os.dup2(devnull, 1)
+        try:
+            pid = os.spawnv(os.P_NOWAIT, sys.executable, args)
+            pid, status, usage = os.wait4(pid, 0)
+        finally:
+            os.dup2(stdout, 1)
+            os.close(devnull)
+            os.close(stdout)
+        t2 = time.time()
+
+        assert(verify(os.path.join(outdir, 'bench.bin'), size))
+    finally:
+        shutil.rmtree(outdir, True)
+
+    return t2 - t1, usage.ru_maxrss, usage.ru_oublock
+
+if __name__=="__main__":
+    mb, parts = 200, 4
+    if len(sys.argv)>1:
+        mb = int(sys.argv[1])
+    if len(sys.argv)>2:
+        parts = int(sys.argv[2])
+
+    BenchHandler.size = mb * 1024 * 1024
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BenchHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+
+    url = 'http://127.0.0.1:%d/bench.bin' % server.server_address[1]
+
+    for merge, name in ((0, 'preallocated'), (1, 'merge')):
+        elapsed, maxrss, blocks = bench(url, BenchHandler.size, parts, merge)
+        print '%s: %d MB in %d parts in %.2f seconds, peak memory %d KB, %d blocks written' % \
+              (name, mb, parts, elapsed, maxrss, blocks)
+
+    # Throttle the first piece so that it takes ten times
+    # as long as the whole file took above
+    BenchHandler.slowrate = BenchHandler.size/parts/(elapsed*10)
+    elapsed, maxrss, blocks = bench(url, BenchHandler.size, parts, 0)
+    print 'throttled: %d MB in %d parts in %.2f seconds, slowest piece alone takes %.2f seconds' % \
+          (mb, parts, elapsed, BenchHandler.size/parts/BenchHandler.slowrate)
+    
+    server.shutdown()
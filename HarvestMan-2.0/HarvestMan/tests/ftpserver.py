@@ -0,0 +1,189 @@
+# -- coding: latin-1
+""" Minimal FTP server for tests, which serves the files
+of a directory to anonymous users in passive mode.
+
+It supports restarting transfers with REST, which can be
+turned off, and can limit the rate of each data connection.
+
+>>> server = FTPServer('/tmp')
+>>> server.start()
+>>> url = 'ftp://127.0.0.1:%d/' % server.port
+>>> server.stop()
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import os
+import time
+import socket
+import threading
+import SocketServer
+
+class FTPRequestHandler(SocketServer.StreamRequestHandler):
+    """ Handler for the control connection of a client """
+
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+
+    def handle(self):
+        self.cwd = '/'
+        self.rest = 0
+        self.pasv = None
+
+        self.reply('220 HarvestMan test FTP server')
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.error, e:
+                break
+            if not line:
+                break
+
+            parts = line.strip().split(' ', 1)
+            cmd, arg = parts[0].upper(), (parts[1:] or [''])[0]
+            self.server.commands.append(cmd)
+
+            method = getattr(self, 'ftp_' + cmd, None)
+            try:
+                if method:
+                    method(arg)
+                else:
+                    self.reply('502 Command not implemented')
+            except socket.error, e:
+                break
+            if cmd == 'QUIT':
+                break
+
+        if self.pasv:
+            self.pasv.close()
+
+    def get_path(self, arg):
+        """ Return the local path of the file or directory 'arg' """
+
+        path = os.path.normpath(os.path.join(self.cwd, arg)).replace('\\', '/')
+        return os.path.join(self.server.root, path.lstrip('/'))
+
+    def ftp_USER(self, arg):
+        self.reply('331 Password required')
+
+    def ftp_PASS(self, arg):
+        self.reply('230 Logged in')
+
+    def ftp_SYST(self, arg):
+        self.reply('215 UNIX Type: L8')
+
+    def ftp_TYPE(self, arg):
+        self.reply('200 Type set to %s' % arg)
+
+    def ftp_PWD(self, arg):
+        self.reply('257 "%s"' % self.cwd)
+
+    def ftp_CWD(self, arg):
+        if os.path.isdir(self.get_path(arg)):
+            self.cwd = os.path.normpath(os.path.join(self.cwd, arg)).replace('\\', '/')
+            self.reply('250 Directory changed')
+        else:
+            self.reply('550 No such directory')
+
+    def ftp_SIZE(self, arg):
+        path = self.get_path(arg)
+        if os.path.isfile(path):
+            self.reply('213 %d' % os.path.getsize(path))
+        else:
+            self.reply('550 No such file')
+
+    def ftp_MDTM(self, arg):
+        path = self.get_path(arg)
+        if os.path.isfile(path):
+            t = time.gmtime(os.path.getmtime(path))
+            self.reply('213 %s' % time.strftime('%Y%m%d%H%M%S', t))
+        else:
+            self.reply('550 No such file')
+
+    def ftp_REST(self, arg):
+        if not self.server.rest:
+            self.reply('502 Command not implemented')
+            return
+        self.rest = int(arg)
+        self.reply('350 Restarting at %d' % self.rest)
+
+    def ftp_PASV(self, arg):
+        if self.pasv:
+            self.pasv.close()
+        self.pasv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.pasv.bind(('127.0.0.1', 0))
+        self.pasv.listen(1)
+        port = self.pasv.getsockname()[1]
+        self.reply('227 Entering Passive Mode (127,0,0,1,%d,%d)' % (port >> 8, port & 0xff))
+
+    def ftp_RETR(self, arg):
+        path = self.get_path(arg)
+        if not os.path.isfile(path):
+            self.reply('550 No such file')
+            return
+        if not self.pasv:
+            self.reply('425 Use PASV first')
+            return
+
+        self.reply('150 Opening BINARY mode data connection')
+        conn, addr = self.pasv.accept()
+        self.pasv.close()
+        self.pasv = None
+
+        f = open(path, 'rb')
+        f.seek(self.rest)
+        self.rest = 0
+
+        rate = self.server.rate
+        try:
+            try:
+                while True:
+                    data = f.read(32*1024)
+                    if not data:
+                        break
+                    conn.sendall(data)
+                    if rate:
+                        time.sleep(float(len(data))/rate)
+            except socket.error, e:
+                # The client stopped reading
+                self.reply('426 Transfer aborted')
+                return
+        finally:
+            f.close()
+            conn.close()
+
+        self.reply('226 Transfer complete')
+
+    def ftp_ABOR(self, arg):
+        self.reply('226 Abort successful')
+
+    def ftp_QUIT(self, arg):
+        self.reply('221 Goodbye')
+
+class FTPServer(SocketServer.ThreadingTCPServer):
+    """ FTP server for the files in the directory 'root' """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, rest=True, rate=0):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FTPRequestHandler)
+        self.root = root
+        # Whether REST is supported
+        self.rest = rest
+        # Bytes per second for each data connection, if not zero
+        self.rate = rate
+        # Commands received, for checking in tests
+        self.commands = []
+        self.port = self.server_address[1]
+
+    def start(self):
+        """ Serve in a thread of its own """
+
+        t = threading.Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,145 @@
+# -- coding: latin-1
+""" Minimal HTTP server for tests, which serves the files
+of a directory and supports byte-range requests,
+conditional requests with entity tags and keep-alive
+connections.
+
+>>> server = HTTPServer('/tmp')
+>>> server.start()
+>>> url = 'http://127.0.0.1:%d/' % server.port
+>>> server.stop()
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import os
+import re
+import md5
+import time
+import socket
+import threading
+import mimetypes
+import SocketServer
+import BaseHTTPServer
+
+class HTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handler for GET and HEAD requests """
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error:
+            # The client closed the connection
+            pass
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def do_HEAD(self):
+        self.do_GET(False)
+
+    def do_GET(self, body=True):
+        self.server.requests.append((self.command, self.path, self.headers.get('Range'),
+                                     self.headers.get('If-None-Match')))
+
+        if self.path in self.server.redirects:
+            code, location = self.server.redirects[self.path]
+            self.send_response(code)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        path = os.path.join(self.server.root, self.path.split('?')[0].lstrip('/'))
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        data = open(path, 'rb').read()
+        etag = '"%s"' % md5.new(data).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start, end = 0, len(data) - 1
+        m = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if m and self.server.ranges:
+            start = int(m.group(1))
+            if m.group(2):
+                end = min(int(m.group(2)), end)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+        else:
+            self.send_response(200)
+
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not body:
+            return
+
+        if start==0 and self.server.slowrate and m:
+            # Throttle the first piece of multipart downloads
+            try:
+                for pos in range(start, end + 1, 4096):
+                    self.wfile.write(data[pos:min(pos + 4096, end + 1)])
+                    time.sleep(4096.0/self.server.slowrate)
+            except socket.error:
+                # The client stopped reading
+                pass
+        else:
+            self.wfile.write(data[start:end+1])
+
+class KeepAliveRequestHandler(HTTPRequestHandler):
+    """ Handler which keeps connections open """
+
+    protocol_version = 'HTTP/1.1'
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ HTTP server for the files in the directory 'root' """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, ranges=True, keepalive=False):
+        handler = HTTPRequestHandler
+        if keepalive:
+            handler = KeepAliveRequestHandler
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.root = root
+        # Whether range requests are supported
+        self.ranges = ranges
+        # Rate in bytes per second for range
+        # requests from the start, if not zero
+        self.slowrate = 0
+        # Requests received as (command, path, range,
+        # if-none-match) tuples, for checking in tests
+        self.requests = []
+        # Redirections as (status, location)
+        # tuples, by path
+        self.redirects = {}
+        self.port = self.server_address[1]
+
+    def start(self):
+        """ Serve in a thread of its own """
+
+        t = threading.Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,73 @@
+# -- coding: latin-1
+""" Unit test for asyncengine module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import time
+import threading
+
+test_base.setUp()
+
+from common.common import GetObject, SetObject
+
+class Downloader(object):
+    """ Downloader which records the threads
+    in which url objects are processed """
+
+    threads = []
+
+    def __init__(self, index, url_obj=None, isThread=True):
+        self._crawlerqueue = None
+
+    def set_url_object(self, obj):
+        self._urlobject = obj[1]
+
+    def process_url(self):
+        self.threads.append(threading.currentThread())
+        self._crawlerqueue.push(self._urlobject, 'crawler')
+
+class TestAsyncEngine(unittest.TestCase):
+    """ Unit test class for HarvestManAsyncEngine """
+
+    import asyncengine, datamgr, rules, connector, urlparser
+
+    def setUp(self):
+        SetObject(self.datamgr.HarvestManDataManager())
+        SetObject(self.rules.HarvestManRulesChecker())
+        SetObject(self.connector.HarvestManNetworkConnector())
+        self.engine = self.asyncengine.HarvestManAsyncEngine(Downloader(0))
+
+    def test_server(self):
+        # Servers are the same as those of the connector factory
+        for url in ('http://www.foo.com:80/bar.html', 'http://WWW.Foo.com/',
+                    'http://www.foo.com:8080/bar.html'):
+            urlobj = self.urlparser.HarvestManUrlParser(url)
+            assert(self.engine.get_server(url)==urlobj.get_domain_with_port())
+
+    def test_fallback(self):
+        urlobj = self.urlparser.HarvestManUrlParser('ftp://ftp.foo.com/bar.bin')
+        self.engine.add_fallback(urlobj)
+        assert(not self.engine.is_exit_condition())
+
+        # The url object is processed in a worker thread
+        for x in range(50):
+            if self.engine._done: break
+            time.sleep(0.1)
+
+        result = self.engine._done.pop(0)
+        assert(Downloader.threads[-1] is not threading.currentThread())
+        assert(result.pushed==[(urlobj, 'crawler')])
+
+        self.engine.handle_result(result)
+        assert(self.engine._numfallbacks==0)
+        # Links pushed by the worker are queued
+        assert(self.engine._queues)
+        self.engine.stop_workers()
+
+if __name__=="__main__":
+    s = unittest.makeSuite(TestAsyncEngine)
+    unittest.TextTestRunner(verbosity=2).run(s)
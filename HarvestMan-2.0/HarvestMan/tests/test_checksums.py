@@ -0,0 +1,111 @@
+# -- coding: latin-1
+""" Unit test for checksums module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import sha
+import tempfile
+
+from cStringIO import StringIO
+
+test_base.setUp()
+
+class TestChecksums(unittest.TestCase):
+    """ Unit test class for verifying data against
+    checksums of files and of their pieces """
+
+    import checksums
+
+    data = ''.join([chr(x % 251) for x in range(10000)])
+    piecelength = 1024
+
+    def get_checksum(self):
+        L = self.piecelength
+        pieces = [sha.new(self.data[x:x+L]).hexdigest() for x in range(0, len(self.data), L)]
+        checksum = self.checksums.HarvestManChecksum('sha1', sha.new(self.data).hexdigest(),
+                                                     'sha1', L, pieces)
+        checksum.length = len(self.data)
+        return checksum
+
+    def test_parse(self):
+        checksum = self.checksums.parse_checksum('SHA1:' + sha.new(self.data).hexdigest().upper())
+        assert(checksum.hashtype=='sha1')
+        assert(checksum.digest==sha.new(self.data).hexdigest())
+
+        # Type known from the length
+        assert(self.checksums.parse_checksum('0'*32).hashtype=='md5')
+        self.assertRaises(self.checksums.HarvestManChecksumError,
+                          self.checksums.parse_checksum, 'md5:' + '0'*40)
+        self.assertRaises(self.checksums.HarvestManChecksumError,
+                          self.checksums.parse_checksum, 'crc32:0a0b0c0d')
+
+    def test_stream(self):
+        checksum = self.get_checksum()
+
+        # Two pieces of a multipart download, the second
+        # one does not start at the start of a piece.
+        data = self.data[:5000] + 'x' + self.data[5001:]
+        verifier = checksum.new_verifier(0)
+        for x in range(0, 4000, 700):
+            verifier.update(data[x:min(x+700, 4000)])
+        verifier = checksum.new_verifier(4000)
+        verifier.update(data[4000:])
+
+        # The first piece of the second part is read again
+        f = StringIO(data)
+        assert(checksum.verify(f)==[4])
+        assert(checksum.get_piece_range(4)==(4096, 5120))
+        assert(checksum.get_piece_range(9)==(9216, 10000))
+
+        checksum.reset_pieces([4])
+        assert(checksum.verify(StringIO(self.data))==[])
+
+    def test_digest(self):
+        checksum = self.checksums.HarvestManChecksum('sha1', sha.new(self.data).hexdigest())
+        checksum.length = len(self.data)
+
+        verifier = checksum.new_verifier(0)
+        verifier.update(self.data)
+        assert(verifier.get_digest()==checksum.digest)
+        assert(checksum.verify(StringIO(''), verifier.get_digest())==[])
+
+        self.assertRaises(self.checksums.HarvestManChecksumError,
+                          checksum.verify, StringIO(self.data[:-1] + 'x'))
+
+    def test_metalink(self):
+        checksum = self.get_checksum()
+        pieces = ''.join(['<hash piece="%d">%s</hash>' % (i, x) for i, x in enumerate(checksum.pieces)])
+
+        fd, filename = tempfile.mkstemp('.metalink')
+        os.write(fd, """<?xml version="1.0" encoding="utf-8"?>
+<metalink version="3.0" xmlns="http://www.metalinker.org/">
+  <files>
+    <file name="foo.bin">
+      <verification>
+        <hash type="md5">%s</hash>
+        <hash type="sha1">%s</hash>
+        <pieces length="%d" type="sha1">%s</pieces>
+      </verification>
+    </file>
+  </files>
+</metalink>
+""" % ('0'*32, checksum.digest, self.piecelength, pieces))
+        os.close(fd)
+
+        try:
+            checksums = self.checksums.load_metalink_checksums(filename)
+        finally:
+            os.remove(filename)
+
+        loaded = checksums['foo.bin']
+        assert(loaded.hashtype=='sha1' and loaded.digest==checksum.digest)
+        assert(loaded.piecelength==self.piecelength)
+        assert(loaded.pieces==checksum.pieces)
+
+if __name__=="__main__":
+    s = unittest.makeSuite(TestChecksums)
+    unittest.TextTestRunner(verbosity=2).run(s)
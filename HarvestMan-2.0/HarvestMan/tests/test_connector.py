@@ -0,0 +1,218 @@
+# -- coding: latin-1
+""" Unit test for connector module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import zlib
+import gzip
+import cStringIO
+import time
+import threading
+
+test_base.setUp()
+
+from common.common import GetObject
+
+class TestDataDecoder(unittest.TestCase):
+    """ Unit test class for DataDecoder class """
+
+    from connector import DataDecoder, DataDecoderException, DataSizeException
+
+    data = 'HarvestMan ' * 10000
+
+    def gzip_data(self, data):
+        f = cStringIO.StringIO()
+        gz = gzip.GzipFile(fileobj=f, mode='wb')
+        gz.write(data)
+        gz.close()
+        return f.getvalue()
+
+    def decode_blocks(self, decoder, data, bs=1024):
+        blocks = []
+        for x in range(0, len(data), bs):
+            blocks.append(decoder.decode(data[x:x+bs]))
+        blocks.append(decoder.flush())
+        return ''.join(blocks)
+
+    def test_gzip(self):
+        d = self.DataDecoder('gzip')
+        compressed = self.gzip_data(self.data)
+        assert(self.decode_blocks(d, compressed)==self.data)
+        assert(d.is_compressed())
+        assert(d.get_sizes()==(len(compressed), len(self.data)))
+
+    def test_deflate(self):
+        d = self.DataDecoder('deflate')
+        assert(self.decode_blocks(d, zlib.compress(self.data))==self.data)
+        # Raw deflate data without zlib header
+        d = self.DataDecoder('deflate')
+        compressed = zlib.compress(self.data)[2:-4]
+        assert(self.decode_blocks(d, compressed)==self.data)
+
+    def test_plain(self):
+        d = self.DataDecoder('plain')
+        assert(self.decode_blocks(d, self.data)==self.data)
+        assert(not d.is_compressed())
+        # Wrongly labelled data is passed through
+        d = self.DataDecoder('gzip')
+        assert(self.decode_blocks(d, self.data)==self.data)
+
+    def test_maxsize(self):
+        # Highly compressed data
+        compressed = self.gzip_data('\0' * 1024 * 1024)
+        d = self.DataDecoder('gzip', 1024*512)
+        self.assertRaises(self.DataSizeException, self.decode_blocks, d, compressed)
+        # Plain data without a length
+        d = self.DataDecoder('plain', 1024*512)
+        self.assertRaises(self.DataSizeException, self.decode_blocks, d, self.data * 10)
+
+    def test_corrupt(self):
+        compressed = self.gzip_data(self.data)
+        # Data after the end of the stream is ignored
+        d = self.DataDecoder('gzip')
+        assert(self.decode_blocks(d, compressed + '\xff' * 4096)==self.data)
+        # Corrupt data is not a size error
+        d = self.DataDecoder('gzip', 1024*512)
+        corrupt = compressed[:-8] + '\xff' * 8
+        try:
+            self.decode_blocks(d, corrupt)
+            assert(False)
+        except self.DataDecoderException, e:
+            assert(not isinstance(e, self.DataSizeException))
+
+class TestConnectorFactory(unittest.TestCase):
+    """ Unit test class for limiting requests with
+    HarvestManUrlConnectorFactory """
+
+    import connector, urlparser
+
+    def setUp(self):
+        cfg = GetObject('config')
+        self.saved = cfg.requests, cfg.maxrequests, cfg.adaptiverequests
+        cfg.requests, cfg.maxrequests, cfg.adaptiverequests = 2, 4, 0
+        self.factory = self.connector.HarvestManUrlConnectorFactory(10)
+
+    def tearDown(self):
+        cfg = GetObject('config')
+        cfg.requests, cfg.maxrequests, cfg.adaptiverequests = self.saved
+
+    def make_urlobj(self, url):
+        return self.urlparser.HarvestManUrlParser(url)
+
+    def test_requests(self):
+        urlobj = self.make_urlobj('http://www.foo.com/a.html')
+        conns = [self.factory.create_connector(urlobj) for x in range(2)]
+        assert(self.factory.get_request_count(urlobj.get_domain_with_port())==2)
+
+        # Other servers are not limited
+        conn = self.factory.create_connector(self.make_urlobj('http://www.bar.com/'))
+        self.factory.remove_connector(conn)
+
+        # A third request to the server waits for one to finish
+        t = threading.Thread(target=self.factory.create_connector, args=(urlobj,))
+        t.setDaemon(True)
+        t.start()
+        t.join(0.5)
+        assert(t.isAlive())
+
+        self.factory.remove_connector(conns.pop())
+        t.join(5.0)
+        assert(not t.isAlive())
+        assert(self.factory.get_request_count(urlobj.get_domain_with_port())==2)
+
+    def test_adaptive(self):
+        GetObject('config').adaptiverequests = 1
+        f = self.factory
+        server = 'www.foo.com'
+
+        # Additive increase, by one for each round of requests
+        f.update_request_limit(server, False)
+        f.update_request_limit(server, False)
+        assert(f.get_request_limit(server)==2)
+        f.update_request_limit(server, False)
+        assert(f.get_request_limit(server)==3)
+        # Up to the maximum
+        for x in range(20):
+            f.update_request_limit(server, False)
+        assert(f.get_request_limit(server)==4)
+
+        # Multiplicative decrease, once in a round trip
+        f.update_request_limit(server, True)
+        assert(f.get_request_limit(server)==2)
+        f.update_request_limit(server, True)
+        assert(f.get_request_limit(server)==2)
+        
+        # Slow responses are a sign of overload
+        f._lastdecrease[server] = 0
+        f.update_request_limit(server, False, 0.2)
+        limit = f.get_request_limit(server)
+        for x in range(5):
+            f.update_request_limit(server, False, 5.0)
+        assert(f.get_request_limit(server)<limit)
+        # Other servers are not affected
+        assert(f.get_request_limit('www.bar.com')==2)
+
+class TestThrottle(unittest.TestCase):
+    """ Unit test class for limiting bandwidth with
+    HarvestManBandwidthThrottle """
+
+    import connector, urlparser
+
+    def test_server(self):
+        # Readers for the same server share its bucket with
+        # the crawler, with or without the default port.
+        throttle = self.connector.HarvestManBandwidthThrottle(0, 1024*1024)
+        for url in ('http://www.foo.com:80/a.bin', 'http://www.foo.com/b.bin'):
+            reader = self.connector.DataReader(cStringIO.StringIO('x' * 4096), url, None, 4096, 1)
+            reader._throttle = throttle
+            while reader._read_block(): pass
+            assert(reader.get_data()=='x' * 4096)
+
+        urlobj = self.urlparser.HarvestManUrlParser('http://www.foo.com/c.bin')
+        assert(throttle._buckets.keys()==[urlobj.get_domain_with_port()])
+
+class Connection:
+    """ Connection which records whether it was closed """
+
+    closed = False
+    
+    def close(self):
+        self.closed = True
+
+class TestConnectionManager(unittest.TestCase):
+    """ Unit test class for the pool of keep-alive connections """
+
+    from common.keepalive import ConnectionManager
+
+    def test_idle(self):
+        cm = self.ConnectionManager(1, 0)
+        conns = [Connection(), Connection()]
+        for c in conns:
+            cm.add('www.foo.com', c, 0)
+        for c in conns:
+            cm.set_ready(c, 1)
+
+        # Only the newest idle connection is kept
+        assert(conns[0].closed and not conns[1].closed)
+        assert(cm.get_ready_conn('www.foo.com') is conns[1])
+        assert(cm.get_stats()['evicted']==1)
+
+    def test_timeout(self):
+        cm = self.ConnectionManager(0, 1)
+        c = Connection()
+        cm.add('www.foo.com', c, 1)
+        time.sleep(1.2)
+        # Connections idle too long are closed
+        assert(cm.get_ready_conn('www.foo.com') is None)
+        assert(c.closed)
+
+if __name__=="__main__":
+    s = unittest.TestSuite((unittest.makeSuite(TestDataDecoder),
+                            unittest.makeSuite(TestConnectorFactory),
+                            unittest.makeSuite(TestThrottle),
+                            unittest.makeSuite(TestConnectionManager)))
+    unittest.TextTestRunner(verbosity=2).run(s)
@@ -0,0 +1,503 @@
+# -- coding: latin-1
+""" Unit test for datamgr module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import time
+import shutil
+import tempfile
+
+from httpserver import HTTPServer
+
+test_base.setUp()
+
+from common.common import GetObject, SetObject
+
+def crawl_links(url, links):
+    """ Crawl the links of the web page at 'url' with
+    HarvestManUrlCrawler, returning the urls pushed """
+
+    import crawler, urlparser, urlcollections, urltypes
+
+    pushed = []
+    class Queue:
+        def push(self, obj, role):
+            pushed.append(obj.get_full_url())
+            return True
+
+    dmgr = GetObject('datamanager')
+    page = urlparser.HarvestManUrlParser(url, urltypes.TYPE_WEBPAGE)
+    page.set_index()
+    dmgr.add_url(page)
+    coll = urlcollections.HarvestManAutoUrlCollection(page)
+    for link in links:
+        urlobj = urlparser.HarvestManUrlParser(link, urltypes.TYPE_WEBPAGE, 0, page)
+        urlobj.set_index()
+        dmgr.add_url(urlobj)
+        coll.addURL(urlobj)
+
+    # Only the checks of the crawler are of interest
+    GetObject('ruleschecker').violates_basic_rules = lambda urlobj: False
+    c = crawler.HarvestManUrlCrawler(0, None, False)
+    c._crawlerqueue = Queue()
+    c.set_url_object((page.priority, coll))
+    c.crawl_url()
+
+    return pushed
+
+class TestDownload(unittest.TestCase):
+    """ Unit test class for downloading urls with
+    HarvestManDataManager """
+
+    import datamgr, rules, connector, urlparser, urltypes
+
+    page = '<html><body><a href="foo.html">foo</a></body></html>'
+    data = ''.join([chr(x % 251) for x in range(409600)])
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name, data in (('index.html', self.page), ('data.bin', self.data)):
+            f = open(os.path.join(self.root, name), 'wb')
+            f.write(data)
+            f.close()
+
+        cfg = GetObject('config')
+        cfg.projdir = tempfile.mkdtemp()
+        cfg.project = 'test'
+        self.maxfilesize = cfg.maxfilesize
+
+        SetObject(self.datamgr.HarvestManDataManager())
+        SetObject(self.rules.HarvestManRulesChecker())
+        SetObject(self.connector.HarvestManNetworkConnector())
+        SetObject(self.connector.HarvestManUrlConnectorFactory(cfg.connections))
+        GetObject('datamanager').initialize()
+
+        self.server = HTTPServer(self.root)
+        self.server.start()
+
+    def tearDown(self):
+        GetObject('config').maxfilesize = self.maxfilesize
+        self.server.stop()
+        shutil.rmtree(self.root, True)
+        shutil.rmtree(GetObject('config').projdir, True)
+
+    def make_urlobj(self, path):
+        url = 'http://127.0.0.1:%d/%s' % (self.server.port, path)
+        return self.urlparser.HarvestManUrlParser(url, self.urltypes.TYPE_ANY, 0, url,
+                                                  GetObject('config').projdir)
+
+    def test_stream(self):
+        # Files which are not parsed are written to
+        # disk in blocks and not kept in memory.
+        urlobj = self.make_urlobj('data.bin')
+        conn = GetObject('connectorfactory').create_connector(urlobj)
+        assert(conn.save_url(urlobj)==1)
+        assert(conn.get_data()=='')
+        # Capabilities of the server are saved
+        info = GetObject('datamanager').get_server_info(urlobj)
+        assert(info['accept-ranges']==1 and info['throughput'] > 0)
+        assert(open(urlobj.get_full_filename(), 'rb').read()==self.data)
+        # No temporary files are left behind
+        files = os.listdir(os.path.dirname(urlobj.get_full_filename()))
+        assert(files==['data.bin'])
+
+        # Web pages are kept in memory for parsing
+        urlobj = self.make_urlobj('index.html')
+        conn = GetObject('connectorfactory').create_connector(urlobj)
+        assert(conn.save_url(urlobj)==1)
+        assert(conn.get_data()==self.page)
+
+    def test_webpage(self):
+        urlobj = self.make_urlobj('index.html')
+        # The data of web pages is returned for parsing
+        data = GetObject('datamanager').download_url(None, urlobj)
+        assert(data==self.page)
+        assert(urlobj.pagehash)
+        assert(open(urlobj.get_full_filename(), 'rb').read()==self.page)
+
+    def test_multipart(self):
+        # The file is larger than the maximum file size, and
+        # so are its pieces, which are not limited by it.
+        GetObject('config').maxfilesize = 100000
+        urlobj = self.make_urlobj('data.bin')
+        conn = GetObject('connectorfactory').create_connector(urlobj)
+        assert(conn.save_url(urlobj)==1)
+        assert(open(urlobj.get_full_filename(), 'rb').read()==self.data)
+        assert(len([x for x in self.server.requests if x[2]])>=4)
+
+    def test_multipart_failed(self):
+        # A failed piece fails the whole download
+        pool = GetObject('datamanager').get_url_threadpool()
+        urlobj = self.make_urlobj('data.bin')
+        urlobj.trymultipart = True
+        urlobj.range = xrange(0, 100000)
+        urlobj.mindex = 0
+
+        class Thread:
+            def get_urlobject(self): return urlobj
+            def get_status(self): return -1
+            def get_error(self): return {'number' : 500}
+            def get_retry_info(self): return ('', 0)
+
+        pool.notify(Thread())
+        assert(pool.get_multipart_download_status(urlobj))
+        assert(pool.get_multipart_download_failed(urlobj))
+
+class TestNotModified(unittest.TestCase):
+    """ Unit test class for revalidating the urls
+    of the project cache of an earlier crawl """
+
+    import datamgr, rules, connector, urlparser, urltypes
+
+    page = '<html><body><a href="foo.html">foo</a></body></html>'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in ('index.html', 'other.html'):
+            f = open(os.path.join(self.root, name), 'wb')
+            f.write(self.page)
+            f.close()
+
+        cfg = GetObject('config')
+        cfg.projdir = tempfile.mkdtemp()
+        cfg.project = 'test'
+
+        SetObject(self.rules.HarvestManRulesChecker())
+        SetObject(self.connector.HarvestManNetworkConnector())
+        SetObject(self.connector.HarvestManUrlConnectorFactory(cfg.connections))
+
+        self.server = HTTPServer(self.root)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.root, True)
+        shutil.rmtree(GetObject('config').projdir, True)
+
+    def start_run(self):
+        dmgr = self.datamgr.HarvestManDataManager()
+        SetObject(dmgr)
+        dmgr.initialize()
+        dmgr.read_project_cache()
+        return dmgr
+
+    def end_run(self, dmgr):
+        dmgr.conditional_cache_set()
+        dmgr._projectcache.close()
+
+    def make_urlobj(self, path):
+        url = 'http://127.0.0.1:%d/%s' % (self.server.port, path)
+        return self.urlparser.HarvestManUrlParser(url, self.urltypes.TYPE_WEBPAGE, 0, url,
+                                                  GetObject('config').projdir)
+
+    def download(self, dmgr, path):
+        """ Download the page at 'path', returning its url object,
+        data and the entity tag of the request """
+
+        urlobj = self.make_urlobj(path)
+        self.server.requests = []
+        data = dmgr.download_url(None, urlobj)
+        return urlobj, data, self.server.requests[0][3]
+
+    def test_notmodified(self):
+        links = [('anchor', 'foo.html')]
+
+        dmgr = self.start_run()
+        for path in ('index.html', 'other.html'):
+            urlobj, data, etag = self.download(dmgr, path)
+            assert(data==self.page and etag is None)
+        self.end_run(dmgr)
+
+        # Without saved links the request is not conditional,
+        # since the page has to be parsed again.
+        dmgr = self.start_run()
+        assert(GetObject('config').cachefound)
+        urlobj, data, etag = self.download(dmgr, 'index.html')
+        assert(data==self.page and etag is None)
+        assert(not urlobj.notmodified)
+        dmgr.update_url_links(urlobj, '', links)
+        self.end_run(dmgr)
+
+        # With saved links a 304 reply crawls them
+        dmgr = self.start_run()
+        urlobj, data, etag = self.download(dmgr, 'index.html')
+        assert(etag and data=='' and urlobj.notmodified)
+        assert(dmgr.get_url_links(urlobj)==('', links))
+
+        # A 304 reply for a page without saved links
+        # is followed by a request which is not.
+        validators = dmgr.get_url_cache_entry(self.make_urlobj('other.html'))['etag']
+        dmgr.get_url_validators = lambda urlobj: (-1, validators)
+        urlobj, data, etag = self.download(dmgr, 'other.html')
+        assert(data==self.page and not urlobj.notmodified)
+        assert([x[3] for x in self.server.requests]==[validators, None])
+        self.end_run(dmgr)
+
+class TestRedirects(unittest.TestCase):
+    """ Unit test class for the cache of redirections
+    of HarvestManDataManager """
+
+    import datamgr, rules, connector, urlparser, urltypes
+
+    page = '<html><body><a href="foo.html">foo</a></body></html>'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        f = open(os.path.join(self.root, 'index.html'), 'wb')
+        f.write(self.page)
+        f.close()
+
+        cfg = GetObject('config')
+        cfg.projdir = tempfile.mkdtemp()
+        cfg.project = 'test'
+
+        SetObject(self.datamgr.HarvestManDataManager())
+        SetObject(self.rules.HarvestManRulesChecker())
+        SetObject(self.connector.HarvestManNetworkConnector())
+        SetObject(self.connector.HarvestManUrlConnectorFactory(cfg.connections))
+        GetObject('datamanager').initialize()
+
+        self.server = HTTPServer(self.root)
+        self.server.start()
+        self.base = 'http://127.0.0.1:%d/' % self.server.port
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.root, True)
+        shutil.rmtree(GetObject('config').projdir, True)
+
+    def make_urlobj(self, url):
+        return self.urlparser.HarvestManUrlParser(url, self.urltypes.TYPE_WEBPAGE, 0, url,
+                                                  GetObject('config').projdir)
+
+    def test_handler(self):
+        dmgr = GetObject('datamanager')
+        self.server.redirects = { '/a.html' : (301, '/index.html'),
+                                  '/b.html' : (302, '/index.html'),
+                                  '/c.html' : (301, '/b.html') }
+
+        # The status of a chain is temporary
+        # if any of its steps is.
+        for path, status in (('a.html', 301), ('b.html', 302), ('c.html', 302)):
+            url = self.base + path
+            urlobj = self.make_urlobj(url)
+            conn = GetObject('connectorfactory').create_connector(urlobj)
+            assert(conn.save_url(urlobj))
+            assert(dmgr.get_redirect(url)==self.base + 'index.html')
+            assert(dmgr._redirects[url]['status']==status)
+
+    def test_apply(self):
+        dmgr = GetObject('datamanager')
+        dmgr.update_redirect('http://www.foo.com/a.html', 'http://www.foo.com/b.html', 301)
+        dmgr.update_redirect('http://www.foo.com/b.html', 'http://www.foo.com/c.html', 302)
+
+        # Chains are followed to their end
+        urlobj = self.urlparser.HarvestManUrlParser('http://www.foo.com/a.html')
+        assert(dmgr.apply_redirect(urlobj))
+        assert(urlobj.get_full_url()=='http://www.foo.com/c.html')
+        urlobj = self.urlparser.HarvestManUrlParser('http://www.foo.com/d.html')
+        assert(not dmgr.apply_redirect(urlobj))
+
+        # But not beyond MAXREDIRECTS steps
+        for x in range(10):
+            dmgr.update_redirect('http://www.bar.com/%d.html' % x,
+                                 'http://www.bar.com/%d.html' % (x + 1), 301)
+        target = 'http://www.bar.com/%d.html' % dmgr.MAXREDIRECTS
+        assert(dmgr.get_redirect('http://www.bar.com/0.html')==target)
+
+        # Nor forever around a cycle
+        dmgr.update_redirect('http://www.baz.com/a.html', 'http://www.baz.com/b.html', 301)
+        dmgr.update_redirect('http://www.baz.com/b.html', 'http://www.baz.com/a.html', 301)
+        assert(dmgr.get_redirect('http://www.baz.com/a.html'))
+
+    def test_cache(self):
+        dmgr = GetObject('datamanager')
+        t = time.time()
+        old = t - dmgr.REDIRECTCACHETIMEOUT - 1
+        redirects = {}
+        for path, status, timestamp in (('a.html', 301, t), ('b.html', 308, t),
+                                        ('c.html', 302, t), ('d.html', 307, t),
+                                        ('e.html', 301, old)):
+            redirects['http://www.foo.com/' + path] = { 'url' : 'http://www.foo.com/',
+                                                        'status' : status,
+                                                        'timestamp' : timestamp }
+        dmgr.read_project_cache()
+        dmgr.conditional_cache_set()
+        dmgr._projectcache.put('_redirects', redirects)
+        dmgr._projectcache.close()
+
+        # Only permanent redirections which are not
+        # too old are used by later runs.
+        dmgr = self.datamgr.HarvestManDataManager()
+        dmgr.read_project_cache()
+        assert(dmgr.get_redirect('http://www.foo.com/a.html'))
+        assert(dmgr.get_redirect('http://www.foo.com/b.html'))
+        for path in ('c.html', 'd.html', 'e.html'):
+            assert(not dmgr.get_redirect('http://www.foo.com/' + path))
+        dmgr._projectcache.close()
+
+    def test_duplicate(self):
+        dmgr = GetObject('datamanager')
+        dmgr.update_redirect('http://www.foo.com/a.html', 'http://www.foo.com/b.html', 301)
+
+        # A link replaced by its target is a
+        # duplicate of a link to the target.
+        pushed = crawl_links('http://www.foo.com/', ('b.html', 'a.html', 'c.html'))
+        assert(pushed==['http://www.foo.com/b.html', 'http://www.foo.com/c.html'])
+
+class TestFailedCache(unittest.TestCase):
+    """ Unit test class for the cache of urls which failed,
+    of HarvestManDataManager """
+
+    import datamgr, rules, urlparser
+
+    def setUp(self):
+        cfg = GetObject('config')
+        self.userdir = cfg.userdir
+        cfg.userdir = tempfile.mkdtemp()
+        cfg.projdir = tempfile.mkdtemp()
+        cfg.project = 'test'
+        SetObject(self.rules.HarvestManRulesChecker())
+
+    def tearDown(self):
+        cfg = GetObject('config')
+        shutil.rmtree(cfg.userdir, True)
+        shutil.rmtree(cfg.projdir, True)
+        cfg.userdir = self.userdir
+
+    def make_dmgr(self):
+        dmgr = self.datamgr.HarvestManDataManager()
+        SetObject(dmgr)
+        dmgr.read_failed_cache()
+        return dmgr
+
+    def test_expiry(self):
+        dmgr = self.make_dmgr()
+        t = time.time()
+        for status, timeout in dmgr.FAILEDCACHETIMEOUTS.items():
+            urlobj = self.urlparser.HarvestManUrlParser('http://www.foo.com/%d.html' % status)
+            dmgr.update_failed_cache(urlobj, status)
+            assert(dmgr.is_failed_url(urlobj))
+            # Skipped for the time given for the status
+            d = dmgr._failedcache[urlobj.get_full_url()]
+            assert(t + timeout <= d['expires'] <= time.time() + timeout)
+
+            # Doubled each time the url fails again
+            dmgr.update_failed_cache(urlobj, status)
+            d = dmgr._failedcache[urlobj.get_full_url()]
+            assert(d['expires'] - d['timestamp']==min(2*timeout, dmgr.MAXFAILEDCACHETIMEOUT))
+
+            # Requested again after that
+            d['expires'] = time.time() - 1
+            assert(not dmgr.is_failed_url(urlobj))
+
+        # Other errors are not saved
+        for status in (401, 403, 408):
+            urlobj = self.urlparser.HarvestManUrlParser('http://www.foo.com/%d.html' % status)
+            dmgr.update_failed_cache(urlobj, status)
+            assert(not dmgr.is_failed_url(urlobj))
+
+    def test_merge(self):
+        urlobj1 = self.urlparser.HarvestManUrlParser('http://www.foo.com/a.html')
+        urlobj2 = self.urlparser.HarvestManUrlParser('http://www.foo.com/b.html')
+        dmgr1 = self.make_dmgr()
+        dmgr2 = self.make_dmgr()
+        dmgr1.update_failed_cache(urlobj1, 404)
+        dmgr2.update_failed_cache(urlobj2, 500)
+
+        # The run which ends last does not lose
+        # the urls saved by other runs
+        dmgr1.write_failed_cache()
+        dmgr2.write_failed_cache()
+        dmgr = self.make_dmgr()
+        assert(dmgr.is_failed_url(urlobj1) and dmgr.is_failed_url(urlobj2))
+
+        # Urls downloaded later are requested again
+        # even if an older run writes the cache last
+        dmgr3 = self.make_dmgr()
+        dmgr3.update_file_stats(urlobj1, 1)
+        assert(not dmgr3.is_failed_url(urlobj1))
+        dmgr3.write_failed_cache()
+        dmgr1.write_failed_cache()
+        dmgr = self.make_dmgr()
+        assert(not dmgr.is_failed_url(urlobj1) and dmgr.is_failed_url(urlobj2))
+
+    def test_crawl(self):
+        dmgr = self.make_dmgr()
+        urlobj = self.urlparser.HarvestManUrlParser('http://www.foo.com/b.html')
+        dmgr.update_failed_cache(urlobj, 404)
+
+        # Links which failed before are skipped
+        pushed = crawl_links('http://www.foo.com/', ('a.html', 'b.html', 'c.html'))
+        assert(pushed==['http://www.foo.com/a.html', 'http://www.foo.com/c.html'])
+
+class TestServerCache(unittest.TestCase):
+    """ Unit test class for the persistent cache of
+    server capabilities """
+
+    import datamgr, urlparser, utils
+
+    def setUp(self):
+        cfg = GetObject('config')
+        self.userdir = cfg.userdir
+        cfg.userdir = tempfile.mkdtemp()
+        self.urlobj = self.urlparser.HarvestManUrlParser('http://www.foo.com/bar.html')
+
+    def tearDown(self):
+        cfg = GetObject('config')
+        shutil.rmtree(cfg.userdir, True)
+        cfg.userdir = self.userdir
+
+    def make_dmgr(self):
+        dmgr = self.datamgr.HarvestManDataManager()
+        dmgr.read_server_cache()
+        return dmgr
+
+    def test_cache(self):
+        dmgr = self.make_dmgr()
+        dmgr.update_server_info(self.urlobj, {'accept-ranges' : 1, 'latency' : 1.0})
+        dmgr.update_server_info(self.urlobj, {'latency' : 2.0})
+        # Latency is smoothed
+        assert(abs(dmgr.get_server_info(self.urlobj)['latency'] - 1.2) < 0.001)
+        dmgr.write_server_cache()
+
+        # Information is read by later runs
+        dmgr = self.make_dmgr()
+        assert(dmgr.supports_range_requests(self.urlobj)==1)
+        # Unless it is too old
+        d = {'accept-ranges' : 1, 'timestamp' : time.time() - dmgr.SERVERCACHETIMEOUT - 1}
+        cachewriter = self.utils.HarvestManCacheReaderWriter(GetObject('config').userdir)
+        cachewriter.write_server_cache({'http://www.bar.com' : d})
+        dmgr = self.make_dmgr()
+        urlobj = self.urlparser.HarvestManUrlParser('http://www.bar.com/')
+        assert(dmgr.supports_range_requests(urlobj)==0)
+        assert(dmgr.supports_range_requests(self.urlobj)==1)
+
+    def test_merge(self):
+        urlobj = self.urlparser.HarvestManUrlParser('http://www.bar.com/')
+        dmgr1 = self.make_dmgr()
+        dmgr2 = self.make_dmgr()
+        dmgr1.update_server_info(self.urlobj, {'accept-ranges' : -1})
+        time.sleep(0.01)
+        dmgr2.update_server_info(self.urlobj, {'accept-ranges' : 1})
+        dmgr2.update_server_info(urlobj, {'accept-ranges' : 1})
+
+        # The run which ends last does not overwrite
+        # newer information saved by other runs
+        dmgr2.write_server_cache()
+        dmgr1.write_server_cache()
+        dmgr = self.make_dmgr()
+        assert(dmgr.supports_range_requests(self.urlobj)==1)
+        assert(dmgr.supports_range_requests(urlobj)==1)
+
+if __name__=="__main__":
+    s = unittest.TestSuite((unittest.makeSuite(TestDownload),
+                            unittest.makeSuite(TestNotModified),
+                            unittest.makeSuite(TestRedirects),
+                            unittest.makeSuite(TestFailedCache),
+                            unittest.makeSuite(TestServerCache)))
+    unittest.TextTestRunner(verbosity=2).run(s)
@@ -0,0 +1,90 @@
+# -- coding: latin-1
+""" Unit test for ftprange module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import shutil
+import tempfile
+import urllib2
+
+from ftpserver import FTPServer
+
+test_base.setUp()
+
+class TestFTPRange(unittest.TestCase):
+    """ Unit test class for byte-range requests
+    to FTP servers using FTPRangeHandler """
+
+    from common.ftprange import FTPRangeHandler
+
+    data = ''.join([chr(x % 251) for x in range(100000)])
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'pub'))
+        f = open(os.path.join(self.root, 'pub', 'data.bin'), 'wb')
+        f.write(self.data)
+        f.close()
+
+        self.opener = urllib2.build_opener(self.FTPRangeHandler)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, True)
+
+    def open(self, server, rangeval=''):
+        request = urllib2.Request('ftp://127.0.0.1:%d/pub/data.bin' % server.port)
+        if rangeval:
+            request.add_header('Range', rangeval)
+        return self.opener.open(request)
+
+    def test_file(self):
+        server = FTPServer(self.root)
+        server.start()
+        try:
+            f = self.open(server)
+            assert(f.info().get('content-length')==str(len(self.data)))
+            assert(f.info().get('accept-ranges')=='bytes')
+            assert(f.info().get('last-modified'))
+            assert(f.read()==self.data)
+            f.close()
+        finally:
+            server.stop()
+
+    def test_range(self):
+        server = FTPServer(self.root)
+        server.start()
+        try:
+            f = self.open(server, 'bytes=1000-1999')
+            assert(f.info().get('content-length')=='1000')
+            assert(f.info().get('content-range')=='bytes 1000-1999/100000')
+            assert(f.read()==self.data[1000:2000])
+            f.close()
+
+            # Open ended range
+            f = self.open(server, 'bytes=99000-')
+            assert(f.read()==self.data[99000:])
+            f.close()
+            assert('REST' in server.commands)
+        finally:
+            server.stop()
+
+    def test_no_rest(self):
+        server = FTPServer(self.root, rest=False)
+        server.start()
+        try:
+            # The whole file is sent
+            f = self.open(server, 'bytes=1000-1999')
+            assert(f.info().get('accept-ranges')==None)
+            assert(f.info().get('content-length')==str(len(self.data)))
+            assert(f.read()==self.data)
+            f.close()
+        finally:
+            server.stop()
+
+if __name__=="__main__":
+    s = unittest.makeSuite(TestFTPRange)
+    unittest.TextTestRunner(verbosity=2).run(s)
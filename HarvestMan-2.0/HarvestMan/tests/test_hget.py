@@ -0,0 +1,209 @@
+# -- coding: latin-1
+""" Unit test for downloads with hget
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import shutil
+import tempfile
+
+from httpserver import HTTPServer
+
+test_base.setUp()
+
+from common.common import GetObject, SetObject
+
+class TestMultipart(unittest.TestCase):
+    """ Base class for unit tests of multipart downloads """
+
+    import datamgr, rules, connector, urlparser
+
+    data = ''.join([chr(x % 251) for x in range(409600)])
+    options = ('nocrawl', 'flushdata', 'hgetoutdir', 'numparts', 'forcesplit', 'multipart')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        f = open(os.path.join(self.root, 'data.bin'), 'wb')
+        f.write(self.data)
+        f.close()
+
+        cfg = GetObject('config')
+        self.saved = [getattr(cfg, x) for x in self.options]
+        cfg.nocrawl, cfg.flushdata, cfg.forcesplit, cfg.numparts = True, True, True, 4
+        cfg.hgetoutdir = tempfile.mkdtemp()
+
+        SetObject(self.datamgr.HarvestManDataManager())
+        SetObject(self.rules.HarvestManRulesChecker())
+        SetObject(self.connector.HarvestManNetworkConnector())
+        SetObject(self.connector.HarvestManUrlConnectorFactory(cfg.connections))
+        GetObject('datamanager').initialize()
+
+        self.server = HTTPServer(self.root, keepalive=True)
+        self.server.start()
+
+    def tearDown(self):
+        cfg = GetObject('config')
+        self.server.stop()
+        shutil.rmtree(self.root, True)
+        shutil.rmtree(cfg.hgetoutdir, True)
+        for x, value in zip(self.options, self.saved):
+            setattr(cfg, x, value)
+        self.connector.DataReader.MULTIPART = False
+
+    def url_to_file(self, name):
+        url = 'http://127.0.0.1:%d/%s' % (self.server.port, name)
+        pool = GetObject('datamanager').get_url_threadpool()
+        conn = self.connector.HarvestManUrlConnector()
+        conn.set_data_mode(pool.get_data_mode())
+        urlobj = self.urlparser.HarvestManUrlParser(url)
+        return conn.url_to_file(urlobj, False), urlobj
+
+class TestSplit(TestMultipart):
+    """ Unit test class for taking over the tail of
+    slow pieces of multipart downloads """
+
+    def test_split(self):
+        # The first piece is slow, so other threads take over
+        # the tail of it once they are done with their own.
+        self.server.slowrate = 100000
+        # Blocks read must not cross the split
+        maxblocksize = self.connector.DataReader.MAXBLOCKSIZE
+        self.connector.DataReader.MAXBLOCKSIZE = 8192
+        pool = GetObject('datamanager').get_url_threadpool()
+        pool.MINSPLITSIZE = 2*8192
+        try:
+            assert(self.url_to_file('data.bin')[0])
+        finally:
+            self.connector.DataReader.MAXBLOCKSIZE = maxblocksize
+
+        filename = os.path.join(GetObject('config').hgetoutdir, 'data.bin')
+        assert(open(filename, 'rb').read()==self.data)
+
+        # Pieces were split off the first one
+        starts = [int(x[2][6:].split('-')[0]) for x in self.server.requests if x[2]]
+        assert([x for x in starts if 0 < x < len(self.data)/4])
+
+        # The connection of the piece which was cut
+        # short is not kept, since it has unread data.
+        stats = GetObject('connector').get_connection_stats()
+        assert(stats['open']==stats['idle'])
+
+class TestMirrors(TestMultipart):
+    """ Unit test class for multipart downloads
+    split across mirrors """
+
+    import mirrors
+
+    def test_nomirrors(self):
+        # The server has mirrors, none of which has
+        # the file, so it is downloaded in one piece.
+        supported, create = self.mirrors.supported_server, self.mirrors.create_multipart_urls
+        self.mirrors.supported_server = lambda urlobj: True
+        self.mirrors.create_multipart_urls = lambda urlobj, clength, numparts: ([], [])
+        try:
+            ret, urlobj = self.url_to_file('data.bin')
+        finally:
+            self.mirrors.supported_server, self.mirrors.create_multipart_urls = supported, create
+
+        assert(ret)
+        assert(not urlobj.trymultipart and not urlobj.partfile)
+        filename = os.path.join(GetObject('config').hgetoutdir, 'data.bin')
+        assert(open(filename, 'rb').read()==self.data)
+        assert(not os.path.exists(filename + '.part'))
+        assert([x for x in self.server.requests if x[0]=='GET' and not x[2]])
+
+class Progress:
+    """ Progress object which shows nothing """
+
+    def getScreenWidth(self):
+        return 80
+
+    def __getattr__(self, name):
+        return lambda *args: None
+    
+class TestBatch(unittest.TestCase):
+    """ Unit test class for batch downloads of hget """
+
+    import datamgr, rules, connector, hget
+
+    files = {'a.bin' : 'a'*5000, 'b.bin' : 'b'*7000, 'sub/a.bin' : 'c'*3000}
+    options = ('nocrawl', 'flushdata', 'hgetoutdir', 'hgetjobs', 'hgetreport',
+               'threadpoolsize', 'nomultipart', 'progressobj')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'sub'))
+        for name, data in self.files.items():
+            f = open(os.path.join(self.root, name), 'wb')
+            f.write(data)
+            f.close()
+
+        cfg = GetObject('config')
+        self.saved = [getattr(cfg, x) for x in self.options]
+        cfg.nocrawl, cfg.flushdata, cfg.nomultipart = True, True, True
+        cfg.hgetjobs, cfg.threadpoolsize = 3, 3
+        cfg.hgetoutdir = tempfile.mkdtemp()
+        cfg.hgetreport = os.path.join(cfg.hgetoutdir, 'report.txt')
+        cfg.progressobj = Progress()
+
+        SetObject(self.datamgr.HarvestManDataManager())
+        SetObject(self.rules.HarvestManRulesChecker())
+        SetObject(self.connector.HarvestManNetworkConnector())
+        SetObject(self.connector.HarvestManUrlConnectorFactory(cfg.connections))
+        GetObject('datamanager').initialize()
+
+        self.server = HTTPServer(self.root)
+        self.server.start()
+
+    def tearDown(self):
+        cfg = GetObject('config')
+        self.server.stop()
+        GetObject('datamanager').get_url_threadpool().end_all_threads()
+        shutil.rmtree(self.root, True)
+        shutil.rmtree(cfg.hgetoutdir, True)
+        for x, value in zip(self.options, self.saved):
+            setattr(cfg, x, value)
+
+    def grab_urls(self, names):
+        h = self.hget.Hget()
+        h._cfg = GetObject('config')
+        h._pool = GetObject('datamanager').get_url_threadpool()
+        urls = ['http://127.0.0.1:%d/%s' % (self.server.port, x) for x in names]
+        h.grab_urls(urls)
+
+        report = {}
+        for line in open(h._cfg.hgetreport).readlines()[1:]:
+            url, status, nbytes, tgap = line.split()
+            report[url.split('/', 3)[-1]] = (status, int(nbytes))
+        return report
+
+    def test_samefile(self):
+        # Both URLs are saved to a.bin, so one of
+        # them has to take a.bin.1 instead, even if
+        # the other file is not written yet.
+        report = self.grab_urls(['a.bin', 'sub/a.bin'])
+        assert(report=={'a.bin' : ('OK', 5000), 'sub/a.bin' : ('OK', 3000)})
+
+        outdir = GetObject('config').hgetoutdir
+        datas = [open(os.path.join(outdir, x), 'rb').read() for x in ('a.bin', 'a.bin.1')]
+        datas.sort()
+        assert(datas==[self.files['a.bin'], self.files['sub/a.bin']])
+
+    def test_report(self):
+        report = self.grab_urls(['a.bin', 'missing.bin', 'b.bin'])
+        assert(report['a.bin']==('OK', 5000))
+        assert(report['b.bin']==('OK', 7000))
+        assert(report['missing.bin']==('FAILED(404)', 0))
+
+        outdir = GetObject('config').hgetoutdir
+        assert(open(os.path.join(outdir, 'b.bin'), 'rb').read()==self.files['b.bin'])
+        assert(not os.path.exists(os.path.join(outdir, 'missing.bin')))
+
+if __name__=="__main__":
+    s = unittest.TestSuite((unittest.makeSuite(TestSplit),
+                            unittest.makeSuite(TestMirrors),
+                            unittest.makeSuite(TestBatch)))
+    unittest.TextTestRunner(verbosity=2).run(s)
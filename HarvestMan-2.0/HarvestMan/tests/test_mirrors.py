@@ -0,0 +1,81 @@
+# -- coding: latin-1
+""" Unit test for mirrors module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import tempfile
+
+test_base.setUp()
+
+class TestMirrors(unittest.TestCase):
+    """ Unit test class for loading mirror lists and
+    splitting downloads across mirrors """
+
+    import mirrors
+    from urlparser import HarvestManUrlParser
+
+    MB = 1024*1024
+
+    metalink = """<?xml version="1.0" encoding="utf-8"?>
+<metalink version="3.0" xmlns="http://www.metalinker.org/">
+  <files>
+    <file name="foo.tar.gz">
+      <resources>
+        <url type="http" preference="100">http://www.foo.com/pub/foo.tar.gz</url>
+        <url type="ftp" preference="90">ftp://ftp.foo.com/pub/foo.tar.gz</url>
+        <url type="http" preference="80">
+          http://mirror.bar.org/foo/foo.tar.gz
+        </url>
+      </resources>
+    </file>
+  </files>
+</metalink>
+"""
+
+    def load(self, data):
+        """ Load mirrors from a file with the given data """
+
+        fd, filename = tempfile.mkstemp()
+        os.write(fd, data)
+        os.close(fd)
+        try:
+            return self.mirrors.load_mirrors(filename)
+        finally:
+            os.remove(filename)
+
+    def test_mirror_list(self):
+        assert(self.load('# Mirrors of foo\nhttp://www.foo.com/pub\n\nhttp://mirror.bar.org/foo/\n')==2)
+
+        urlobj = self.HarvestManUrlParser('http://www.foo.com/pub/foo/foo.tar.gz')
+        assert(self.mirrors.supported_server(urlobj))
+        urls = self.mirrors.get_mirror_urls(urlobj)
+        assert(urls==['http://www.foo.com/pub/foo/foo.tar.gz',
+                      'http://mirror.bar.org/foo/foo/foo.tar.gz'])
+
+        urlobj = self.HarvestManUrlParser('http://www.foo.com/public/foo.tar.gz')
+        assert(not self.mirrors.supported_server(urlobj))
+
+    def test_metalink(self):
+        assert(self.load(self.metalink)==2)
+
+        urlobj = self.HarvestManUrlParser('http://mirror.bar.org/foo/foo.tar.gz')
+        assert(self.mirrors.is_multipart_download_supported(urlobj))
+        assert(self.mirrors.supported_server(urlobj))
+        assert(self.mirrors.get_mirror_urls(urlobj)==['http://www.foo.com/pub/foo.tar.gz',
+                                                      'http://mirror.bar.org/foo/foo.tar.gz'])
+
+    def test_piece_sizes(self):
+        sizes = self.mirrors.get_piece_sizes(10*self.MB + 1, [400.0, 300.0, 100.0])
+        assert(sizes==[5*self.MB, 3*self.MB + self.MB*3/4, self.MB + self.MB/4 + 1])
+
+        # The slowest mirror would get too small a piece
+        sizes = self.mirrors.get_piece_sizes(self.MB, [1000.0, 1000.0, 10.0])
+        assert(sizes==[self.MB/2, self.MB/2])
+
+if __name__=="__main__":
+    s = unittest.makeSuite(TestMirrors)
+    unittest.TextTestRunner(verbosity=2).run(s)
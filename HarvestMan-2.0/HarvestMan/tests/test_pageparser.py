@@ -0,0 +1,74 @@
+# -- coding: latin-1
+""" Unit test for pageparser module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+
+test_base.setUp()
+
+class TestJSParser(unittest.TestCase):
+    """ Unit test class for HarvestManJSParser """
+
+    from pageparser import HarvestManJSParser
+
+    redirects = ('window.location.replace("http://www.foo.com/a.html")',
+                 "location.assign('http://www.foo.com/b.html')",
+                 'window.location.href = "http://www.foo.com/c.html"',
+                 'Location.HREF="http://www.foo.com/d.html"')
+
+    pages = ('<html><body><p>No scripts here</p></body></html>',
+             '<script>document.write("location of the office");</script>',
+             '<a href="location.html">Location</a>')
+
+    def test_redirects(self):
+        # Every statement which redirects passes the pre-scan
+        for statement in self.redirects:
+            parser = self.HarvestManJSParser()
+            parser.process_expression(statement)
+            assert(parser.redirectedurl)
+            page = '<script>\n%s;\n</script>' % statement
+            assert(self.HarvestManJSParser.needs_parsing(page))
+
+    def test_fastpath(self):
+        # Pages without redirect statements skip the parser
+        for page in self.pages:
+            assert(not self.HarvestManJSParser.needs_parsing(page))
+
+class TestCSSParser(unittest.TestCase):
+    """ Unit test class for HarvestManCSSParser """
+
+    from pageparser import HarvestManCSSParser
+
+    css = '''
+    /* url(x.png) @import "x.css"; */
+    @import url('b.css') screen;
+    @IMPORT c.css;
+    @import "d.css" print;
+    p:before { content: "url(y.png)"; }
+    body { background: URL( "bg.png" ) no-repeat; }
+    h1 { background: url(h1.png); }
+    h2 { background: url('h1.png'); }
+    /* an unterminated comment url(z.png) *'''
+
+    def test_parse(self):
+        parser = self.HarvestManCSSParser()
+        parser.feed(self.css)
+
+        # Comments and strings are skipped, links are in
+        # document order and without duplicates
+        assert(parser.links==['b.css', 'c.css', 'd.css', 'bg.png', 'h1.png'])
+        assert(parser.csslinks==['b.css', 'c.css', 'd.css'])
+
+    def test_comments(self):
+        parser = self.HarvestManCSSParser()
+        parser.feed('/** a ***/ a { b: url(a.png) } /*/ url(b.png) */')
+        assert(parser.links==['a.png'])
+
+if __name__=="__main__":
+    s = unittest.TestSuite((unittest.makeSuite(TestJSParser),
+                            unittest.makeSuite(TestCSSParser)))
+    unittest.TextTestRunner(verbosity=2).run(s)
@@ -0,0 +1,104 @@
+# -- coding: latin-1
+""" Unit test for urlqueue module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import time
+import heapq
+import shutil
+import tempfile
+
+test_base.setUp()
+
+from common.common import GetObject, SetObject
+
+class TestRetries(unittest.TestCase):
+    """ Unit test class for retrying failed urls later
+    with HarvestManCrawlerQueue """
+
+    import urlqueue, datamgr, urlparser
+
+    def setUp(self):
+        cfg = GetObject('config')
+        self.saved = cfg.fastmode, cfg.usethreads, cfg.retryfailed
+        cfg.fastmode, cfg.usethreads, cfg.retryfailed = 1, 0, 2
+        cfg.projdir = tempfile.mkdtemp()
+        cfg.project = 'test'
+
+        SetObject(self.datamgr.HarvestManDataManager())
+        GetObject('datamanager').initialize()
+        self.queue = self.urlqueue.HarvestManCrawlerQueue()
+        SetObject(self.queue)
+
+        # Url objects pushed to the queue
+        self.pushed = []
+        self.queue.push = lambda obj, role: self.pushed.append(obj)
+
+    def tearDown(self):
+        cfg = GetObject('config')
+        cfg.fastmode, cfg.usethreads, cfg.retryfailed = self.saved
+        shutil.rmtree(cfg.projdir, True)
+
+    def make_urlobj(self, path):
+        return self.urlparser.HarvestManUrlParser('http://www.foo.com/' + path)
+
+    def test_delay(self):
+        q = self.queue
+        base = q.RETRYDELAYS['timeout']
+        for retries in range(1, 5):
+            # Doubles with each retry, less the jitter
+            maxdelay = base*pow(2, retries-1)
+            for x in range(20):
+                delay = q.get_retry_delay('timeout', retries)
+                assert(maxdelay*0.5 <= delay <= maxdelay)
+
+        # Capped, and at least the delay asked for by the server
+        assert(q.get_retry_delay('server', 20)==q.MAXRETRYDELAY)
+        assert(q.get_retry_delay('error', 1, 30)==30)
+        assert(q.get_retry_delay('error', 1, 1000)==q.MAXRETRYDELAY)
+
+    def test_due(self):
+        q = self.queue
+        urlobjs = [self.make_urlobj('%d.html' % x) for x in range(3)]
+        t = time.time()
+        for urlobj, notbefore in zip(urlobjs, (t - 1, t + 60, t - 2)):
+            heapq.heappush(q._retries, (notbefore, urlobj.index, urlobj))
+
+        # Only urls whose retry is due are pushed, earliest first
+        q.push_retries()
+        assert(self.pushed==[urlobjs[2], urlobjs[0]])
+        assert(len(q._retries)==1)
+        # The crawl does not end while urls are waiting
+        assert(not q.is_exit_condition())
+
+        q._retries = []
+        assert(q.is_exit_condition())
+
+    def test_failed(self):
+        dmgr = GetObject('datamanager')
+        urlobj = self.make_urlobj('foo.html')
+
+        # Scheduled till the number of retries is used up
+        for x in range(2):
+            dmgr.update_failed_files(urlobj, ('timeout', 0))
+            assert(urlobj.retries==x+1)
+            assert(len(self.queue._retries)==x+1)
+
+        dmgr.update_failed_files(urlobj, ('timeout', 0))
+        assert(urlobj.retries==2)
+        assert(len(self.queue._retries)==2)
+        assert(urlobj in dmgr._downloaddict['_failedurls'])
+
+        # Errors which are not temporary are not retried
+        urlobj = self.make_urlobj('bar.html')
+        dmgr.update_failed_files(urlobj, ('', 0))
+        assert(urlobj.retries==0)
+        assert(urlobj in dmgr._downloaddict['_failedurls'])
+
+if __name__=="__main__":
+    s = unittest.makeSuite(TestRetries)
+    unittest.TextTestRunner(verbosity=2).run(s)
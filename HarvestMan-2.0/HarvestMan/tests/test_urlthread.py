@@ -0,0 +1,86 @@
+# -- coding: latin-1
+""" Unit test for urlthread module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+
+test_base.setUp()
+
+from common.common import GetObject
+
+class TestSegments(unittest.TestCase):
+    """ Unit test class for splitting the pieces of
+    multipart downloads in HarvestManUrlThreadPool """
+
+    from urlthread import HarvestManUrlThreadPool
+    from urlparser import HarvestManUrlParser
+
+    MB = 1024*1024
+
+    def setUp(self):
+        # Pieces are only split for hget
+        GetObject('config').nocrawl = True
+
+    def tearDown(self):
+        GetObject('config').nocrawl = False
+
+    def make_pieces(self, pool, sizes):
+        """ Push a piece for each size and return them """
+
+        pieces, prev = [], 0
+        for x in range(len(sizes)):
+            urlobj = self.HarvestManUrlParser('http://www.foo.com/bar.bin')
+            urlobj.trymultipart = True
+            urlobj.range = xrange(prev, prev + sizes[x])
+            urlobj.mindex = x
+            prev += sizes[x]
+            pool.push(urlobj)
+            pieces.append(urlobj)
+
+        return pieces
+
+    def test_update(self):
+        pool = self.HarvestManUrlThreadPool()
+        pieces = self.make_pieces(pool, [5*self.MB, 5*self.MB])
+        assert(pool.update_segment(pieces[0], self.MB)==5*self.MB)
+        assert(pool.update_segment(pieces[1], 2*self.MB)==10*self.MB)
+        # Pushing a piece again does not reset it
+        pool.push(pieces[0])
+        assert(pool.split_segment(pieces[1]).range[0]==3*self.MB)
+
+    def test_split(self):
+        pool = self.HarvestManUrlThreadPool()
+        pieces = self.make_pieces(pool, [5*self.MB, 11*self.MB])
+        # First piece done, second one has 10 MB left
+        pool.update_segment(pieces[0], 5*self.MB)
+        pool.update_segment(pieces[1], self.MB)
+
+        newobj = pool.split_segment(pieces[0])
+        assert(newobj.range[0]==11*self.MB)
+        assert(newobj.range[-1]==16*self.MB - 1)
+        assert(newobj.mindex==2)
+        # The end of the second piece moved back
+        assert(pool.update_segment(pieces[1], 5*self.MB)==11*self.MB)
+        assert(pool.update_segment(newobj, 0)==16*self.MB)
+
+        # The piece with most data left is split next
+        newobj2 = pool.split_segment(pieces[1])
+        assert(newobj2.range[0]==13*self.MB + self.MB/2)
+        assert(newobj2.mindex==3)
+        assert(pool.update_segment(newobj, self.MB)==newobj2.range[0])
+
+        # Pieces with little data left are not split
+        pool.update_segment(newobj2, self.MB)
+        assert(pool.split_segment(pieces[1])==None)
+
+        # Nor the pieces of downloads of the crawler
+        GetObject('config').nocrawl = False
+        assert(pool.split_segment(pieces[0])==None)
+
+if __name__=="__main__":
+    s = unittest.makeSuite(TestSegments)
+    unittest.TextTestRunner(verbosity=2).run(s)
@@ -0,0 +1,215 @@
+# -- coding: latin-1
+""" Unit test for utils module
+
+Copyright (C) 2007, Anand B Pillai.
+"""
+
+import test_base
+import unittest
+import sys, os
+import glob
+import shutil
+import shelve
+import sha
+import time
+import whichdb
+import tempfile
+
+test_base.setUp()
+
+class TestResumeJournal(unittest.TestCase):
+    """ Unit test class for the resume journal of hget """
+
+    from utils import HarvestManResumeJournal
+
+    headers = {'etag' : '"1f2e3d"',
+               'last-modified' : 'Mon, 01 Oct 2007 10:00:00 GMT'}
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def test_ranges(self):
+        journal = self.HarvestManResumeJournal(self.filename)
+        journal.start('http://www.foo.com/bar.bin', self.headers, 1000)
+        journal.add_ranges([(500, 600), (0, 100), (700, 700)])
+        journal.add_ranges([(50, 150), (600, 650)])
+        assert(journal.ranges==[(0, 150), (500, 650)])
+        assert(journal.get_missing_ranges()==[(150, 500), (650, 1000)])
+        assert(journal.get_datalen()==300)
+
+        journal.add_ranges([(150, 500), (650, 1000)])
+        assert(journal.get_missing_ranges()==[])
+
+        journal.remove_ranges([(100, 200), (900, 1000)])
+        assert(journal.get_missing_ranges()==[(100, 200), (900, 1000)])
+
+    def test_read_write(self):
+        journal = self.HarvestManResumeJournal(self.filename)
+        journal.start('http://www.foo.com/bar.bin', self.headers, 1000)
+        journal.datafile = '/tmp/bar.bin.part'
+        journal.add_ranges([(0, 100), (500, 600)])
+        assert(journal.write())
+
+        journal2 = self.HarvestManResumeJournal(self.filename)
+        assert(journal2.read())
+        assert(journal2.url==journal.url)
+        assert(journal2.datafile==journal.datafile)
+        assert(journal2.ranges==journal.ranges)
+        assert(journal2.matches(self.headers, 1000))
+
+        # The file on the server changed
+        assert(not journal2.matches(self.headers, 1001))
+        assert(not journal2.matches({'etag' : '"4c5b6a"'}, 1000))
+
+    def test_damaged(self):
+        journal = self.HarvestManResumeJournal(self.filename)
+        journal.start('http://www.foo.com/bar.bin', self.headers, 1000)
+        journal.add_ranges([(0, 100)])
+        journal.write()
+
+        data = open(self.filename, 'rb').read()
+        open(self.filename, 'wb').write(data.replace('range 0 100', 'range 0 900'))
+        assert(not self.HarvestManResumeJournal(self.filename).read())
+
+        # Truncated
+        open(self.filename, 'wb').write(data[:len(data)/2])
+        assert(not self.HarvestManResumeJournal(self.filename).read())
+
+        journal.remove()
+        assert(not self.HarvestManResumeJournal(self.filename).read())
+
+class TestProjectCache(unittest.TestCase):
+    """ Unit test class for the on-disk project cache """
+
+    from utils import HarvestManProjectCache, HarvestManCacheReaderWriter
+
+    url = 'http://www.foo.com/bar.html'
+    
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir, True)
+
+    def test_lookup(self):
+        cache = self.HarvestManProjectCache(os.path.join(self.cachedir, 'urls.hmc'))
+        cache.put(self.url, {'location' : 'bar.html', 'data' : '<html></html>'})
+        assert(cache.get(self.url)['location']=='bar.html')
+        assert(cache.get('http://www.foo.com/')==None)
+        cache.close()
+
+        cache = self.HarvestManProjectCache(os.path.join(self.cachedir, 'urls.hmc'))
+        # The entry keeps only the hash of the data
+        assert(cache.get(self.url)=={'location' : 'bar.html',
+                                     'datahash' : sha.new('<html></html>').hexdigest()})
+        assert(cache.get_data(self.url)=='<html></html>')
+        cache.close()
+
+    def test_blobs(self):
+        cache = self.HarvestManProjectCache(os.path.join(self.cachedir, 'urls.hmc'))
+        data = '<html>%s</html>' % ('x'*10000)
+        datahash = sha.new(data).hexdigest()
+
+        # The same content is stored once, compressed
+        cache.put(self.url, {'location' : 'bar.html', 'data' : data})
+        cache.put('http://www.foo.com/', {'location' : 'index.html', 'data' : data})
+        cache.flush()
+        files = glob.glob(os.path.join(self.cachedir, 'blobs', '*', datahash))
+        assert(len(files)==1)
+        assert(os.path.getsize(files[0]) < len(data))
+        assert(cache.blobs.get_count(datahash)==2)
+
+        # Updating entries releases their old data
+        cache.put(self.url, {'location' : 'bar.html', 'data' : 'bar'})
+        cache.flush()
+        assert(cache.blobs.get_count(datahash)==1)
+        cache.put('http://www.foo.com/', {'location' : 'index.html'})
+        cache.flush()
+        assert(cache.blobs.get_count(datahash)==0)
+        assert(not os.path.exists(files[0]))
+        assert(cache.get_data(self.url)=='bar')
+        cache.close()
+
+    def test_release(self):
+        cache = self.HarvestManProjectCache(os.path.join(self.cachedir, 'urls.hmc'))
+        cache.put(self.url, {'location' : 'bar.html', 'data' : 'foo'})
+        cache.flush()
+
+        calls = []
+        sync, release = cache._shelf.sync, cache.blobs.release
+        def shelfsync():
+            calls.append('sync')
+            sync()
+        def blobrelease(hash):
+            calls.append('release')
+            release(hash)
+        cache._shelf.sync, cache.blobs.release = shelfsync, blobrelease
+
+        # The old data is released after the entry
+        # which no longer refers to it is on the disk.
+        cache.put(self.url, {'location' : 'bar.html', 'data' : 'bar'})
+        cache.flush()
+        assert(calls==['sync', 'release'])
+        assert(cache.blobs.get_count(sha.new('foo').hexdigest())==0)
+        cache.close()
+
+    def test_batches(self):
+        filename = os.path.join(self.cachedir, 'urls.hmc')
+        cache = self.HarvestManProjectCache(filename)
+        for x in range(cache.BATCHSIZE + 1):
+            cache.put(self.url + str(x), {'location' : str(x)})
+
+        # A batch of entries is written, the last one is pending
+        s = shelve.open(filename, 'r')
+        assert(len(s)==cache.BATCHSIZE)
+        s.close()
+        cache.close()
+
+    def test_writer(self):
+        filename = os.path.join(self.cachedir, 'urls.hmc')
+        cache = self.HarvestManProjectCache(filename)
+        cache.start_writer(60.0, 10)
+        for x in range(10):
+            cache.put(self.url + str(x), {'location' : str(x), 'data' : str(x)})
+        assert(cache.get_data(self.url + '9')=='9')
+
+        # The entries are written by the thread when
+        # enough of them are waiting.
+        count = 0
+        for x in range(50):
+            time.sleep(0.1)
+            if not whichdb.whichdb(filename): continue
+            s = shelve.open(filename, 'r')
+            count = len(s)
+            s.close()
+            if count==10: break
+
+        assert(count==10)
+        assert(cache.get(self.url + '9')['datahash']==sha.new('9').hexdigest())
+        assert(cache.get_data(self.url + '9')=='9')
+        cache.close()
+
+    def test_convert(self):
+        # Cache file of older versions
+        s = shelve.open(os.path.join(self.cachedir, 'cache.hmc'), 'n')
+        s['a1b2'] = {self.url : {'location' : 'bar.html'}}
+        s['_redirects'] = {}
+        s.close()
+
+        cachereader = self.HarvestManCacheReaderWriter(self.cachedir)
+        cache, found = cachereader.read_project_cache()
+        assert(found)
+        assert(cache.get(self.url)=={'location' : 'bar.html'})
+        assert(cache.get('_redirects')=={})
+        cachereader.write_project_cache(cache)
+        assert(not glob.glob(os.path.join(self.cachedir, 'cache.hmc*')))
+
+if __name__=="__main__":
+    s = unittest.TestSuite((unittest.makeSuite(TestResumeJournal),
+                            unittest.makeSuite(TestProjectCache)))
+    unittest.TextTestRunner(verbosity=2).run(s)
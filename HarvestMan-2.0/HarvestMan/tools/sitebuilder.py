@@ -3,9 +3,11 @@
 """Re-create the website on the disk
 for a project, from its cache file.
 
-NOTE: This will work only if the cache file
-has an entry for the actual data for the urls
-of the HarvestMan project.
+NOTE: This will work only if the data of the
+urls of the HarvestMan project was cached, i.e
+if the project was crawled with the data cache
+enabled. The data is read from the blob store of
+the cache by its hash.
 
 Author: Anand B Pillai
 Copyright (C) 2005: Anand B Pillai
@@ -18,10 +20,12 @@ import os
 def build_site(cacheobj):
 
     count=0
-    for d in cacheobj.values():
-        if d.has_key('data'):
+    for d in cacheobj.iterentries():
+        if d.get('datahash'):
             fileloc = d['location']
-            data = d['data']
+            data = cacheobj.blobs.get(d['datahash'])
+            if not data:
+                continue
             try:
                 # If directory does not exist
                 # create it
@@ -31,6 +35,7 @@ def build_site(cacheobj):
                     
                 f=open(fileloc,'wb')
                 f.write(data)
+                f.close()
                 count += 1
                 print 'Re-generated file %s...' % fileloc
             except Exception, e:
@@ -43,18 +48,25 @@ if __name__=="__main__":
     import sys
 
     if len(sys.argv)<2:
-        sys.exit("Usage: %s <HarvestMan cache file>" % sys.argv[0])
+        sys.exit("Usage: %s <HarvestMan cache directory>" % sys.argv[0])
         
     # Pick up modules from parent
     # directory.
     sys.path.append("..")
-    from utils import HarvestManCacheManager
-    from common import Initialize
+    from utils import HarvestManCacheReaderWriter
+    from common.common import InitConfig, InitLogger
+    import config
+    import logger
 
-    Initialize()
+    InitConfig(config.HarvestManStateObject)
+    InitLogger(logger.HarvestManLogger)
     try:
-        cm=HarvestManCacheManager(sys.argv[1])
-        build_site(cm.read_project_cache())
+        cacheobj, found = HarvestManCacheReaderWriter(sys.argv[1]).read_project_cache()
+        if found:
+            build_site(cacheobj)
+        else:
+            print 'Project cache not found in %s.' % sys.argv[1]
+        cacheobj.close()
     except OSError, e:
         print e
     except Exception, e:
@@ -170,6 +170,17 @@ class HarvestManUrlParser(object):
         self.status = 0
         # Fatal status
         self.fatal = False
+        # Number of times the download was tried
+        # again after failing
+        self.retries = 0
+        # Flag set if the server said the url was
+        # not modified since the last crawl
+        self.notmodified = False
+        # Result of a batch download by hget, set
+        # when the download is over. This is a tuple
+        # of the return value of the download, the
+        # bytes downloaded and the time taken.
+        self.hgetresult = None
         # is starting url?
         self.starturl = False
         # Flag for files having extension
@@ -204,6 +215,13 @@ class HarvestManUrlParser(object):
         # This is the content length of the original
         # content.
         self.clength = 0
+        # File preallocated for multi-part
+        # downloads, which the pieces write
+        # into at their offsets.
+        self.partfile = ''
+        # Expected checksum of the data, for
+        # verifying downloads of hget.
+        self.checksum = None
         self.dirpath = []
         # Archive for self.dirpath
         self.dirpathold = []
@@ -219,6 +237,9 @@ class HarvestManUrlParser(object):
         self.baseurl = None
         # Hash of page data
         self.pagehash = ''
+        # Depth of stylesheet @imports
+        # leading to this URL
+        self.importdepth = 0
         # Flag for using old filename
         self.useoldfilename = False
         # Base Url Dictionary
@@ -20,6 +20,8 @@ __version__ = '2.0 b1'
 __author__ = 'Anand B Pillai'
 
 import bisect
+import heapq
+import random
 from Queue import *
 import time
 
@@ -64,9 +66,21 @@ class HarvestManCrawlerQueue(object):
     """ This class functions as the thread safe queue
     for storing url data for tracker threads """
 
+    # Delay in seconds before the first retry of a
+    # failed url for each class of error. The delay
+    # doubles with each retry.
+    RETRYDELAYS = { 'timeout' : 4.0,
+                    'server' : 8.0,
+                    'reset' : 2.0,
+                    'error' : 1.0 }
+    # Maximum delay before a retry
+    MAXRETRYDELAY = 120.0
+    
     def __init__(self):
         self._basetracker = None
         self._controller = None # New in 1.4
+        # Asynchronous download engine
+        self._engine = None
         self._flag = 0
         self._pushes = 0
         self._lockedinst = 0
@@ -96,6 +110,11 @@ class HarvestManCrawlerQueue(object):
             
         # Local buffer - new in 1.4.5
         self.buffer = []
+        # Url objects waiting to be retried, kept as
+        # a heap of (time, index, url object) tuples,
+        # where time is the earliest time for the retry.
+        self._retries = []
+        self._retrylock = threading.Lock()
         # Condition object for exit condition checking
         # loop - to halt exit condition check, acquire this lock
         self._cond = threading.Condition(threading.Lock())
@@ -120,6 +139,7 @@ class HarvestManCrawlerQueue(object):
         d['_lastblockedtime'] = self._lastblockedtime
         d['buffer'] = self.buffer
         d['_baseUrlObj'] = self._baseUrlObj
+        d['_retries'] = self._retries
         
         # For the queues, get their contents
         q1 = self.url_q.queue
@@ -172,6 +192,7 @@ class HarvestManCrawlerQueue(object):
         self._requests = state.get('_requests', 0)
         self._lastblockedtime = state.get('_lastblockedtime', 0)
         self.buffer = state.get('buffer', [])
+        self._retries = state.get('_retries', [])
 
         # Set state for queues
         self.url_q.queue = state.get('url_q', MyDeque())
@@ -243,7 +264,11 @@ class HarvestManCrawlerQueue(object):
 
         self._baseUrlObj.starturl = True
         
-        if self._configobj.fastmode:
+        if self._configobj.asyncmode:
+            # The asynchronous engine uses this object
+            # to save and parse data and crawl links.
+            self._basetracker = crawler.HarvestManUrlDownloader( 0, self._baseUrlObj, False )
+        elif self._configobj.fastmode:
             self._basetracker = crawler.HarvestManUrlFetcher( 0, self._baseUrlObj, True )
         else:
             # Disable usethreads
@@ -267,6 +292,8 @@ class HarvestManCrawlerQueue(object):
         numstops = 3
         
         while 1:
+            self.push_retries()
+            
             if self.is_exit_condition():
                 count += 1
 
@@ -313,6 +340,10 @@ class HarvestManCrawlerQueue(object):
         # Set start time on config object
         self._configobj.starttime = t1
 
+        if self._configobj.asyncmode:
+            self.crawl_async()
+            return
+        
         self.push(self._baseUrlObj, 'crawler')
 
         if self._configobj.fastmode:
@@ -366,6 +397,25 @@ class HarvestManCrawlerQueue(object):
         else:
             self._basetracker.action()
 
+    def crawl_async(self):
+        """ Crawl using the asynchronous engine """
+
+        import asyncengine
+        import datamgr
+
+        # The controller thread takes care of
+        # file and time limits as usual.
+        self._controller = datamgr.HarvestManController()
+        self._controller.start()
+
+        self._engine = asyncengine.HarvestManAsyncEngine(self._basetracker)
+        self._engine.crawl(self._baseUrlObj)
+
+        # Set flag to 1 to denote that downloading is finished.
+        self._flag = 1
+        
+        self.stop_threads(noexit = True)
+        
     def get_base_tracker(self):
         """ Get the base tracker object """
 
@@ -398,6 +448,8 @@ class HarvestManCrawlerQueue(object):
                         continue
                 
         elif role == 'fetcher' or role=='tracker':
+            self.push_retries()
+            
             if blk:
                 obj = self.url_q.get()
             else:
@@ -501,7 +553,8 @@ class HarvestManCrawlerQueue(object):
             
         timediff = currtime - self._lasttimestamp
 
-        is_blocked = self.is_blocked() and len(self.url_q)==0 and len(self.data_q)==0
+        is_blocked = self.is_blocked() and len(self.url_q)==0 and len(self.data_q)==0 \
+                     and len(self._retries)==0
             
         has_running_threads = dmgr.has_download_threads()
         timed_out = False
@@ -654,6 +707,61 @@ class HarvestManCrawlerQueue(object):
         finally:
             self._cond.release()
                 
+    def can_schedule_retries(self):
+        """ Return whether failed urls can be scheduled
+        to be downloaded again later """
+
+        # In single thread mode, there is nobody
+        # to pick up the urls later.
+        return self._configobj.fastmode or self._configobj.asyncmode
+
+    def get_retry_delay(self, retryclass, retries, retryafter=0):
+        """ Return the delay before retry number 'retries' of a
+        url which failed with an error of class 'retryclass' """
+
+        delay = self.RETRYDELAYS.get(retryclass, 1.0) * pow(2, retries-1)
+        # Add jitter, so that urls which failed
+        # together are not retried together.
+        delay = delay * random.uniform(0.5, 1.0)
+        # Respect the delay asked for by the server
+        return min(max(delay, retryafter), self.MAXRETRYDELAY)
+        
+    def schedule_retry(self, urlobj, retryclass, retryafter=0):
+        """ Schedule download of the url object again after a delay.
+        The thread which failed the download is free to do other
+        work in the mean time """
+
+        delay = self.get_retry_delay(retryclass, urlobj.retries, retryafter)
+        moreinfo('Retrying', urlobj.get_full_url(), 'in %.1f seconds...' % delay)
+        
+        notbefore = time.time() + delay
+        if self._engine:
+            self._engine.add_retry(urlobj, notbefore)
+            return
+
+        try:
+            self._retrylock.acquire()
+            heapq.heappush(self._retries, (notbefore, urlobj.index, urlobj))
+        finally:
+            self._retrylock.release()
+
+    def push_retries(self):
+        """ Push url objects whose retry is due to the queue """
+
+        if not self._retries: return
+        
+        t = time.time()
+        urlobjs = []
+        try:
+            self._retrylock.acquire()
+            while self._retries and self._retries[0][0] <= t:
+                urlobjs.append(heapq.heappop(self._retries)[-1])
+        finally:
+            self._retrylock.release()
+
+        for urlobj in urlobjs:
+            self.push(urlobj, 'crawler')
+            
     def push(self, obj, role):
         """ Push trackers to the queue """
 
@@ -738,6 +846,10 @@ class HarvestManCrawlerQueue(object):
 
         # Stop controller thread
         self._controller.stop()
+
+        # Stop asynchronous engine
+        if self._engine:
+            self._engine.stop()
  
         # Kill tracker threads
         self._kill_tracker_threads()
@@ -71,6 +71,8 @@ class HarvestManUrlThread(threading.Thread):
         self._sleepTime = 1.0
         # error dictionary
         self._error = {}
+        # Class of error and delay for retrying
+        self._retryinfo = ('', 0)
         # download status 
         self._downloadstatus = 0
         # busy flag
@@ -81,6 +83,9 @@ class HarvestManUrlThread(threading.Thread):
         self._data = ''
         # Url temp file, used for mode 0
         self._urltmpfile = ''
+        # Piece of a multipart download split off
+        # another piece, to be downloaded next
+        self._splitobject = None
         # Current connector
         self._conn = None
         # initialize threading
@@ -91,6 +96,11 @@ class HarvestManUrlThread(threading.Thread):
 
         return self._error
 
+    def get_retry_info(self):
+        """ Get the retry information of the last download """
+
+        return self._retryinfo
+
     def get_status(self):
         """ Get the download status of this thread """
 
@@ -190,11 +200,13 @@ class HarvestManUrlThread(threading.Thread):
             elif mode == 1:
                 self._data = self._conn.get_data()
 
-        # Add page hash to URL object
-        data = self._conn.get_data()
-        # Update pagehash on the URL object
-        if data: 
-            url_obj.pagehash = sha.new(data).hexdigest()
+        # Add page hash to URL object. The connector
+        # computes it as the data is read.
+        if self._conn.get_digest():
+            url_obj.pagehash = self._conn.get_digest()
+        else:
+            data = self._conn.get_data()
+            if data: url_obj.pagehash = sha.new(data).hexdigest()
             
         # Remove the connector from the factory
         conn_factory.remove_connector(self._conn)
@@ -204,12 +216,18 @@ class HarvestManUrlThread(threading.Thread):
         
         # get error flag from connector
         self._error = self._conn.get_error()
+        self._retryinfo = self._conn.get_retry_info()
 
         self._conn = None
         
         # Notify thread pool
         self._pool.notify(self)
 
+        # Once done with a piece of a multipart download,
+        # take over the tail of the piece with most data left.
+        if url_obj.trymultipart and res==1:
+            self._splitobject = self._pool.split_segment(url_obj)
+
         if res != 0:
             if not url_obj.trymultipart:            
                 extrainfo('Finished download of ', url)
@@ -250,6 +268,12 @@ class HarvestManUrlThread(threading.Thread):
                 # in case the program was terminated
                 # between start of loop and now!
                 if not self._endflag: self.download(url_obj)
+                
+                while self._splitobject and not self._endflag:
+                    url_obj, self._splitobject = self._splitobject, None
+                    self._urlobject = url_obj
+                    self.download(url_obj)
+                    
                 # reset busyflag
                 # print 'Setting busyflag to False',self
                 self._busyflag = False
@@ -355,6 +379,12 @@ class HarvestManUrlThread(threading.Thread):
 class HarvestManUrlThreadPool(Queue):
     """ Thread group/pool class to manage download threads """
 
+    # A piece of a multipart download is split only if
+    # it has more than this many bytes left. This is twice
+    # the largest block a data reader reads at a time, so
+    # that a block being read never crosses the split.
+    MINSPLITSIZE = 2*1024*1024
+    
     def __init__(self):
         """ Initialize this class """
 
@@ -377,8 +407,20 @@ class HarvestManUrlThreadPool(Queue):
         # Status of URLs being downloaded in
         # multipart. Keys are URLs
         self._multipartstatus = {}
+        # Indices of URLs whose multipart download
+        # failed, since a piece of it failed
+        self._multipartfailed = {}
         # Number of parts
         self._parts = self._cfg.numparts
+        # Byte ranges of the pieces of multipart downloads.
+        # Keys are URL indices and values are dictionaries
+        # of [start, position, end] lists keyed on the index
+        # of each piece.
+        self._segments = {}
+        # Lock for the segments. Threads which are stopped
+        # push their pieces back while the condition object
+        # below is held.
+        self._seglock = threading.Lock()
         # Data mode
         # 0 => Flush data
         # 1 => keep data in memory (default)
@@ -491,6 +533,9 @@ class HarvestManUrlThreadPool(Queue):
         except:
             return
 
+        if urlObj.trymultipart:
+            self.add_segment(urlObj)
+            
         # Wait till we have a thread slot free, and push the
         # current url's info when we get one
         try:
@@ -565,8 +610,16 @@ class HarvestManUrlThreadPool(Queue):
 
                         self._multipartdata[index] = infolist
 
+                    # This piece is done
+                    self._seglock.acquire()
+                    segments = self._segments.get(index, {})
+                    if urlObj.mindex in segments:
+                        segment = segments[urlObj.mindex]
+                        segment[1] = segment[2]
+                    self._seglock.release()
+                        
                     # print 'Length of data list is',len(infolist)
-                    if len(infolist)==self._parts:
+                    if len(infolist)==(len(segments) or self._parts):
                         # Sort the data list  according to byte-range
                         infolist.sort()
                         # Download of this URL is complete...
@@ -578,6 +631,13 @@ class HarvestManUrlThreadPool(Queue):
                             pass
 
                         self._multipartstatus[index] = True
+                else:
+                    # The data of the piece is missing, so the
+                    # download fails and is not waited for.
+                    extrainfo('Download of byte range(%d - %d) of %s failed' % (urlObj.range[0], urlObj.range[-1],
+                                                                                urlObj.get_full_url()))
+                    self._multipartfailed[urlObj.index] = True
+                    self._multipartstatus[urlObj.index] = True
 
             # if the thread failed, update failure stats on the data manager
             dmgr = GetObject('datamanager')
@@ -591,11 +651,106 @@ class HarvestManUrlThreadPool(Queue):
                 # thread succeeded, increment file count stats on the data manager
                 dmgr.update_file_stats( urlObj, tstatus)
             else:
-                dmgr.update_failed_files( urlObj )
+                dmgr.update_failed_files( urlObj, thread.get_retry_info() )
+
+        finally:
+            self._cond.release()
+
+    def reset_multipart(self, urlobj):
+        """ Forget the pieces of the multipart download of urlobj,
+        before some of its byte ranges are downloaded again """
+
+        try:
+            self._cond.acquire()
+            self._multipartdata.pop(urlobj.index, None)
+            self._multipartstatus.pop(urlobj.index, None)
+            self._multipartfailed.pop(urlobj.index, None)
 
+            self._seglock.acquire()
+            self._segments.pop(urlobj.index, None)
+            self._seglock.release()
         finally:
             self._cond.release()
+            
+    def add_segment(self, urlobj):
+        """ Add the byte range of a piece of a multipart download """
+
+        try:
+            self._seglock.acquire()
+            segments = self._segments.setdefault(urlobj.index, {})
+            if urlobj.mindex not in segments:
+                start, end = urlobj.range[0], urlobj.range[-1] + 1
+                segments[urlobj.mindex] = [start, start, end]
+        finally:
+            self._seglock.release()
 
+    def update_segment(self, urlobj, datalen):
+        """ Update the amount of data downloaded for a piece of a
+        multipart download. Returns the offset where the piece ends
+        now, which moves back if another thread took over its tail """
+
+        try:
+            self._seglock.acquire()
+            segments = self._segments.get(urlobj.index, {})
+            if urlobj.mindex not in segments:
+                return urlobj.range[-1] + 1
+            
+            segment = segments[urlobj.mindex]
+            segment[1] = segment[0] + datalen
+            return segment[2]
+        finally:
+            self._seglock.release()
+
+    def get_segment_ranges(self, urlobj):
+        """ Return the byte ranges of the multipart download
+        of urlobj which are downloaded, as (start, end) tuples """
+
+        try:
+            self._seglock.acquire()
+            segments = self._segments.get(urlobj.index, {})
+            return [(start, pos) for start, pos, end in segments.values()]
+        finally:
+            self._seglock.release()
+            
+    def split_segment(self, urlobj):
+        """ Split the piece of the multipart download of urlobj
+        which has the most data left, and return a URL object for
+        the second half of it. Returns None if no piece is worth
+        splitting """
+
+        # Only the pieces of hget downloads stop reading
+        # at the current end of their piece.
+        if not self._cfg.nocrawl:
+            return None
+        
+        try:
+            self._seglock.acquire()
+            segments = self._segments.get(urlobj.index, {})
+            
+            mindex, left = -1, 0
+            for idx, (start, pos, end) in segments.items():
+                if end - pos > left:
+                    mindex, left = idx, end - pos
+
+            if left <= self.MINSPLITSIZE:
+                return None
+
+            # The piece keeps the first half of what it has left
+            segment = segments[mindex]
+            end = segment[2]
+            mid = end - left/2
+            segment[2] = mid
+
+            newobj = copy.deepcopy(urlobj)
+            newobj.range = xrange(mid, end)
+            newobj.mindex = len(segments)
+            segments[newobj.mindex] = [mid, mid, end]
+
+            extrainfo('Split byte range (%d - %d) off piece %d of %s' % (mid, end - 1, mindex, urlobj.get_full_url()))
+            return newobj
+        finally:
+            self._seglock.release()
+        
     def has_busy_threads(self):
         """ Return whether I have any busy threads """
 
@@ -645,6 +800,10 @@ class HarvestManUrlThreadPool(Queue):
         has downloaded this url, and copy the file to
         the file location of the new download request """
 
+        # Pieces of a multipart download share the URL
+        if urlobj.trymultipart:
+            return False
+        
         filename = urlobj.get_full_filename()
         url = urlobj.get_full_url()
 
@@ -731,10 +890,17 @@ class HarvestManUrlThreadPool(Queue):
         return self._ltrt
 
     def get_multipart_download_status(self, url):
-        """ Get status of multipart downloads """
+        """ Get status of multipart downloads, which is True
+        once the download is complete or has failed """
 
         return self._multipartstatus.get(url.index, False)
 
+    def get_multipart_download_failed(self, url):
+        """ Return whether a piece of the multipart
+        download of the url failed """
+
+        return self._multipartfailed.get(url.index, False)
+
     def get_multipart_url_data(self, url):
         """ Return data for multipart downloads """
 
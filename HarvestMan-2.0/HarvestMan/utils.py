@@ -25,13 +25,17 @@ __author__ = 'Anand B Pillai'
 
 
 import os
+import sha
+import md5
+import threading as tg
 import cPickle, pickle
 import marshal
 import zlib
 import shelve
+import whichdb
 import glob
 
-from shutil import copy
+from shutil import copy, rmtree
 from common.common import *
 
 HARVESTMAN_XML_HEAD1="""<?xml version=\"1.0\" encoding=\"UTF-8\"?>"""
@@ -250,6 +254,348 @@ class HarvestManSerializer(object):
 
         return obj
 
+class HarvestManBlobStore(object):
+    """ Content addressed store for the data of cached urls.
+    Every distinct content is kept once, compressed with zlib,
+    in a file named by the sha1 hash of the content. The store
+    counts the references to each content, and removes it when
+    the last reference is released """
+
+    def __init__(self, directory):
+        self._dir = directory
+        try:
+            os.makedirs(self._dir)
+        except OSError, e:
+            pass
+        # Reference counts of the contents, by hash
+        self._refs = shelve.open(os.path.join(self._dir, 'refs.hmc'), 'c')
+        self._lock = tg.Lock()
+
+    def _get_path(self, hash):
+        # Spread the files over sub-directories by the
+        # first two digits of the hash.
+        return os.path.join(self._dir, hash[:2], hash)
+
+    def add(self, data):
+        """ Add a reference to the content 'data', storing it
+        if it is not in the store. Returns the hash of the content """
+
+        hash = sha.new(data).hexdigest()
+        try:
+            self._lock.acquire()
+            count = self._refs.get(hash, 0)
+            path = self._get_path(hash)
+            if count==0 or not os.path.isfile(path):
+                dname = os.path.dirname(path)
+                if not os.path.isdir(dname):
+                    os.makedirs(dname)
+                # Write to a temporary file first, so that
+                # a partly written file is never read.
+                f = open(path + '.tmp', 'wb')
+                f.write(zlib.compress(data))
+                f.close()
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(path + '.tmp', path)
+
+            self._refs[hash] = count + 1
+        finally:
+            self._lock.release()
+
+        return hash
+
+    def get(self, hash):
+        """ Return the content with the given hash, or an
+        empty string if it is not in the store """
+
+        try:
+            f = open(self._get_path(hash), 'rb')
+        except IOError, e:
+            return ''
+
+        try:
+            try:
+                return zlib.decompress(f.read())
+            except zlib.error, e:
+                debug('Corrupt cache data %s: %s' % (hash, e))
+                return ''
+        finally:
+            f.close()
+
+    def release(self, hash):
+        """ Release a reference to the content with the given
+        hash, removing the content if it is not referred to """
+
+        try:
+            self._lock.acquire()
+            count = self._refs.get(hash, 0) - 1
+            if count > 0:
+                self._refs[hash] = count
+                return
+
+            if self._refs.has_key(hash):
+                del self._refs[hash]
+            try:
+                os.remove(self._get_path(hash))
+            except OSError, e:
+                debug(str(e))
+        finally:
+            self._lock.release()
+
+    def get_count(self, hash):
+        """ Return the number of references to the content
+        with the given hash """
+
+        try:
+            self._lock.acquire()
+            return self._refs.get(hash, 0)
+        finally:
+            self._lock.release()
+
+    def sync(self):
+        try:
+            self._lock.acquire()
+            self._refs.sync()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        try:
+            self._lock.acquire()
+            self._refs.close()
+        finally:
+            self._lock.release()
+
+class HarvestManCacheWriter(tg.Thread):
+    """ Thread which writes the updated entries of a project
+    cache to the disk in the background, every 'interval'
+    seconds or when 'count' updated entries are waiting """
+
+    def __init__(self, cache, interval, count):
+        self._cache = cache
+        self._interval = interval
+        self.count = count
+        self._evt = tg.Event()
+        self._exitflag = False
+        tg.Thread.__init__(self, None, None, 'cache writer')
+        self.setDaemon(True)
+
+    def notify(self):
+        """ Wake up the thread to write the entries """
+
+        self._evt.set()
+
+    def run(self):
+
+        while not self._exitflag:
+            self._evt.wait(self._interval)
+            self._evt.clear()
+            if self._exitflag:
+                break
+
+            try:
+                self._cache.flush()
+            except Exception, e:
+                debug('Error writing project cache', e)
+
+    def stop(self):
+        """ Stop this thread """
+
+        self._exitflag = True
+        self._evt.set()
+        self.join()
+
+class HarvestManProjectCache(object):
+    """ On-disk cache of the urls of a project. This is a shelf
+    of cache entries keyed by the md5 hash of the url. Entries are
+    read from the disk when they are looked up, and updated entries
+    are written in batches, by a writer thread if one is started.
+    The data of an entry is kept in a blob store in the directory
+    'blobs' next to the shelf, and the entry keeps only its hash
+    as 'datahash' """
+
+    # Number of updated entries written at a time
+    # if there is no writer thread
+    BATCHSIZE = 500
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._shelf = shelve.open(filename, 'c', pickle.HIGHEST_PROTOCOL)
+        self.blobs = HarvestManBlobStore(os.path.join(os.path.dirname(filename), 'blobs'))
+        # Entries updated since the last write, by key
+        self._pending = {}
+        # Entries being written
+        self._writing = {}
+        self._writer = None
+        # Lock for the updated entries, which is
+        # never held while writing to the disk.
+        self._lock = tg.Lock()
+        # Lock for the shelf, and for writing
+        self._shelflock = tg.Lock()
+        self._writelock = tg.Lock()
+
+    def _get_key(self, url):
+        return md5.new(url).hexdigest()
+
+    def start_writer(self, interval, count):
+        """ Write the updated entries in a thread of their own,
+        every 'interval' seconds or when 'count' are waiting """
+
+        if self._writer is None:
+            self._writer = HarvestManCacheWriter(self, interval, count)
+            self._writer.start()
+
+    def get(self, url, default=None):
+        """ Return a copy of the cache entry of the url. The entry
+        has a key named 'data' if its data is not yet written, else
+        the data is read by get_data. Changes to the entry are saved
+        by calling put """
+
+        key = self._get_key(url)
+        try:
+            self._lock.acquire()
+            entry = self._pending.get(key) or self._writing.get(key)
+        finally:
+            self._lock.release()
+
+        if entry is not None:
+            return entry.copy()
+
+        try:
+            self._shelflock.acquire()
+            return self._shelf.get(key, default)
+        finally:
+            self._shelflock.release()
+
+    def get_data(self, url):
+        """ Return the data in the cache entry of the url """
+
+        entry = self.get(url)
+        if entry is None:
+            return ''
+        elif entry.has_key('data'):
+            return entry['data']
+        elif entry.get('datahash'):
+            return self.blobs.get(entry['datahash'])
+        return ''
+
+    def put(self, url, entry):
+        """ Save the cache entry of the url. If the entry has a
+        key named 'data', the data is moved to the blob store
+        when the entry is written """
+
+        key = self._get_key(url)
+        try:
+            self._lock.acquire()
+            self._pending[key] = entry.copy()
+            count = len(self._pending)
+        finally:
+            self._lock.release()
+
+        if self._writer:
+            if count >= self._writer.count:
+                self._writer.notify()
+        elif count >= self.BATCHSIZE:
+            self.flush()
+
+    def iterentries(self):
+        """ Iterate over the cache entries of the urls """
+
+        self.flush()
+        try:
+            self._shelflock.acquire()
+            keys = self._shelf.keys()
+        finally:
+            self._shelflock.release()
+
+        for key in keys:
+            try:
+                self._shelflock.acquire()
+                entry = self._shelf.get(key)
+            finally:
+                self._shelflock.release()
+            if type(entry) is dict and entry.has_key('location'):
+                yield entry
+
+    def _write(self, key, entry):
+        """ Write the entry with the given key to the shelf. Returns
+        the hash of the data the entry no longer refers to, which
+        is released once the shelf is synced """
+
+        added = False
+        if entry.has_key('data'):
+            entry['datahash'] = self.blobs.add(entry.pop('data'))
+            added = True
+
+        try:
+            self._shelflock.acquire()
+            old = self._shelf.get(key) or {}
+            self._shelf[key] = entry
+        finally:
+            self._shelflock.release()
+
+        # The entry held a reference to its old data
+        oldhash = old.get('datahash')
+        if oldhash and (added or entry.get('datahash') != oldhash):
+            return oldhash
+
+    def flush(self):
+        """ Write the updated entries to the disk """
+
+        try:
+            self._writelock.acquire()
+            try:
+                self._lock.acquire()
+                self._writing, self._pending = self._pending, {}
+            finally:
+                self._lock.release()
+
+            if not self._writing:
+                return
+
+            # Copies of the entries are written, as the
+            # entries are still looked up while writing.
+            oldhashes = []
+            for key, entry in self._writing.items():
+                oldhash = self._write(key, entry.copy())
+                if oldhash:
+                    oldhashes.append(oldhash)
+
+            try:
+                self._shelflock.acquire()
+                self._shelf.sync()
+            finally:
+                self._shelflock.release()
+
+            # Old data is only removed once no entry on
+            # the disk refers to it, so that the cache
+            # is never left with entries without data.
+            for oldhash in oldhashes:
+                self.blobs.release(oldhash)
+            self.blobs.sync()
+            try:
+                self._lock.acquire()
+                self._writing = {}
+            finally:
+                self._lock.release()
+        finally:
+            self._writelock.release()
+
+    def close(self):
+        """ Write the updated entries and close the cache """
+
+        if self._writer:
+            self._writer.stop()
+            self._writer = None
+
+        self.flush()
+        try:
+            self._shelflock.acquire()
+            self._shelf.close()
+            self.blobs.close()
+        finally:
+            self._shelflock.release()
+
 class HarvestManCacheReaderWriter(object):
     """ Utility class to read/write different cache files for HarvestMan """
 
@@ -272,50 +618,155 @@ class HarvestManCacheReaderWriter(object):
             debug('OS Exception ', e)
 
         # Create cache directory if it does not exist
-        self._cachefilename = os.path.join(self._cachedir, 'cache.hmc')
+        self._cachefilename = os.path.join(self._cachedir, 'urls.hmc')
+        # Cache file of older versions, which was
+        # read into memory as a whole.
+        self._oldcachefilename = os.path.join(self._cachedir, 'cache.hmc')
+        self._servercachefilename = os.path.join(self._cachedir, 'servers.hmc')
+        self._failedcachefilename = os.path.join(self._cachedir, 'failed.hmc')
         
     def read_project_cache(self):
-        """ Try to read the project cache file """
-
-        found = False
+        """ Open the project cache file, creating it if it does not
+        exist. Returns the cache object and whether the cache was found """
 
         # Get cache filename
         if not os.path.exists(self._cachedir):
             moreinfo("Project cache not found")
 
-        cfg = GetObject('config')
+        # Depending on the dbm module, the shelf may be
+        # kept in files with extensions added to the name.
+        found = bool(whichdb.whichdb(self._cachefilename))
 
-        cachefilename = self._cachefilename
-        cache_obj = None
-        
-        if os.path.isfile(cachefilename):
-            try:
-                cache_obj = shelve.open(cachefilename)
-                found = True
-            except Exception, e:
-                logconsole(e)
+        try:
+            cacheobj = HarvestManProjectCache(self._cachefilename)
+        except Exception, e:
+            logconsole(e)
+            # Start afresh with a new cache file
+            for f in glob.glob(self._cachefilename + '*'):
+                os.remove(f)
+            # The data of the entries is lost with them
+            rmtree(os.path.join(self._cachedir, 'blobs'), True)
+            cacheobj = HarvestManProjectCache(self._cachefilename)
+            found = False
+
+        if not found and whichdb.whichdb(self._oldcachefilename):
+            found = self.convert_project_cache(cacheobj)
 
-        # Create a new shelf with the same values
-        # cache_obj2 = MyShelf(cachefilename, 'n', pickle.HIGHEST_PROTOCOL)
-        cache_obj2 = {}
-        # shelve.open(cachefilename, 'n')
-        # Copy from cache_obj to cache_obj2
-        if cache_obj:
-            for key, value in cache_obj.iteritems():
-                cache_obj2[key] = value.copy()
+        return (cacheobj, found)
+
+    def convert_project_cache(self, cacheobj):
+        """ Copy the entries of the cache file of older versions,
+        which are grouped by domain, to the cache object and remove
+        the old file. Returns True if the old cache was read """
+
+        moreinfo('Converting project cache to new format...')
+        try:
+            s = shelve.open(self._oldcachefilename, 'r')
+            for key, value in s.iteritems():
+                if key == '_redirects':
+                    cacheobj.put(key, value)
+                else:
+                    for url, entry in value.iteritems():
+                        cacheobj.put(url, entry)
+            s.close()
+        except Exception, e:
+            logconsole(e)
+            return False
 
-            cache_obj.close()
+        cacheobj.flush()
+        for f in glob.glob(self._oldcachefilename + '*'):
+            try:
+                os.remove(f)
+            except OSError, e:
+                debug(str(e))
 
-        return (cache_obj2, found)
+        return True
 
     def write_project_cache(self, cacheobj):
         """ Commit the project cache to the disk """
 
-        s = shelve.open(self._cachefilename, 'n')
-        for key, value in cacheobj.iteritems():
-            s[key] = value.copy()
+        cacheobj.close()
+        
+    def read_server_cache(self):
+        """ Read the server cache file """
+
+        serversdict = {}
+
+        try:
+            s = shelve.open(self._servercachefilename, 'r')
+            for key, value in s.iteritems():
+                serversdict[key] = value.copy()
+            s.close()
+        except Exception, e:
+            debug(str(e))
+
+        return serversdict
+
+    def write_server_cache(self, serversdict):
+        """ Commit the server cache to the disk, merging it
+        with the entries saved by other runs """
+
+        try:
+            s = shelve.open(self._servercachefilename, 'c')
+            for key, value in serversdict.iteritems():
+                # Keep entries which another run saved later
+                if s.has_key(key) and \
+                   s[key].get('timestamp', 0) > value.get('timestamp', 0):
+                    continue
+                s[key] = value.copy()
+            s.close()
+        except Exception, e:
+            debug(str(e))
+        
+    def read_failed_cache(self):
+        """ Read the cache file of failed urls """
+
+        failedurls = {}
 
-        s.close()
+        if not whichdb.whichdb(self._failedcachefilename):
+            return failedurls
+        
+        try:
+            s = shelve.open(self._failedcachefilename, 'r')
+            for key, value in s.iteritems():
+                failedurls[key] = value.copy()
+            s.close()
+        except Exception, e:
+            debug(str(e))
+
+        return failedurls
+
+    def write_failed_cache(self, failedurls, cutoff=0):
+        """ Commit the cache of failed urls to the disk, merging it
+        with the entries saved by other runs. Entries which expired
+        before the time 'cutoff' are removed """
+
+        try:
+            s = shelve.open(self._failedcachefilename, 'c')
+            for key, value in failedurls.iteritems():
+                key = str(key)
+                # Keep entries which another run saved later
+                if s.has_key(key) and \
+                   s[key].get('timestamp', 0) > value.get('timestamp', 0):
+                    continue
+                s[key] = value.copy()
+            for key in s.keys():
+                if s[key].get('expires', 0) < cutoff:
+                    del s[key]
+            s.close()
+        except Exception, e:
+            debug(str(e))
+
+    def purge_failed_cache(self):
+        """ Remove the cache file of failed urls """
+
+        # Depending on the dbm module, the shelf may be
+        # kept in files with extensions added to the name.
+        for f in glob.glob(self._failedcachefilename + '*'):
+            try:
+                os.remove(f)
+            except OSError, e:
+                debug(str(e))
         
     def write_url_headers(self, headerdict):
 
@@ -328,6 +779,177 @@ class HarvestManCacheReaderWriter(object):
 
         return 0
     
+class HarvestManResumeJournal(object):
+    """ Journal of an unfinished hget download, which records the
+    URL, the validators and length of the file on the server, the
+    file the data is written to and the byte ranges of the file
+    which are downloaded. It is kept as lines of text followed by
+    a checksum of them, so that a damaged journal is not used. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.url = ''
+        self.etag = ''
+        self.lastmodified = ''
+        self.length = 0
+        self.datafile = ''
+        # Downloaded byte ranges as sorted, non
+        # overlapping (start, end) tuples, end is
+        # not included.
+        self.ranges = []
+
+    def start(self, url, headers, length):
+        """ Start a journal for a new download of the url with
+        the given response headers and content length """
+
+        self.url = url
+        self.etag = headers.get('etag', '')
+        self.lastmodified = headers.get('last-modified', '')
+        self.length = length
+        self.ranges = []
+
+    def matches(self, headers, length):
+        """ Check whether the file on the server, which has the
+        given response headers and content length, is the file
+        of the journal """
+
+        if length != self.length:
+            return False
+        
+        for key, value in (('etag', self.etag), ('last-modified', self.lastmodified)):
+            if value and headers.get(key, '') != value:
+                return False
+
+        return True
+
+    def add_ranges(self, ranges):
+        """ Add the given byte ranges to the downloaded ranges """
+
+        allranges = [r for r in self.ranges + ranges if r[1] > r[0]]
+        allranges.sort()
+
+        self.ranges = []
+        for start, end in allranges:
+            if self.ranges and start <= self.ranges[-1][1]:
+                if end > self.ranges[-1][1]:
+                    self.ranges[-1] = (self.ranges[-1][0], end)
+            else:
+                self.ranges.append((start, end))
+
+    def remove_ranges(self, ranges):
+        """ Remove the given byte ranges from the downloaded
+        ranges, so that they are downloaded again """
+
+        for rstart, rend in ranges:
+            left = []
+            for start, end in self.ranges:
+                if rend <= start or rstart >= end:
+                    left.append((start, end))
+                    continue
+                if start < rstart:
+                    left.append((start, rstart))
+                if rend < end:
+                    left.append((rend, end))
+            self.ranges = left
+
+    def get_missing_ranges(self):
+        """ Return the byte ranges which are yet to be downloaded """
+
+        missing, prev = [], 0
+        for start, end in self.ranges:
+            if start > prev:
+                missing.append((prev, start))
+            prev = end
+
+        if prev < self.length:
+            missing.append((prev, self.length))
+
+        return missing
+
+    def get_datalen(self):
+        """ Return the number of bytes downloaded """
+
+        return sum([end - start for start, end in self.ranges])
+
+    def read(self):
+        """ Read the journal file. Returns True if the journal
+        was read and False if there is none or it is damaged """
+
+        try:
+            lines = open(self.filename, 'rb').read().split('\n')
+        except (IOError, OSError), e:
+            return False
+
+        try:
+            # The last line is empty
+            key, digest = lines[-2].split(' ', 1)
+            body = '\n'.join(lines[:-2]) + '\n'
+            if key != 'sha' or sha.new(body).hexdigest() != digest:
+                return False
+
+            ranges = []
+            for line in lines[:-2]:
+                key, value = line.split(' ', 1)
+                if key == 'url':
+                    self.url = value
+                elif key == 'etag':
+                    self.etag = value
+                elif key == 'lastmodified':
+                    self.lastmodified = value
+                elif key == 'length':
+                    self.length = int(value)
+                elif key == 'datafile':
+                    self.datafile = value
+                elif key == 'range':
+                    start, end = value.split()
+                    ranges.append((int(start), int(end)))
+        except (IndexError, ValueError), e:
+            return False
+
+        self.ranges = []
+        self.add_ranges(ranges)
+        return True
+
+    def write(self):
+        """ Write the journal file. The journal is written to a new
+        file which then replaces the old one, so that an interrupted
+        write does not leave a damaged journal. Returns True if the
+        journal was written and False otherwise """
+
+        lines = ['url ' + self.url,
+                 'etag ' + self.etag,
+                 'lastmodified ' + self.lastmodified,
+                 'length %d' % self.length,
+                 'datafile ' + self.datafile]
+        lines += ['range %d %d' % r for r in self.ranges]
+        body = '\n'.join(lines) + '\n'
+
+        tmpname = self.filename + '.new'
+        try:
+            f = open(tmpname, 'wb')
+            f.write(body + 'sha %s\n' % sha.new(body).hexdigest())
+            f.close()
+            try:
+                os.rename(tmpname, self.filename)
+            except OSError, e:
+                # Renaming over a file fails on Windows
+                os.remove(self.filename)
+                os.rename(tmpname, self.filename)
+        except (IOError, OSError), e:
+            debug('Error writing journal', self.filename, e)
+            return False
+
+        return True
+
+    def remove(self):
+        """ Remove the journal file """
+
+        if os.path.isfile(self.filename):
+            try:
+                os.remove(self.filename)
+            except OSError, e:
+                debug('Error removing journal', self.filename, e)
+        
 class HarvestManProjectManager(object):
     """ Utility class to read/write project files """
 